@@ -0,0 +1,427 @@
+import hashlib
+import json
+import os
+import re
+import string
+import time
+from contextlib import ExitStack
+
+from generation_engine import estimate_tokens
+from model_registry import model_registry
+from openai_client import get_openai_client
+
+TOKEN_PATTERN = re.compile(r'\s*\S+|\s+')
+
+
+class GPT4AllBackend:
+    """
+    Generates text with a local gpt4all model shared through the model registry.
+    The model runs one generation at a time.
+    Once a session preamble is set, prompts run in a persistent chat session, so the
+    preamble and the earlier exchanges stay in the model's context and are not evaluated
+    again. The session is restarted when the context budget would be exceeded.
+    """
+
+    name = 'gpt4all'
+    concurrent = False
+
+    def __init__(self, model_name, context_budget=None, completion_reserve=None):
+        """
+        Initialize the GPT4AllBackend and load the model.
+
+        Args:
+            model_name (str): The name of the gpt4all model.
+            context_budget (int): The estimated number of tokens a chat session may hold, at most
+                the context window of the model. Defaults to AUTOPYWIZARD_CONTEXT_TOKENS, or 2048.
+            completion_reserve (int): The most tokens the session keeps free for a completion,
+                so a packed prompt with a large completion limit does not restart it on every
+                call. Defaults to AUTOPYWIZARD_COMPLETION_RESERVE_TOKENS, or a quarter of the
+                context budget.
+        """
+        self.model_name = model_name
+        self.context_budget = context_budget or int(os.environ.get('AUTOPYWIZARD_CONTEXT_TOKENS', '2048'))
+        self.completion_reserve = completion_reserve or int(
+            os.environ.get('AUTOPYWIZARD_COMPLETION_RESERVE_TOKENS', self.context_budget // 4)
+        )
+        self.preamble = None
+        # Models are shared through the process-wide registry, so building several
+        # backends does not load the weights again.
+        model_registry.get_model(model_name)
+
+    @property
+    def model(self):
+        """
+        The shared gpt4all model instance from the model registry.
+        """
+        return model_registry.get_model(self.model_name)
+
+    def generation_params(self, max_tokens):
+        """
+        Return the generation parameters that affect the model output.
+
+        Args:
+            max_tokens (int): The completion token limit of the caller.
+
+        Returns:
+            dict: The generation parameters.
+        """
+        params = {'max_tokens': max_tokens}
+        # Answers in a session depend on its preamble
+        if self.preamble is not None:
+            params['preamble'] = self.preamble
+        return params
+
+    def start_session(self, preamble):
+        """
+        Run the following prompts in a chat session that starts with a shared preamble,
+        e.g. the project description.
+
+        Args:
+            preamble (str): The system prompt of the session.
+        """
+        self.preamble = preamble
+
+    def reset_session(self):
+        """
+        Close the chat session of this backend, if it is the open session of the model.
+        The next prompt starts a fresh session with the same preamble.
+        """
+        with model_registry.get_model_lock(self.model_name):
+            session = model_registry.get_session_state(self.model_name)
+            if session.get('preamble') == self.preamble:
+                model_registry.close_session(session)
+
+    def _prepare_session(self, prompt, max_tokens):
+        # Called with the model lock held. The model holds one session at a time, so a
+        # backend with another preamble, or a full context, starts a new one. Completions are
+        # accounted as they are, so only a part of their limit needs to be free up front.
+        session = model_registry.get_session_state(self.model_name)
+        needed = estimate_tokens(prompt) + min(max_tokens, self.completion_reserve)
+        if session and (session['preamble'] != self.preamble or session['tokens'] + needed > self.context_budget):
+            model_registry.close_session(session)
+        if self.preamble is None:
+            return
+        if not session:
+            stack = ExitStack()
+            stack.enter_context(self.model.chat_session(system_prompt=self.preamble))
+            session.update({'preamble': self.preamble, 'stack': stack, 'tokens': estimate_tokens(self.preamble)})
+        session['tokens'] += estimate_tokens(prompt)
+
+    def _account_response(self, response):
+        session = model_registry.get_session_state(self.model_name)
+        if session:
+            session['tokens'] += estimate_tokens(response)
+
+    def generate(self, prompt, max_tokens, temperature=None):
+        """
+        Generate a completion.
+
+        Args:
+            prompt (str): The prompt.
+            max_tokens (int): The completion token limit.
+            temperature (float): The sampling temperature, or None for the model default.
+
+        Returns:
+            str: The completion.
+        """
+        options = {'temp': temperature} if temperature is not None else {}
+        with model_registry.get_model_lock(self.model_name):
+            self._prepare_session(prompt, max_tokens)
+            response = self.model.generate(prompt, max_tokens=max_tokens, **options)
+            self._account_response(response)
+        return response
+
+    def stream(self, prompt, max_tokens):
+        """
+        Generate a completion token by token.
+
+        Args:
+            prompt (str): The prompt.
+            max_tokens (int): The completion token limit.
+
+        Yields:
+            str: The generated tokens.
+        """
+        with model_registry.get_model_lock(self.model_name):
+            self._prepare_session(prompt, max_tokens)
+            tokens = []
+            for token in self.model.generate(prompt, max_tokens=max_tokens, streaming=True):
+                tokens.append(token)
+                yield token
+            self._account_response(''.join(tokens))
+
+
+class OpenAIBackend:
+    """
+    Generates text with the OpenAI completions API, or a compatible one. Requests go
+    through the shared client of the credentials, so backends with different credentials
+    can be used from several threads at once.
+    """
+
+    name = 'openai'
+    concurrent = True
+
+    def __init__(self, model_name, context_budget=None):
+        """
+        Initialize the OpenAIBackend.
+
+        Args:
+            model_name (str): The name of the OpenAI model.
+            context_budget (int): The estimated number of tokens a prompt and its completion
+                may use. Defaults to AUTOPYWIZARD_CONTEXT_TOKENS, or 4096.
+        """
+        self.model_name = model_name
+        self.context_budget = context_budget or int(os.environ.get('AUTOPYWIZARD_CONTEXT_TOKENS', '4096'))
+        self.api_key = None
+        self.base_url = None
+
+    def set_credentials(self, api_key, base_url):
+        """
+        Set the OpenAI API credentials.
+
+        Args:
+            api_key (str): The OpenAI API key.
+            base_url (str): The base URL for the OpenAI API.
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+
+    def start_session(self, preamble):
+        """
+        Ignored; this provider keeps no session state between prompts.
+        """
+
+    def reset_session(self):
+        """
+        Ignored; this provider keeps no session state between prompts.
+        """
+
+    @property
+    def client(self):
+        """
+        The shared OpenAIClient of the credentials.
+        """
+        return get_openai_client(self.api_key, self.base_url)
+
+    def list_models(self):
+        """
+        Fetch the available models from the OpenAI API; the list is cached for a while.
+
+        Returns:
+            list: The model ids.
+        """
+        return self.client.list_models()
+
+    def generation_params(self, max_tokens):
+        """
+        Return the generation parameters that affect the model output.
+
+        Args:
+            max_tokens (int): The completion token limit of the caller.
+
+        Returns:
+            dict: The generation parameters.
+        """
+        return {'max_tokens': max_tokens}
+
+    def generate(self, prompt, max_tokens, temperature=None):
+        """
+        Generate a completion.
+
+        Args:
+            prompt (str): The prompt.
+            max_tokens (int): The completion token limit.
+            temperature (float): The sampling temperature, or None for the API default.
+
+        Returns:
+            str: The completion.
+        """
+        return self.client.complete(self.model_name, prompt, max_tokens, temperature=temperature).strip()
+
+    def stream(self, prompt, max_tokens):
+        """
+        Generate a completion token by token.
+
+        Args:
+            prompt (str): The prompt.
+            max_tokens (int): The completion token limit.
+
+        Yields:
+            str: The generated tokens.
+        """
+        yield from self.client.stream_completion(self.model_name, prompt, max_tokens)
+
+
+class FakeBackend:
+    """
+    A deterministic stand-in for a real model, for offline runs and benchmarks.
+    Completions come from a fixture corpus: a JSON list of entries with a 'pattern'
+    regular expression and a 'completion' template in string.Template syntax, filled
+    with the named groups of the first pattern that matches the prompt. Entries with
+    'repeat' set are filled once per match instead, and the completions of all matching
+    repeat entries are joined, so packed prompts get an answer for every item. Latency
+    can be injected before the first token and between tokens.
+    """
+
+    name = 'fake'
+    concurrent = True
+
+    def __init__(self, model_name='fake', corpus_path=None, latency=None, token_latency=None, context_budget=None):
+        """
+        Initialize the FakeBackend.
+
+        Args:
+            model_name (str): The name reported for the model; only used in cache keys.
+            corpus_path (str): The path of the fixture corpus. Defaults to
+                AUTOPYWIZARD_FAKE_CORPUS, or no corpus.
+            latency (float): Seconds before the first token. Defaults to
+                AUTOPYWIZARD_FAKE_LATENCY, or 0.
+            token_latency (float): Seconds between tokens. Defaults to
+                AUTOPYWIZARD_FAKE_TOKEN_LATENCY, or 0.
+            context_budget (int): The estimated number of tokens a prompt and its completion
+                may use. Defaults to AUTOPYWIZARD_CONTEXT_TOKENS, or 4096.
+        """
+        self.model_name = model_name
+        self.context_budget = context_budget or int(os.environ.get('AUTOPYWIZARD_CONTEXT_TOKENS', '4096'))
+        corpus_path = corpus_path or os.environ.get('AUTOPYWIZARD_FAKE_CORPUS')
+        self.corpus = self.load_corpus(corpus_path) if corpus_path else []
+        self.latency = latency if latency is not None else float(os.environ.get('AUTOPYWIZARD_FAKE_LATENCY', 0))
+        self.token_latency = (
+            token_latency if token_latency is not None
+            else float(os.environ.get('AUTOPYWIZARD_FAKE_TOKEN_LATENCY', 0))
+        )
+
+    def start_session(self, preamble):
+        """
+        Ignored; this provider keeps no session state between prompts.
+        """
+
+    def reset_session(self):
+        """
+        Ignored; this provider keeps no session state between prompts.
+        """
+
+    @staticmethod
+    def load_corpus(corpus_path):
+        """
+        Read and compile a fixture corpus.
+
+        Args:
+            corpus_path (str): The path of the JSON corpus file.
+
+        Returns:
+            list: (compiled pattern, string.Template, repeat) tuples, in corpus order.
+        """
+        with open(corpus_path, encoding='utf-8') as file:
+            entries = json.load(file)
+        return [
+            (re.compile(entry['pattern'], re.DOTALL), string.Template(entry['completion']), entry.get('repeat', False))
+            for entry in entries
+        ]
+
+    def complete(self, prompt):
+        """
+        Return the completion of a prompt without any latency.
+        Prompts that match no corpus entry get a comment derived from the prompt hash.
+
+        Args:
+            prompt (str): The prompt.
+
+        Returns:
+            str: The completion.
+        """
+        repeated = []
+        for pattern, template, repeat in self.corpus:
+            if repeat:
+                repeated.extend(template.safe_substitute(match.groupdict()) for match in pattern.finditer(prompt))
+            elif not repeated:
+                match = pattern.search(prompt)
+                if match:
+                    return template.safe_substitute(match.groupdict())
+        if repeated:
+            return '\n\n'.join(completion.strip('\n') for completion in repeated) + '\n'
+        return f"# fake completion {hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]}\n"
+
+    def generation_params(self, max_tokens):
+        """
+        Return the generation parameters that affect the model output.
+
+        Args:
+            max_tokens (int): The completion token limit of the caller.
+
+        Returns:
+            dict: The generation parameters.
+        """
+        return {}
+
+    def generate(self, prompt, max_tokens, temperature=None):
+        """
+        Generate a completion, sleeping as long as streaming it would take.
+
+        Args:
+            prompt (str): The prompt.
+            max_tokens (int): The completion token limit; ignored.
+            temperature (float): The sampling temperature; ignored, completions are deterministic.
+
+        Returns:
+            str: The completion.
+        """
+        completion = self.complete(prompt)
+        time.sleep(self.latency + self.token_latency * len(TOKEN_PATTERN.findall(completion)))
+        return completion.strip()
+
+    def stream(self, prompt, max_tokens):
+        """
+        Generate a completion token by token.
+
+        Args:
+            prompt (str): The prompt.
+            max_tokens (int): The completion token limit; ignored.
+
+        Yields:
+            str: The generated tokens.
+        """
+        time.sleep(self.latency)
+        for index, token in enumerate(TOKEN_PATTERN.findall(self.complete(prompt))):
+            if index and self.token_latency:
+                time.sleep(self.token_latency)
+            yield token
+
+
+BACKENDS = {
+    'gpt4all': GPT4AllBackend,
+    'openai': OpenAIBackend,
+    'fake': FakeBackend,
+}
+
+
+def backend_from_settings(ai_settings):
+    """
+    Build the backend described by AI settings, with its credentials.
+
+    Args:
+        ai_settings (dict): The AI provider, model name and, for OpenAI, credentials.
+
+    Returns:
+        The backend.
+    """
+    backend = make_backend(ai_settings['ai_provider'], ai_settings['model_name'])
+    if backend.name == 'openai':
+        backend.set_credentials(ai_settings.get('api_key'), ai_settings.get('base_url'))
+    return backend
+
+
+def make_backend(provider, model_name):
+    """
+    Build the backend of a provider.
+
+    Args:
+        provider (str): The provider name, one of BACKENDS.
+        model_name (str): The name of the model.
+
+    Returns:
+        The backend.
+    """
+    if provider not in BACKENDS:
+        raise ValueError(f"Unsupported AI provider '{provider}'")
+    return BACKENDS[provider](model_name)
@@ -1,28 +1,180 @@
-import openai
-from gpt4all import GPT4All
+import copy
+import json
+import os
+import threading
+import time
+from ai_backends import backend_from_settings, make_backend
+from code_validator import split_definitions
+from generation_engine import GenerationEngine, estimate_tokens, get_rate_limiter
+from instrumentation import instrumentation
+from provider_router import TASK_TYPES, RoutedBackend
+from response_cache import get_response_cache
 
 class AIInteraction:
     """
     A class to handle interactions with AI models for code generation.
-    Supports both gpt4all and OpenAI's API.
+    Supports gpt4all, OpenAI's API and a deterministic fake provider for offline runs.
     """
 
-    def __init__(self, use_openai=False, model_name='wizardcoder-33b-v1.1.Q4_0.gguf'):
+    def __init__(self, use_openai=False, model_name='wizardcoder-33b-v1.1.Q4_0.gguf', max_workers=8, use_cache=True, provider=None,
+                 max_pack_size=8, routes=None, hedge_after=None):
         """
         Initialize the AIInteraction class with the specified model.
         
         Args:
             use_openai (bool): Flag to use OpenAI API instead of gpt4all.
             model_name (str): The name of the AI model to use.
+            max_workers (int): The maximum number of concurrent OpenAI requests in generate_batch.
+            use_cache (bool): Flag to serve repeated prompts from the persistent response cache.
+            provider (str): The provider name, 'gpt4all', 'openai' or 'fake'. Overrides use_openai;
+                defaults to AUTOPYWIZARD_AI_PROVIDER, or gpt4all.
+            max_pack_size (int): The maximum number of items generate_packed asks for in one prompt.
+            routes (dict): Task types ('modules', 'generation' or 'fix') mapped to the backends
+                tried for them, most preferred first. Other tasks use the configured provider.
+            hedge_after (float): Seconds after which a routed request is also sent to the next
+                backend. Defaults to AUTOPYWIZARD_HEDGE_SECONDS, or the rolling 95th latency
+                percentile of the backend.
         """
-        self.use_openai = use_openai
+        if provider is None:
+            provider = 'openai' if use_openai else os.environ.get('AUTOPYWIZARD_AI_PROVIDER', 'gpt4all')
+        self.backend = make_backend(provider, model_name)
+        self.use_openai = provider == 'openai'
         self.model_name = model_name
-        if not self.use_openai:
-            self.model = GPT4All(model=model_name)
-        else:
-            self.openai_api_key = None
-            self.openai_base_url = None
-            self.openai_model_name = model_name
+        self.max_workers = max_workers
+        self.max_tokens = 500
+        self.use_cache = use_cache
+        self.max_pack_size = max_pack_size
+        # Items per packed prompt; shrinks when responses miss items and grows back when they do not
+        self.pack_size = max_pack_size
+        if hedge_after is None and os.environ.get('AUTOPYWIZARD_HEDGE_SECONDS'):
+            hedge_after = float(os.environ['AUTOPYWIZARD_HEDGE_SECONDS'])
+        self.hedge_after = hedge_after
+        self.session_preamble = None
+        self._task_lock = threading.Lock()
+        self.set_routes(routes or {})
+
+    @classmethod
+    def from_settings(cls, ai_settings, **kwargs):
+        """
+        Build an AIInteraction from the AI settings of a project.
+        The optional 'routes' setting maps task types to lists of provider settings ('ai_provider',
+        'model_name' and, for OpenAI, credentials defaulting to the project's), tried in order
+        before the project's provider. Without it, routes are read from the JSON file named
+        by AUTOPYWIZARD_ROUTES, if set.
+        
+        Args:
+            ai_settings (dict): The AI provider, model name, OpenAI credentials and routes.
+            **kwargs: Extra keyword arguments passed to the constructor.
+        
+        Returns:
+            AIInteraction: The AIInteraction.
+        """
+        route_settings = ai_settings.get('routes')
+        if route_settings is None and os.environ.get('AUTOPYWIZARD_ROUTES'):
+            with open(os.environ['AUTOPYWIZARD_ROUTES'], encoding='utf-8') as routes_file:
+                route_settings = json.load(routes_file)
+        ai_interaction = cls(provider=ai_settings['ai_provider'], model_name=ai_settings['model_name'], **kwargs)
+        if ai_interaction.use_openai:
+            ai_interaction.set_openai_credentials(
+                api_key=ai_settings['api_key'],
+                base_url=ai_settings['base_url']
+            )
+        credentials = {key: ai_settings[key] for key in ('api_key', 'base_url') if key in ai_settings}
+        routes = {}
+        for task, entries in (route_settings or {}).items():
+            backends = [backend_from_settings({**credentials, **entry}) for entry in entries]
+            # The project's provider is the last resort of every route
+            if not any(
+                backend.name == ai_interaction.provider and backend.model_name == ai_interaction.model_name
+                for backend in backends
+            ):
+                backends.append(ai_interaction.backend)
+            routes[task] = backends
+        if routes:
+            ai_interaction.set_routes(routes)
+        return ai_interaction
+
+    def set_routes(self, routes):
+        """
+        Set the backends tried for each task type.
+        
+        Args:
+            routes (dict): Task types ('modules', 'generation' or 'fix') mapped to the backends
+                tried for them, most preferred first.
+        """
+        unknown = set(routes) - set(TASK_TYPES)
+        if unknown:
+            raise ValueError(f"Unknown task type(s) {', '.join(sorted(unknown))}; expected one of {', '.join(TASK_TYPES)}")
+        with self._task_lock:
+            self.routes = routes
+            self._task_interactions = {}
+
+    def for_task(self, task):
+        """
+        Return the AI interaction used for a task type: one that routes the requests across
+        the backends configured for the task, with failover and hedging, or this one if the
+        task has no route.
+        
+        Args:
+            task (str): The task type, 'modules', 'generation' or 'fix'.
+        
+        Returns:
+            AIInteraction: The AI interaction of the task.
+        """
+        if task not in self.routes:
+            return self
+        with self._task_lock:
+            if task not in self._task_interactions:
+                routed = copy.copy(self)
+                routed.backend = RoutedBackend(self.routes[task], hedge_after=self.hedge_after)
+                routed.model_name = routed.backend.model_name
+                routed.use_openai = routed.backend.name == 'openai'
+                routed.routes = {}
+                routed._task_interactions = {}
+                routed._task_lock = threading.Lock()
+                if self.session_preamble is not None:
+                    routed.backend.start_session(self.session_preamble)
+                self._task_interactions[task] = routed
+            return self._task_interactions[task]
+
+    @staticmethod
+    def build_session_preamble(project_details):
+        """
+        Build the preamble shared by the prompts of a project.
+        
+        Args:
+            project_details (dict): The project name and description.
+        
+        Returns:
+            str: The preamble.
+        """
+        return (
+            f"You are writing the Python project '{project_details['project_name']}': "
+            f"{project_details['project_description']}\nAnswer with Python code only."
+        )
+
+    def start_session(self, project_details):
+        """
+        Share a project preamble across the following prompts. Local models evaluate it once
+        and keep it, with the earlier exchanges, in a persistent chat session.
+        
+        Args:
+            project_details (dict): The project name and description.
+        """
+        self.session_preamble = self.build_session_preamble(project_details)
+        self.backend.start_session(self.session_preamble)
+        with self._task_lock:
+            for routed in self._task_interactions.values():
+                routed.backend.start_session(self.session_preamble)
+
+    def reset_session(self):
+        """
+        Drop the context of the chat session; the next prompt starts a fresh session.
+        """
+        self.backend.reset_session()
+        with self._task_lock:
+            for routed in self._task_interactions.values():
+                routed.backend.reset_session()
 
     def set_openai_credentials(self, api_key, base_url):
         """
@@ -32,8 +184,7 @@ class AIInteraction:
             api_key (str): The OpenAI API key.
             base_url (str): The base URL for the OpenAI API.
         """
-        self.openai_api_key = api_key
-        self.openai_base_url = base_url
+        self.backend.set_credentials(api_key, base_url)
 
     def get_openai_models(self):
         """
@@ -42,58 +193,126 @@ class AIInteraction:
         Returns:
             list: A list of available OpenAI models.
         """
-        openai.api_key = self.openai_api_key
-        openai.api_base = self.openai_base_url
-        models = openai.Model.list_models()
-        return [model['id'] for model in models['data']]
+        return self.backend.list_models()
 
-    def generate_code(self, prompt):
+    def generate_code(self, prompt, bypass_cache=False, temperature=None, max_tokens=None):
         """
         Generate code using the specified AI model based on the provided prompt.
+        Responses are served from and stored in the persistent response cache unless
+        caching is disabled or bypassed.
         
         Args:
             prompt (str): The prompt for the AI model.
+            bypass_cache (bool): Flag to skip the cache lookup and always call the model.
+            temperature (float): The sampling temperature, or None for the provider default.
+            max_tokens (int): The completion token limit. Defaults to self.max_tokens.
         
         Returns:
             str: The generated code.
         """
-        if self.use_openai:
-            return self.generate_code_openai(prompt)
-        else:
-            return self.generate_code_gpt4all(prompt)
+        if not bypass_cache:
+            response = self.cached_response(prompt, temperature=temperature, max_tokens=max_tokens)
+            if response is not None:
+                return response
+        response = self._generate_uncached(prompt, temperature=temperature, max_tokens=max_tokens)
+        if self.use_cache:
+            get_response_cache().put(self.cache_key(prompt, temperature=temperature, max_tokens=max_tokens), response)
+        return response
 
-    def generate_code_gpt4all(self, prompt):
+    def cache_key(self, prompt, temperature=None, max_tokens=None):
         """
-        Generate code using the gpt4all model.
+        Build the response cache key of a prompt for the configured provider and model.
         
         Args:
             prompt (str): The prompt for the AI model.
+            temperature (float): The sampling temperature, or None for the provider default.
+            max_tokens (int): The completion token limit. Defaults to self.max_tokens.
         
         Returns:
-            str: The generated code.
+            str: The cache key.
         """
-        response = self.model.generate(prompt)
-        return response
+        params = self.generation_params(max_tokens=max_tokens)
+        if temperature is not None:
+            params['temperature'] = temperature
+        return get_response_cache().make_key(prompt, self.provider, self.model_name, params)
 
-    def generate_code_openai(self, prompt):
+    def cached_response(self, prompt, temperature=None, max_tokens=None):
         """
-        Generate code using the OpenAI model.
+        Look up the cached response of a prompt.
         
         Args:
             prompt (str): The prompt for the AI model.
+            temperature (float): The sampling temperature, or None for the provider default.
+            max_tokens (int): The completion token limit. Defaults to self.max_tokens.
         
         Returns:
-            str: The generated code.
+            str: The cached response, or None if caching is disabled or the prompt is not cached.
+        """
+        if not self.use_cache:
+            return None
+        response = get_response_cache().get(self.cache_key(prompt, temperature=temperature, max_tokens=max_tokens))
+        instrumentation.count('cache_hits' if response is not None else 'cache_misses', provider=self.provider)
+        return response
+
+    def _generate_uncached(self, prompt, temperature=None, max_tokens=None):
+        with instrumentation.span('generation', provider=self.provider):
+            response = self.backend.generate(prompt, max_tokens or self.max_tokens, temperature=temperature)
+        self._count_tokens(prompt, response)
+        return response
+
+    def _count_tokens(self, prompt, response):
+        instrumentation.count('prompt_tokens', estimate_tokens(prompt), provider=self.provider)
+        instrumentation.count('completion_tokens', estimate_tokens(response), provider=self.provider)
+
+    @property
+    def provider(self):
+        """
+        The name of the configured provider, 'openai', 'gpt4all' or 'fake'.
+        """
+        return self.backend.name
+
+    def generation_params(self, max_tokens=None):
         """
-        openai.api_key = self.openai_api_key
-        openai.api_base = self.openai_base_url
+        Return the generation parameters that affect the model output.
         
-        response = openai.Completion.create(
-            model=self.openai_model_name,
-            prompt=prompt,
-            max_tokens=500
-        )
-        return response.choices[0].text.strip()
+        Args:
+            max_tokens (int): The completion token limit. Defaults to self.max_tokens.
+        
+        Returns:
+            dict: The generation parameters.
+        """
+        return self.backend.generation_params(max_tokens or self.max_tokens)
+
+    def stream_code(self, prompt, bypass_cache=False, max_tokens=None):
+        """
+        Generate code token by token using the specified AI model.
+        A cached response is yielded as a single chunk.
+        
+        Args:
+            prompt (str): The prompt for the AI model.
+            bypass_cache (bool): Flag to skip the cache lookup and always call the model.
+            max_tokens (int): The completion token limit. Defaults to self.max_tokens.
+        
+        Yields:
+            str: The generated tokens.
+        """
+        if not bypass_cache:
+            response = self.cached_response(prompt, max_tokens=max_tokens)
+            if response is not None:
+                yield response
+                return
+        tokens = self.backend.stream(prompt, max_tokens or self.max_tokens)
+        chunks = []
+        start = time.perf_counter()
+        for token in tokens:
+            if not chunks:
+                instrumentation.record_span('generation_first_token', time.perf_counter() - start, provider=self.provider)
+            chunks.append(token)
+            yield token
+        instrumentation.record_span('generation', time.perf_counter() - start, provider=self.provider)
+        self._count_tokens(prompt, ''.join(chunks))
+        if self.use_cache:
+            get_response_cache().put(self.cache_key(prompt, max_tokens=max_tokens), ''.join(chunks).strip())
 
     def generate_class_code(self, class_name, class_description):
         """
@@ -106,8 +325,7 @@ class AIInteraction:
         Returns:
             str: The generated class code.
         """
-        prompt = f"Generate a Python class named '{class_name}' with the following description: {class_description}"
-        return self.generate_code(prompt)
+        return self.generate_code(self.build_class_prompt(class_name, class_description))
 
     def generate_function_code(self, function_name, function_description):
         """
@@ -120,5 +338,215 @@ class AIInteraction:
         Returns:
             str: The generated function code.
         """
-        prompt = f"Generate a Python function named '{function_name}' with the following description: {function_description}"
-        return self.generate_code(prompt)
+        return self.generate_code(self.build_function_prompt(function_name, function_description))
+
+    @staticmethod
+    def build_class_prompt(class_name, class_description):
+        """
+        Build the prompt used to generate a class.
+        
+        Args:
+            class_name (str): The name of the class.
+            class_description (str): The description of the class.
+        
+        Returns:
+            str: The prompt.
+        """
+        return f"Generate a Python class named '{class_name}' with the following description: {class_description}"
+
+    @staticmethod
+    def build_function_prompt(function_name, function_description):
+        """
+        Build the prompt used to generate a function.
+        
+        Args:
+            function_name (str): The name of the function.
+            function_description (str): The description of the function.
+        
+        Returns:
+            str: The prompt.
+        """
+        return f"Generate a Python function named '{function_name}' with the following description: {function_description}"
+
+    def build_job_prompt(self, job):
+        """
+        Build the prompt for a generation job.
+        
+        Args:
+            job (dict): A job with 'type' ('class', 'function' or 'prompt'), and either
+                'name' and 'description' or 'prompt'. An optional 'max_tokens' overrides the
+                completion token limit.
+        
+        Returns:
+            str: The prompt.
+        """
+        if job['type'] == 'class':
+            return self.build_class_prompt(job['name'], job['description'])
+        if job['type'] == 'function':
+            return self.build_function_prompt(job['name'], job['description'])
+        return job['prompt']
+
+    def generation_engine(self):
+        """
+        Build the generation engine for the configured provider. OpenAI requests run
+        concurrently; the single local gpt4all model is used as a serialized queue.
+        
+        Returns:
+            GenerationEngine: The generation engine.
+        """
+        return GenerationEngine(
+            self.generate_code,
+            max_workers=self.max_workers if self.backend.concurrent else 1,
+            rate_limiter=get_rate_limiter(self.provider),
+            completion_tokens=self.max_tokens
+        )
+
+    def generate_batch(self, jobs, on_token=None):
+        """
+        Generate code for a batch of jobs with bounded parallelism, rate limits and retries.
+        
+        Args:
+            jobs (list): The generation jobs, see build_job_prompt.
+            on_token (callable): Called with (job index, token) for every streamed token.
+                Cached results are reported as a single token.
+        
+        Returns:
+            list: The generated code, in the same order as the jobs.
+        """
+        with instrumentation.span('prompt_build'):
+            prompts = [self.build_job_prompt(job) for job in jobs]
+        results = [self.cached_response(prompt, max_tokens=job.get('max_tokens')) for prompt, job in zip(prompts, jobs)]
+        missing = [index for index, result in enumerate(results) if result is None]
+        if on_token is not None:
+            for index, result in enumerate(results):
+                if result is not None:
+                    on_token(index, result)
+
+        def generate_fn_for(index):
+            max_tokens = jobs[index].get('max_tokens')
+            if on_token is None:
+                return lambda prompt: self.generate_code(prompt, bypass_cache=True, max_tokens=max_tokens)
+            return lambda prompt: self._stream_to_callback(prompt, index, on_token, max_tokens=max_tokens)
+
+        # Only cache misses go through the engine, so cache hits do not use up rate limits.
+        engine = self.generation_engine()
+        generated = engine.run(
+            [prompts[index] for index in missing],
+            generate_fns=[generate_fn_for(index) for index in missing]
+        )
+        for index, result in zip(missing, generated):
+            results[index] = result
+        return results
+
+    def _stream_to_callback(self, prompt, index, on_token, max_tokens=None):
+        chunks = []
+        for token in self.stream_code(prompt, bypass_cache=True, max_tokens=max_tokens):
+            chunks.append(token)
+            on_token(index, token)
+        return ''.join(chunks).strip()
+
+    def build_packed_prompt(self, jobs):
+        """
+        Build one prompt asking for several classes and functions of the same module.
+        
+        Args:
+            jobs (list): The class and function jobs, all for the same module.
+        
+        Returns:
+            str: The prompt.
+        """
+        items = '\n'.join(f"{number}. {self.build_job_prompt(job)}" for number, job in enumerate(jobs, 1))
+        return (
+            f"Generate the following Python definitions for the module '{jobs[0]['module']}'. "
+            f"Define each one at the top level with exactly the requested name, and return them "
+            f"all in one Python code block.\n{items}"
+        )
+
+    def pack_jobs(self, jobs):
+        """
+        Split jobs into packs: class and function jobs of the same module are packed
+        together, as many as fit the context window of the model and the current pack size.
+        
+        Args:
+            jobs (list): The generation jobs.
+        
+        Returns:
+            list: Lists of job indexes, one per prompt.
+        """
+        packs = []
+        open_packs = {}
+        for index, job in enumerate(jobs):
+            if job['type'] not in ('class', 'function'):
+                packs.append([index])
+                continue
+            pack = open_packs.get(job['module'])
+            if pack is not None:
+                candidate = [jobs[member] for member in pack + [index]]
+                needed = estimate_tokens(self.build_packed_prompt(candidate)) + self.max_tokens * len(candidate)
+                if len(candidate) <= self.pack_size and needed <= self.backend.context_budget:
+                    pack.append(index)
+                    continue
+            open_packs[job['module']] = [index]
+            packs.append(open_packs[job['module']])
+        return packs
+
+    def generate_packed(self, jobs, on_token=None):
+        """
+        Generate code for a batch of jobs with fewer model calls: the classes and functions
+        of a module are requested together in packed prompts, and the response is split
+        back into definitions by name. Items missing from a packed response are generated
+        on their own, and the pack size is halved for the next packs.
+        
+        Args:
+            jobs (list): The generation jobs, see build_job_prompt.
+            on_token (callable): Called with (job index, token) for every streamed token.
+                Tokens of a packed prompt are reported for its first job.
+        
+        Returns:
+            list: The generated code, in the same order as the jobs.
+        """
+        if self.max_pack_size <= 1:
+            return self.generate_batch(jobs, on_token=on_token)
+        packs = self.pack_jobs(jobs)
+        pack_jobs = [
+            jobs[pack[0]] if len(pack) == 1 else {
+                'type': 'prompt',
+                'prompt': self.build_packed_prompt([jobs[index] for index in pack]),
+                'max_tokens': self.max_tokens * len(pack),
+            }
+            for pack in packs
+        ]
+        pack_on_token = None
+        if on_token is not None:
+            pack_on_token = lambda pack_index, token: on_token(packs[pack_index][0], token)
+        responses = self.generate_batch(pack_jobs, on_token=pack_on_token)
+
+        results = [None] * len(jobs)
+        missed = False
+        for pack, response in zip(packs, responses):
+            if len(pack) == 1:
+                results[pack[0]] = response
+                continue
+            shared, definitions = split_definitions(response)
+            requested = {jobs[index]['name'] for index in pack}
+            # Helpers the model added are shared by the items like imports and constants;
+            # merging the items into the module keeps one copy of each.
+            shared += ''.join(
+                definition + '\n\n\n' for name, definition in definitions.items() if name not in requested
+            )
+            for index in pack:
+                if jobs[index]['name'] in definitions:
+                    results[index] = shared + definitions[jobs[index]['name']] + '\n'
+                else:
+                    missed = True
+        self.pack_size = max(1, self.pack_size // 2) if missed else min(self.max_pack_size, self.pack_size + 1)
+
+        fallback = [index for index, result in enumerate(results) if result is None]
+        if fallback:
+            print(f"Generating {len(fallback)} item(s) missing from packed responses one by one.")
+            fallback_on_token = None
+            if on_token is not None:
+                fallback_on_token = lambda position, token: on_token(fallback[position], token)
+            for index, result in zip(fallback, self.generate_batch([jobs[index] for index in fallback], on_token=fallback_on_token)):
+                results[index] = result
+        return results
@@ -1,16 +1,42 @@
-from flask import Flask, render_template, request, redirect, url_for, session
+import os
+import threading
+import uuid
+from flask import Flask, Response, abort, jsonify, render_template, request, redirect, url_for, session
 from ai_interaction import AIInteraction
-from code_generator import CodeGenerator
-from iterative_improver import IterativeImprover
+from instrumentation import instrumentation
+from job_queue import JobQueue
+from model_registry import model_registry
+from module_plan import ModulePlanParser, stream_module_plan
+from progress_events import format_sse
 from requirements_manager import RequirementsManager
+from state_store import DEFAULT_STATE_DB_PATH, make_state_store
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # Needed to use sessions
 
-project_details = {}
-modules = []
-functions = []
-ai_settings = {}
+# Per-session project details, modules, functions and AI settings. The SQLite store is shared by
+# all threads and worker processes; 'memory' only suits a single server process.
+state_store = make_state_store(os.environ.get('AUTOPYWIZARD_STATE_STORE', f'sqlite:///{DEFAULT_STATE_DB_PATH}'))
+
+job_queue = JobQueue(
+    workers=int(os.environ.get('AUTOPYWIZARD_JOB_WORKERS', '2')),
+    mode=os.environ.get('AUTOPYWIZARD_JOB_MODE', 'thread')
+)
+
+@app.before_request
+def start_job_queue():
+    # Started lazily in the serving process so the debug reloader's parent does not run jobs
+    # or load models, and also under a WSGI server, which never runs __main__
+    job_queue.start()
+    start_model_warm_up()
+
+def state_id():
+    """
+    Return the id under which the current session's project state is stored.
+    """
+    if 'state_id' not in session:
+        session['state_id'] = uuid.uuid4().hex
+    return session['state_id']
 
 @app.route('/')
 def index():
@@ -18,7 +44,6 @@ def index():
 
 @app.route('/set-ai-settings', methods=['GET', 'POST'])
 def set_ai_settings():
-    global ai_settings
     if request.method == 'POST':
         ai_provider = request.form['ai_provider']
         model_name = request.form['model_name']
@@ -31,15 +56,17 @@ def set_ai_settings():
             ai_settings['base_url'] = request.form['base_url']
             session['api_key'] = request.form['api_key']
             session['base_url'] = request.form['base_url']
+            state_store.set(state_id(), 'ai_settings', ai_settings)
             return redirect(url_for('openai_models'))
         else:
+            state_store.set(state_id(), 'ai_settings', ai_settings)
             return redirect(url_for('project'))
     return render_template('ai_settings.html')
 
 @app.route('/openai-models', methods=['GET', 'POST'])
 def openai_models():
     if request.method == 'POST':
-        ai_settings['model_name'] = request.form['model_name']
+        state_store.update(state_id(), 'ai_settings', model_name=request.form['model_name'])
         return redirect(url_for('project'))
     
     ai_interaction = AIInteraction(use_openai=True)
@@ -49,12 +76,11 @@ def openai_models():
 
 @app.route('/project', methods=['GET', 'POST'])
 def project():
-    global project_details
     if request.method == 'POST':
-        project_details = {
+        state_store.set(state_id(), 'project_details', {
             'project_name': request.form['project_name'],
             'project_description': request.form['project_description']
-        }
+        })
         if 'generate_modules' in request.form:
             return redirect(url_for('generate_modules'))
         return redirect(url_for('module'))
@@ -62,21 +88,27 @@ def project():
 
 @app.route('/generate_modules', methods=['GET', 'POST'])
 def generate_modules():
-    ai_interaction = AIInteraction(
-        use_openai=ai_settings['ai_provider'] == 'openai',
-        model_name=ai_settings['model_name']
-    )
-    if ai_settings['ai_provider'] == 'openai':
-        ai_interaction.set_openai_credentials(
-            api_key=ai_settings['api_key'],
-            base_url=ai_settings['base_url']
-        )
-    
-    prompt = f"Generate a list of modules with names and descriptions for a project with the following description: {project_details['project_description']}"
-    response = ai_interaction.generate_code(prompt)
-    
-    generated_modules = parse_generated_modules(response)  # Assume a function to parse the response into a list of modules
-    return render_template('generated_modules.html', modules=generated_modules)
+    # The page renders the modules from module_plan_events as they are generated
+    return render_template('generated_modules.html')
+
+@app.route('/generate_modules/events')
+def module_plan_events():
+    ai_settings = state_store.get(state_id(), 'ai_settings')
+    project_details = state_store.get(state_id(), 'project_details')
+    ai_interaction = AIInteraction.from_settings(ai_settings).for_task('modules')
+
+    def stream():
+        parser = ModulePlanParser()
+        event_id = 0
+        try:
+            for event_id, module in enumerate(stream_module_plan(ai_interaction, project_details['project_description'], parser)):
+                yield format_sse(event_id, {'type': 'module', **module})
+        except Exception as error:
+            yield format_sse(event_id + 1, {'type': 'error', 'message': str(error)})
+            return
+        yield format_sse(event_id + 1, {'type': 'done', 'modules': len(parser.modules), 'rejected': len(parser.rejected)})
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/module', methods=['GET', 'POST'])
 def module():
@@ -85,7 +117,7 @@ def module():
             'module_name': request.form['module_name'],
             'module_description': request.form['module_description']
         }
-        modules.append(module_details)
+        state_store.append(state_id(), 'modules', module_details)
         return redirect(url_for('function', module_name=module_details['module_name']))
     return render_template('module.html')
 
@@ -96,7 +128,7 @@ def function(module_name):
             'function_name': request.form['function_name'],
             'function_description': request.form['function_description']
         }
-        functions.append((module_name, function_details))
+        state_store.append(state_id(), 'functions', [module_name, function_details])
         if 'add_more' in request.form:
             return redirect(url_for('function', module_name=module_name))
         else:
@@ -107,51 +139,89 @@ def function(module_name):
 def requirements():
     if request.method == 'POST':
         packages = request.form['packages'].split()
+        project_details = state_store.get(state_id(), 'project_details')
         requirements_manager = RequirementsManager(project_details['project_name'])
         for package in packages:
             requirements_manager.add_requirement(package)
-        requirements_manager.install_requirements()
+        # Installation runs in the generation job, before the tests
         return redirect(url_for('progress'))
     return render_template('requirements.html')
 
 @app.route('/progress')
 def progress():
-    if ai_settings['ai_provider'] == 'openai':
-        ai_interaction = AIInteraction(use_openai=True, model_name=ai_settings['model_name'])
-        ai_interaction.set_openai_credentials(
-            api_key=ai_settings['api_key'],
-            base_url=ai_settings['base_url'],
-        )
-    else:
-        ai_interaction = AIInteraction(use_openai=False, model_name=ai_settings['model_name'])
-
-    code_generator = CodeGenerator(project_details['project_name'])
-
-    for module in modules:
-        class_code = ai_interaction.generate_class_code(module['module_name'], module['module_description'])
-        code_generator.save_class_code(module['module_name'], class_code)
-
-    for module_name, function in functions:
-        function_code = ai_interaction.generate_function_code(function['function_name'], function['function_description'])
-        code_generator.save_function_code(module_name, function['function_name'], function_code)
-
-    iterative_improver = IterativeImprover(project_details['project_name'])
-    iterative_improver.improve_code()
-
-    return render_template('progress.html')
-
-def parse_generated_modules(response):
-    # Implement parsing logic to convert the response into a list of module names and descriptions
-    modules = []
-    lines = response.split('\n')
-    for line in lines:
-        if ':' in line:
-            module_name, module_description = line.split(':', 1)
-            modules.append({
-                'module_name': module_name.strip(),
-                'module_description': module_description.strip()
-            })
-    return modules
+    job_id = job_queue.submit('generate_project', {
+        'project_details': state_store.get(state_id(), 'project_details'),
+        'modules': state_store.items(state_id(), 'modules'),
+        'functions': state_store.items(state_id(), 'functions'),
+        'ai_settings': state_store.get(state_id(), 'ai_settings'),
+    })
+    return render_template('progress.html', job_id=job_id)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    job.pop('result')
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    if job['status'] not in ('succeeded', 'failed', 'cancelled'):
+        return jsonify({'status': job['status']}), 202
+    return jsonify({'status': job['status'], 'result': job['result'], 'error': job['error']})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if job_queue.get(job_id) is None:
+        abort(404)
+    return jsonify({'cancelled': job_queue.cancel(job_id)})
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    if job_queue.get(job_id) is None:
+        abort(404)
+    offset = int(request.headers.get('Last-Event-ID', -1)) + 1
+
+    def stream():
+        for item in job_queue.follow(job_id, offset):
+            if item is None:
+                # Comment line that keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+            else:
+                yield format_sse(*item)
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def metrics():
+    # Process-mode job workers record their own metrics; only this process's are shown.
+    return Response(instrumentation.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+def warm_up_models():
+    """
+    Load the gpt4all models listed in AUTOPYWIZARD_WARMUP_MODELS (comma-separated)
+    so the first generation does not pay the model loading time.
+    """
+    model_names = [name.strip() for name in os.environ.get('AUTOPYWIZARD_WARMUP_MODELS', '').split(',') if name.strip()]
+    model_registry.warm_up(model_names)
+
+_warm_up_started = False
+_warm_up_lock = threading.Lock()
+
+def start_model_warm_up():
+    """
+    Start warming up the models in the background, once per serving process.
+    """
+    global _warm_up_started
+    with _warm_up_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+    threading.Thread(target=warm_up_models, name='model-warm-up', daemon=True).start()
 
 if __name__ == '__main__':
     app.run(debug=True)
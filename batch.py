@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pipeline import run_project
+from requirements_manager import RequirementsManager
+
+
+def load_specs(spec_path):
+    """
+    Read project specs from a JSONL file, one project per line.
+    Each spec has 'project_name', 'project_description', 'modules' (module details dicts),
+    'functions' (dicts with 'module_name', 'function_name' and 'function_description')
+    and optionally 'requirements' (package specifiers) and 'ai_settings'.
+
+    Args:
+        spec_path (str): The path of the JSONL file.
+
+    Returns:
+        list: The project spec dicts.
+    """
+    specs = []
+    with open(spec_path, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                specs.append(json.loads(line))
+    return specs
+
+
+def generate_project(spec, output_dir, default_ai_settings):
+    """
+    Generate one project from its spec. Runs in a worker process.
+
+    Args:
+        spec (dict): The project spec, see load_specs.
+        output_dir (str): The directory in which the project directory is created.
+        default_ai_settings (dict): The AI settings used when the spec has none.
+
+    Returns:
+        dict: The project outcome for the summary.
+    """
+    start = time.monotonic()
+    project_name = spec['project_name']
+    outcome = {'project_name': project_name, 'output_dir': os.path.join(output_dir, project_name)}
+    stages = {}
+    stage_start = [start, None]
+
+    def emit(event_type, **data):
+        if event_type == 'stage':
+            now = time.monotonic()
+            if stage_start[1] is not None:
+                stages[stage_start[1]] = now - stage_start[0]
+            stage_start[:] = [now, data['stage']]
+        elif event_type == 'requirements':
+            outcome['requirements'] = data
+
+    try:
+        os.makedirs(outcome['output_dir'], exist_ok=True)
+        requirements_manager = RequirementsManager(project_name, base_dir=output_dir)
+        for package in spec.get('requirements', []):
+            requirements_manager.add_requirement(package)
+        result = run_project(
+            {'project_name': project_name, 'project_description': spec.get('project_description', '')},
+            spec.get('modules', []),
+            [
+                (function['module_name'], {
+                    'function_name': function['function_name'],
+                    'function_description': function['function_description'],
+                })
+                for function in spec.get('functions', [])
+            ],
+            spec.get('ai_settings') or default_ai_settings,
+            emit,
+            base_dir=output_dir
+        )
+        outcome['status'] = 'passed' if result['all_tests_passed'] else 'tests_failing'
+        outcome['stop_reason'] = result['stop_reason']
+        outcome['trace_path'] = result['trace_path']
+    except Exception as error:
+        outcome['status'] = 'error'
+        outcome['error'] = ''.join(traceback.format_exception(error))
+    if stage_start[1] is not None:
+        stages[stage_start[1]] = time.monotonic() - stage_start[0]
+    outcome['stage_seconds'] = stages
+    outcome['seconds'] = time.monotonic() - start
+    return outcome
+
+
+def run_batch(specs, output_dir, workers, ai_settings):
+    """
+    Generate many projects across a process pool.
+
+    Args:
+        specs (list): The project specs.
+        output_dir (str): The directory in which the project directories are created.
+        workers (int): The number of worker processes.
+        ai_settings (dict): The default AI settings.
+
+    Returns:
+        dict: The summary with per-project outcomes and timings.
+    """
+    names = [spec['project_name'] for spec in specs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate project names in the spec file: {', '.join(duplicates)}")
+
+    started = time.time()
+    start = time.monotonic()
+    outcomes = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(generate_project, spec, output_dir, ai_settings) for spec in specs]
+        for future in as_completed(futures):
+            outcome = future.result()
+            print(f"{outcome['project_name']}: {outcome['status']} in {outcome['seconds']:.1f}s")
+            outcomes.append(outcome)
+    outcomes.sort(key=lambda outcome: names.index(outcome['project_name']))
+    return {
+        'started_at': started,
+        'seconds': time.monotonic() - start,
+        'workers': workers,
+        'projects': outcomes,
+        'counts': {
+            status: sum(1 for outcome in outcomes if outcome['status'] == status)
+            for status in ('passed', 'tests_failing', 'error')
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate projects from a JSONL spec file without prompts.")
+    parser.add_argument('spec_file', help="JSONL file with one project spec per line")
+    parser.add_argument('--output-dir', default='batch_output', help="directory for the generated projects")
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help="number of worker processes (default: 1 with gpt4all, whose model every worker loads "
+             "its own copy of, else the CPU count)"
+    )
+    parser.add_argument('--summary', default=None, help="summary JSON path (default: <output-dir>/summary.json)")
+    parser.add_argument('--ai-provider', choices=['gpt4all', 'openai', 'fake'], default='gpt4all')
+    parser.add_argument('--model-name', default='wizardcoder-33b-v1.1.Q4_0.gguf')
+    parser.add_argument('--api-key', default=os.environ.get('OPENAI_API_KEY'))
+    parser.add_argument('--base-url', default=os.environ.get('OPENAI_BASE_URL'))
+    parser.add_argument(
+        '--routes', default=None,
+        help="JSON file mapping task types (modules, generation, fix) to the providers tried for them"
+    )
+    args = parser.parse_args()
+
+    ai_settings = {'ai_provider': args.ai_provider, 'model_name': args.model_name}
+    if args.ai_provider == 'openai':
+        ai_settings['api_key'] = args.api_key
+        ai_settings['base_url'] = args.base_url
+    if args.routes:
+        with open(args.routes, encoding='utf-8') as file:
+            ai_settings['routes'] = json.load(file)
+    workers = args.workers
+    if workers is None:
+        providers = {args.ai_provider} | {
+            settings.get('ai_provider') for route in ai_settings.get('routes', {}).values() for settings in route
+        }
+        workers = 1 if 'gpt4all' in providers else os.cpu_count() or 1
+
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    summary = run_batch(load_specs(args.spec_file), output_dir, workers, ai_settings)
+    summary_path = args.summary or os.path.join(output_dir, 'summary.json')
+    with open(summary_path, 'w', encoding='utf-8') as file:
+        json.dump(summary, file, indent=2)
+    print(f"Summary written to '{summary_path}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+Offline benchmarks of the generation pipeline.
+
+Every scenario runs against the deterministic fake provider (see ai_backends.FakeBackend)
+with the fixture corpus in benchmarks/fixtures, so no model download or network access is
+needed. The generated functions first fail their fixture tests and are corrected by the fix
+loop, so the improvement loop does real work. Results are written as JSON:
+
+    python benchmarks/run_benchmarks.py --sizes 1,5,20 --repeat 3 --output benchmark_results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import statistics
+import string
+import sys
+import tempfile
+import time
+import uuid
+from unittest import mock
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+FIXTURE_DIR = os.path.join(BENCHMARK_DIR, 'fixtures')
+CORPUS_PATH = os.path.join(FIXTURE_DIR, 'corpus.json')
+TEST_TEMPLATE_PATH = os.path.join(FIXTURE_DIR, 'test_module.tmpl')
+SCENARIOS = ('code_generator', 'improvement_loop', 'main', 'progress')
+JOB_POLL_INTERVAL = 0.02
+
+sys.path.insert(0, REPO_DIR)
+
+from ai_interaction import AIInteraction  # noqa: E402
+from code_generator import CodeGenerator  # noqa: E402
+from instrumentation import instrumentation  # noqa: E402
+from iterative_improver import IterativeImprover  # noqa: E402
+from pipeline import generate_project_code  # noqa: E402
+from response_cache import get_response_cache  # noqa: E402
+
+
+def project_spec(size):
+    """
+    Build a benchmark project spec with one class and one function per module.
+
+    Args:
+        size (int): The number of modules.
+
+    Returns:
+        tuple: The module details dicts and the (module_name, function details dict) tuples.
+    """
+    modules = [
+        {'module_name': f"Module{index}", 'module_description': f"Benchmark module {index} holding a value."}
+        for index in range(size)
+    ]
+    functions = [
+        (module['module_name'], {
+            'function_name': f"add_{index}",
+            'function_description': "Return the sum of a and b.",
+        })
+        for index, module in enumerate(modules)
+    ]
+    return modules, functions
+
+
+def write_fixture_tests(project_dir, size):
+    """
+    Write the fixture tests of a benchmark project.
+
+    Args:
+        project_dir (str): The project directory.
+        size (int): The number of modules.
+    """
+    with open(TEST_TEMPLATE_PATH, encoding='utf-8') as file:
+        template = string.Template(file.read())
+    os.makedirs(project_dir, exist_ok=True)
+    for index in range(size):
+        with open(os.path.join(project_dir, f"test_module{index}.py"), 'w', encoding='utf-8') as file:
+            file.write(template.substitute(
+                module=f"module{index}", class_name=f"Module{index}", function_name=f"add_{index}"
+            ))
+
+
+def span_summary(spans):
+    """
+    Summarize the durations of trace spans by name.
+
+    Args:
+        spans (list): The span dicts of one or more traces.
+
+    Returns:
+        dict: Span names mapped to their count, median, 95th percentile and maximum in seconds.
+    """
+    by_name = {}
+    for span in spans:
+        by_name.setdefault(span['name'], []).append(span['seconds'])
+    summary = {}
+    for name, seconds in sorted(by_name.items()):
+        seconds.sort()
+        summary[name] = {
+            'count': len(seconds),
+            'p50': statistics.median(seconds),
+            'p95': seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))],
+            'max': seconds[-1],
+        }
+    return summary
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def run_code_generator(size, run_dir):
+    """
+    Time buffering and writing the code of a project with CodeGenerator.
+    """
+    code_generator = CodeGenerator('code_generator', base_dir=run_dir)
+    start = time.perf_counter()
+    for index in range(size):
+        code_generator.save_class_code(f"Module{index}", f"class Module{index}:\n    pass\n")
+        code_generator.save_function_code(f"Module{index}", f"add_{index}", f"def add_{index}(a, b):\n    return a + b\n")
+    code_generator.flush()
+    return {'seconds': time.perf_counter() - start, 'items': 2 * size, 'passed': None, 'spans': []}
+
+
+def run_improvement_loop(size, run_dir):
+    """
+    Time the TestRunner and IterativeImprover loop on a generated project whose
+    functions fail their tests until they are fixed.
+    """
+    modules, functions = project_spec(size)
+    ai_interaction = AIInteraction(provider='fake', model_name='fake')
+    code_generator = CodeGenerator('improvement_loop', base_dir=run_dir)
+    write_fixture_tests(code_generator.project_dir, size)
+    generate_project_code(ai_interaction, code_generator, modules, functions)
+
+    with instrumentation.trace(uuid.uuid4().hex) as trace:
+        start = time.perf_counter()
+        iterative_improver = IterativeImprover('improvement_loop', base_dir=run_dir, ai_interaction=ai_interaction)
+        passed = iterative_improver.improve_code()
+        seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'items': size, 'passed': passed, 'spans': trace.to_dict()['spans']}
+
+
+def run_main(size, run_dir):
+    """
+    Time main.main end to end with scripted answers to its prompts.
+    """
+    import main
+
+    modules, functions = project_spec(size)
+    answers = ['main_project', 'Benchmark project']
+    for index, (module, (_, function)) in enumerate(zip(modules, functions)):
+        answers += [
+            module['module_name'], module['module_description'],
+            function['function_name'], function['function_description'],
+            'yes' if index < size - 1 else 'no',
+        ]
+    write_fixture_tests(os.path.join(run_dir, 'main_project'), size)
+
+    with working_directory(run_dir), mock.patch('builtins.input', side_effect=answers):
+        with instrumentation.trace(uuid.uuid4().hex) as trace:
+            start = time.perf_counter()
+            main.main()
+            seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'items': 2 * size, 'passed': None, 'spans': trace.to_dict()['spans']}
+
+
+def run_progress(size, run_dir):
+    """
+    Time the web flow: fill in a project through the Flask routes, submit it with
+    /progress and wait for the background job to finish.
+    """
+    import app as web_app
+    from job_queue import FINISHED_STATUSES
+
+    modules, functions = project_spec(size)
+    project_name = f"progress_{uuid.uuid4().hex[:8]}"
+    write_fixture_tests(os.path.join(os.getcwd(), project_name), size)
+    client = web_app.app.test_client()
+    client.post('/set-ai-settings', data={'ai_provider': 'fake', 'model_name': 'fake'})
+    client.post('/project', data={'project_name': project_name, 'project_description': 'Benchmark project'})
+    for module, (module_name, function) in zip(modules, functions):
+        client.post('/module', data=module)
+        client.post(f"/function/{module_name}", data=function)
+
+    start = time.perf_counter()
+    response = client.get('/progress')
+    submit_seconds = time.perf_counter() - start
+    job_id = re.search(r'/jobs/([^/"]+)/events', response.get_data(as_text=True)).group(1)
+    job = web_app.job_queue.get(job_id)
+    while job['status'] not in FINISHED_STATUSES:
+        time.sleep(JOB_POLL_INTERVAL)
+        job = web_app.job_queue.get(job_id)
+    seconds = time.perf_counter() - start
+    if job['status'] != 'succeeded':
+        raise RuntimeError(f"Benchmark job {job_id} {job['status']}: {job['error']}")
+
+    with open(job['result']['trace_path'], encoding='utf-8') as file:
+        spans = json.load(file)['spans']
+    return {
+        'seconds': seconds,
+        'submit_seconds': submit_seconds,
+        'items': 2 * size,
+        'passed': job['result']['all_tests_passed'],
+        'spans': spans,
+    }
+
+
+RUNNERS = {
+    'code_generator': run_code_generator,
+    'improvement_loop': run_improvement_loop,
+    'main': run_main,
+    'progress': run_progress,
+}
+
+
+def run_scenario(scenario, size, repeat, work_dir, verbose=False):
+    """
+    Run one scenario at one project size several times.
+
+    Args:
+        scenario (str): The scenario name, one of SCENARIOS.
+        size (int): The number of modules of the project.
+        repeat (int): The number of timed runs.
+        work_dir (str): The directory for the generated projects.
+        verbose (bool): Flag to show the output of the pipeline.
+
+    Returns:
+        dict: The timings of the scenario.
+    """
+    if scenario == 'progress':
+        try:
+            import flask  # noqa: F401
+        except ImportError:
+            return {'scenario': scenario, 'size': size, 'skipped': 'flask is not installed'}
+
+    runs = []
+    for _ in range(repeat):
+        run_dir = tempfile.mkdtemp(prefix=f"{scenario}_{size}_", dir=work_dir)
+        # Start every run cold, so repeats do not measure cache hits.
+        get_response_cache().clear()
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            runs.append(RUNNERS[scenario](size, run_dir))
+
+    seconds = [run['seconds'] for run in runs]
+    median = statistics.median(seconds)
+    result = {
+        'scenario': scenario,
+        'size': size,
+        'items': runs[0]['items'],
+        'seconds': seconds,
+        'median_seconds': median,
+        'items_per_second': runs[0]['items'] / median if median else None,
+        'passed': [run['passed'] for run in runs],
+        'spans': span_summary([span for run in runs for span in run['spans']]),
+    }
+    if 'submit_seconds' in runs[0]:
+        result['median_submit_seconds'] = statistics.median(run['submit_seconds'] for run in runs)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline pipeline benchmarks.")
+    parser.add_argument('--sizes', default='1,5,20', help="comma-separated numbers of modules per project")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per scenario and size")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="comma-separated scenarios to run")
+    parser.add_argument('--latency', type=float, default=0.0, help="fake provider seconds before the first token")
+    parser.add_argument('--token-latency', type=float, default=0.0, help="fake provider seconds between tokens")
+    parser.add_argument('--output', default='benchmark_results.json', help="results JSON path")
+    parser.add_argument('--verbose', action='store_true', help="show the output of the pipeline")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    scenarios = [scenario for scenario in args.scenarios.split(',') if scenario]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    output_path = os.path.abspath(args.output)
+
+    work_dir = tempfile.mkdtemp(prefix='autopywizard_benchmarks_')
+    # The web app keeps its job and state databases under the working directory.
+    os.chdir(work_dir)
+    os.environ.update({
+        'AUTOPYWIZARD_AI_PROVIDER': 'fake',
+        'AUTOPYWIZARD_FAKE_CORPUS': CORPUS_PATH,
+        'AUTOPYWIZARD_FAKE_LATENCY': str(args.latency),
+        'AUTOPYWIZARD_FAKE_TOKEN_LATENCY': str(args.token_latency),
+        'AUTOPYWIZARD_CACHE_PATH': os.path.join(work_dir, 'response_cache.sqlite3'),
+        'AUTOPYWIZARD_STATE_STORE': 'memory',
+    })
+
+    started = time.time()
+    results = []
+    for scenario in scenarios:
+        for size in sizes:
+            result = run_scenario(scenario, size, args.repeat, work_dir, verbose=args.verbose)
+            if 'skipped' in result:
+                print(f"{scenario} size={size}: skipped ({result['skipped']})")
+            else:
+                print(f"{scenario} size={size}: {result['median_seconds']:.3f}s median, {result['items_per_second']:.1f} items/s")
+            results.append(result)
+
+    if 'app' in sys.modules:
+        sys.modules['app'].job_queue.stop()
+    summary = {
+        'started_at': started,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {
+            'sizes': sizes,
+            'repeat': args.repeat,
+            'latency': args.latency,
+            'token_latency': args.token_latency,
+        },
+        'work_dir': work_dir,
+        'results': results,
+    }
+    with open(output_path, 'w', encoding='utf-8') as file:
+        json.dump(summary, file, indent=2)
+    print(f"Results written to '{output_path}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,24 @@
 import os
+from project_buffer import ProjectBuffer
 
 class CodeGenerator:
     """
     A class to handle saving generated code to files within a project directory.
+    Code is collected in an in-memory project buffer and written with flush().
     """
 
-    def __init__(self, project_name):
+    def __init__(self, project_name, base_dir=None):
         """
         Initialize the CodeGenerator with the project name.
         
         Args:
             project_name (str): The name of the project.
+            base_dir (str): The directory containing the project directory. Defaults to the working directory.
         """
         self.project_name = project_name
-        self.project_dir = os.path.join(os.getcwd(), project_name)
+        self.project_dir = os.path.join(base_dir or os.getcwd(), project_name)
         self.create_project_directory()
+        self.buffer = ProjectBuffer(self.project_dir)
 
     def create_project_directory(self):
         """
@@ -28,32 +32,30 @@ class CodeGenerator:
 
     def save_code_to_file(self, file_name, code):
         """
-        Save the generated code to a file within the project directory.
+        Replace the content of a file within the project directory.
         
         Args:
             file_name (str): The name of the file to save the code.
             code (str): The generated code.
         """
-        file_path = os.path.join(self.project_dir, file_name)
-        with open(file_path, 'w') as file:
-            file.write(code)
-        print(f"Code saved to '{file_path}'.")
+        self.buffer.module(file_name).replace(code)
 
     def save_class_code(self, class_name, code):
         """
-        Save the generated class code to a file within the project directory.
+        Save the generated class code to its module within the project directory.
+        Definitions already in the module are kept unless the code redefines them.
         
         Args:
             class_name (str): The name of the class.
             code (str): The generated class code.
         """
         file_name = f"{class_name.lower()}.py"
-        self.save_code_to_file(file_name, code)
+        self.save_definitions(file_name, code)
 
     def save_function_code(self, module_name, function_name, code):
         """
         Save the generated function code to a module file within the project directory.
-        If the module file already exists, append the function code to the file.
+        A function with the same name already in the module is replaced.
         
         Args:
             module_name (str): The name of the module (file).
@@ -61,10 +63,26 @@ class CodeGenerator:
             code (str): The generated function code.
         """
         file_name = f"{module_name.lower()}.py"
-        file_path = os.path.join(self.project_dir, file_name)
-        if os.path.exists(file_path):
-            with open(file_path, 'a') as file:
-                file.write("\n\n" + code)
-            print(f"Function '{function_name}' appended to '{file_path}'.")
-        else:
-            self.save_code_to_file(file_name, code)
+        self.save_definitions(file_name, code)
+
+    def save_definitions(self, file_name, code):
+        """
+        Merge generated definitions into a module file, replacing definitions with the same name.
+        
+        Args:
+            file_name (str): The name of the module file.
+            code (str): The generated code.
+        """
+        self.buffer.module(file_name).merge(code)
+
+    def flush(self):
+        """
+        Write the changed modules to disk.
+        
+        Returns:
+            list: The paths of the written files.
+        """
+        written = self.buffer.flush()
+        for file_path in written:
+            print(f"Code saved to '{file_path}'.")
+        return written
@@ -0,0 +1,282 @@
+import ast
+import builtins
+import re
+
+from instrumentation import instrumentation
+
+FENCE_PATTERN = re.compile(r'```[ \t]*([\w+-]*)[^\n]*\n(.*?)```', re.DOTALL)
+CODE_START_PATTERN = re.compile(r'(import|from|def|async def|class|@|#|if __name__)\b|[A-Za-z_]\w*\s*=')
+PYTHON_FENCE_LANGUAGES = ('', 'python', 'python3', 'py')
+MODULE_GLOBALS = {'__name__', '__file__', '__doc__', '__spec__', '__package__', '__loader__', '__builtins__'}
+
+
+def _parses(code):
+    try:
+        ast.parse(code)
+    except SyntaxError:
+        return False
+    return True
+
+
+def extract_code(response):
+    """
+    Extract the Python code from a model response: the fenced code blocks if there are
+    any, otherwise the response without the prose before and after the code.
+
+    Args:
+        response (str): The model response.
+
+    Returns:
+        str: The code.
+    """
+    blocks = FENCE_PATTERN.findall(response)
+    if blocks:
+        python_blocks = [code for language, code in blocks if language.lower() in PYTHON_FENCE_LANGUAGES]
+        return '\n\n'.join(code.strip('\n') for code in python_blocks or [code for _, code in blocks]) + '\n'
+    if _parses(response):
+        return response
+    lines = response.strip('\n').splitlines()
+    start = next((index for index, line in enumerate(lines) if CODE_START_PATTERN.match(line)), None)
+    if start is None:
+        return response
+    lines = lines[start:]
+    # Drop trailing unindented prose, e.g. "This function returns ..."
+    while lines and not _parses('\n'.join(lines)):
+        last = lines[-1]
+        if last.strip() and (last[0].isspace() or CODE_START_PATTERN.match(last)):
+            break
+        lines.pop()
+    return '\n'.join(lines).rstrip('\n') + '\n' if lines else response
+
+
+def bound_names(tree):
+    """
+    Collect every name a module binds anywhere: definitions, assignments, imports,
+    parameters, exception and pattern captures, and global declarations.
+
+    Args:
+        tree (ast.AST): The parsed code.
+
+    Returns:
+        set: The bound names.
+    """
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.alias):
+            names.add(node.asname or node.name.split('.')[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+
+def module_names(source):
+    """
+    Return the names bound by existing module source, or none if it does not parse.
+
+    Args:
+        source (str): The module source.
+
+    Returns:
+        set: The bound names.
+    """
+    try:
+        return bound_names(ast.parse(source))
+    except SyntaxError:
+        return set()
+
+
+def unresolved_names(tree, known_names=()):
+    """
+    Find the names the code reads but never binds, imports or gets from builtins.
+    Nothing is reported for code with a star import.
+
+    Args:
+        tree (ast.AST): The parsed code.
+        known_names (iterable): Names bound elsewhere in the target module.
+
+    Returns:
+        list: The unresolved names, sorted.
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and any(alias.name == '*' for alias in node.names):
+            return []
+    loaded = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)}
+    resolved = bound_names(tree) | set(known_names) | set(dir(builtins)) | MODULE_GLOBALS
+    return sorted(loaded - resolved)
+
+
+def validate_code(code, expected_name=None, known_names=()):
+    """
+    Check generated code without running it: it must parse and compile, define the
+    requested class or function, and not read unresolved names.
+
+    Args:
+        code (str): The extracted code.
+        expected_name (str): The name of the class or function the code must define, or None.
+        known_names (iterable): Names bound elsewhere in the target module.
+
+    Returns:
+        list: The problems found, empty if the code is valid.
+    """
+    try:
+        tree = ast.parse(code)
+        compile(tree, '<generated>', 'exec')
+    except SyntaxError as error:
+        return [f"SyntaxError: {error.msg} (line {error.lineno})"]
+    except ValueError as error:
+        return [f"Invalid code: {error}"]
+    problems = []
+    defined = {
+        node.name for node in tree.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+    }
+    if expected_name is not None and expected_name not in defined:
+        problems.append(f"The code does not define '{expected_name}'.")
+    unresolved = unresolved_names(tree, known_names)
+    if unresolved:
+        problems.append(f"Undefined names (missing imports or definitions): {', '.join(unresolved)}.")
+    return problems
+
+
+def parse_complete_prefix(code):
+    """
+    Parse the longest prefix of code that ends before a top-level statement and parses,
+    dropping e.g. a definition cut off by the completion token limit.
+
+    Args:
+        code (str): The code.
+
+    Returns:
+        tuple: The prefix and its ast.Module, or ('', None) if no prefix parses.
+    """
+    try:
+        return code, ast.parse(code)
+    except SyntaxError:
+        pass
+    lines = code.splitlines()
+    for end in range(len(lines) - 1, 0, -1):
+        if lines[end] and not lines[end][0].isspace():
+            prefix = '\n'.join(lines[:end])
+            try:
+                return prefix, ast.parse(prefix)
+            except SyntaxError:
+                continue
+    return '', None
+
+
+def split_definitions(response):
+    """
+    Split the code of a response to a packed prompt into its top-level definitions.
+    A response whose end does not parse keeps its complete leading statements.
+
+    Args:
+        response (str): The model response.
+
+    Returns:
+        tuple: The source of the other top-level statements (imports, constants and
+            the like), and a dict mapping the name of every top-level class and function
+            to its source, decorators included. Both are empty if no code parses.
+    """
+    code, tree = parse_complete_prefix(extract_code(response))
+    if tree is None:
+        return '', {}
+    lines = code.splitlines()
+    shared = []
+    definitions = {}
+    for node in tree.body:
+        start = node.lineno
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+            definitions[node.name] = '\n'.join(lines[start - 1:node.end_lineno])
+        else:
+            shared.append('\n'.join(lines[start - 1:node.end_lineno]))
+    return ('\n'.join(shared) + '\n\n' if shared else ''), definitions
+
+
+def build_feedback_prompt(prompt, code, problems):
+    """
+    Build the prompt asking the model to correct invalid output.
+
+    Args:
+        prompt (str): The original prompt.
+        code (str): The invalid code.
+        problems (list): The problems found by validate_code.
+
+    Returns:
+        str: The prompt.
+    """
+    return (
+        f"{prompt}\n\nYour previous answer was not valid:\n" + '\n'.join(f"- {problem}" for problem in problems)
+        + f"\n\nPrevious answer:\n{code}\n\nReturn only the corrected Python code, without explanations or markdown."
+    )
+
+
+class CodeValidator:
+    """
+    A class to check generated code before it is saved, and to ask the model again,
+    with the problems as feedback, when the code is invalid.
+    """
+
+    def __init__(self, ai_interaction, max_retries=2):
+        """
+        Initialize the CodeValidator.
+
+        Args:
+            ai_interaction (AIInteraction): The AI interaction used to regenerate invalid code.
+            max_retries (int): The maximum number of regeneration rounds.
+        """
+        self.ai_interaction = ai_interaction
+        self.max_retries = max_retries
+
+    def validate(self, prompts, responses, expected_names=None, known_names=None):
+        """
+        Extract and check the code of a batch of responses, regenerating the invalid ones.
+        Code that is still invalid after the last round is returned as extracted.
+
+        Args:
+            prompts (list): The prompts of the responses.
+            responses (list): The model responses.
+            expected_names (list): The name each response must define, or None, per response.
+            known_names (list): The names bound elsewhere in the target module, per response.
+
+        Returns:
+            list: The extracted code, in the same order as the responses.
+        """
+        expected_names = expected_names or [None] * len(responses)
+        known_names = known_names or [()] * len(responses)
+        with instrumentation.span('validation'):
+            codes = [extract_code(response) for response in responses]
+            problems = [
+                validate_code(code, expected, known)
+                for code, expected, known in zip(codes, expected_names, known_names)
+            ]
+        for _ in range(self.max_retries):
+            invalid = [index for index, found in enumerate(problems) if found]
+            if not invalid:
+                break
+            instrumentation.count('validation_retries', len(invalid))
+            print(f"Regenerating {len(invalid)} invalid item(s): {problems[invalid[0]][0]}")
+            regenerated = self.ai_interaction.generate_batch([
+                {'type': 'prompt', 'prompt': build_feedback_prompt(prompts[index], codes[index], problems[index])}
+                for index in invalid
+            ])
+            with instrumentation.span('validation'):
+                for index, response in zip(invalid, regenerated):
+                    codes[index] = extract_code(response)
+                    problems[index] = validate_code(codes[index], expected_names[index], known_names[index])
+        for index, found in enumerate(problems):
+            if found:
+                print(f"Keeping invalid code after {self.max_retries} regeneration(s): {'; '.join(found)}")
+        return codes
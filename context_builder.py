@@ -0,0 +1,288 @@
+import ast
+import os
+import re
+
+from generation_engine import estimate_tokens
+
+FRAME_PATTERN = re.compile(r'File "([^"]+)", line (\d+), in (\S+)')
+
+
+def parse_traceback_frames(traceback_info):
+    """
+    Parse the frames of a formatted traceback.
+
+    Args:
+        traceback_info (str): The traceback information.
+
+    Returns:
+        list: (file path, line number, function name) tuples, outermost first.
+    """
+    return [(path, int(line), name) for path, line, name in FRAME_PATTERN.findall(traceback_info)]
+
+
+def top_level_definitions(tree):
+    """
+    Return the top-level function and class definitions of a module by name.
+
+    Args:
+        tree (ast.Module): The parsed module.
+
+    Returns:
+        dict: Definition names mapped to their ast nodes.
+    """
+    return {
+        node.name: node for node in tree.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+    }
+
+
+def definition_signature(node):
+    """
+    Render the signature line of a function or class definition.
+
+    Args:
+        node (ast.AST): A FunctionDef, AsyncFunctionDef or ClassDef node.
+
+    Returns:
+        str: The signature, e.g. "def add(a, b)".
+    """
+    if isinstance(node, ast.ClassDef):
+        bases = ', '.join(ast.unparse(base) for base in node.bases)
+        return f"class {node.name}({bases})" if bases else f"class {node.name}"
+    prefix = 'async def' if isinstance(node, ast.AsyncFunctionDef) else 'def'
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns else ''
+    return f"{prefix} {node.name}({ast.unparse(node.args)}){returns}"
+
+
+class ContextBuilder:
+    """
+    A class to build compact fix prompts from the generated code: the failing
+    definitions, the signatures they call and the failing assertion, trimmed to a
+    token budget.
+    """
+
+    def __init__(self, project_dir, token_budget=1500):
+        """
+        Initialize the ContextBuilder.
+
+        Args:
+            project_dir (str): The project directory.
+            token_budget (int): The maximum estimated number of tokens of the context.
+        """
+        self.project_dir = os.path.abspath(project_dir)
+        self.token_budget = token_budget
+        self._trees = {}
+
+    def project_frames(self, traceback_info):
+        """
+        Return the traceback frames that belong to the project.
+
+        Args:
+            traceback_info (str): The traceback information.
+
+        Returns:
+            list: (file name relative to the project, line number, function name) tuples, outermost first.
+        """
+        frames = []
+        for path, line, name in parse_traceback_frames(traceback_info):
+            path = os.path.abspath(path)
+            if path.startswith(self.project_dir + os.sep):
+                frames.append((os.path.relpath(path, self.project_dir), line, name))
+        return frames
+
+    def _parse(self, file_name):
+        if file_name not in self._trees:
+            file_path = os.path.join(self.project_dir, file_name)
+            try:
+                with open(file_path, encoding='utf-8') as file:
+                    source = file.read()
+                self._trees[file_name] = (source, ast.parse(source, filename=file_path))
+            except (OSError, SyntaxError, ValueError):
+                self._trees[file_name] = (None, None)
+        return self._trees[file_name]
+
+    def enclosing_definition(self, file_name, line):
+        """
+        Find the top-level definition of a module that contains a line.
+
+        Args:
+            file_name (str): The file name relative to the project.
+            line (int): The line number.
+
+        Returns:
+            ast.AST: The definition node, or None.
+        """
+        source, tree = self._parse(file_name)
+        if tree is None:
+            return None
+        for node in top_level_definitions(tree).values():
+            start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+            if start <= line <= node.end_lineno:
+                return node
+        return None
+
+    def enclosing_function(self, file_name, line):
+        """
+        Find the innermost function or method of a module that contains a line.
+
+        Args:
+            file_name (str): The file name relative to the project.
+            line (int): The line number.
+
+        Returns:
+            ast.AST: The function node, or None.
+        """
+        source, tree = self._parse(file_name)
+        if tree is None:
+            return None
+        candidates = [
+            node for node in ast.walk(tree)
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.lineno <= line <= node.end_lineno
+        ]
+        return min(candidates, key=lambda node: node.end_lineno - node.lineno, default=None)
+
+    def called_names(self, node):
+        """
+        Collect the names called inside a definition.
+
+        Args:
+            node (ast.AST): The definition node.
+
+        Returns:
+            set: The called function, class and method names.
+        """
+        names = set()
+        for child in ast.walk(node):
+            if isinstance(child, ast.Call):
+                if isinstance(child.func, ast.Name):
+                    names.add(child.func.id)
+                elif isinstance(child.func, ast.Attribute):
+                    names.add(child.func.attr)
+        return names
+
+    def called_signatures(self, node, exclude=()):
+        """
+        Look up the signatures of the project definitions called inside a definition.
+
+        Args:
+            node (ast.AST): The definition node.
+            exclude (iterable): Names to leave out, e.g. the definitions already shown in full.
+
+        Returns:
+            list: The signature lines.
+        """
+        wanted = self.called_names(node) - set(exclude)
+        signatures = []
+        for root, dirs, files in os.walk(self.project_dir):
+            dirs[:] = [name for name in dirs if not name.startswith('.') and name != '__pycache__']
+            for file_name in sorted(files):
+                if not file_name.endswith('.py') or file_name.startswith('test'):
+                    continue
+                _, tree = self._parse(os.path.relpath(os.path.join(root, file_name), self.project_dir))
+                if tree is None:
+                    continue
+                for name, definition in top_level_definitions(tree).items():
+                    if name in wanted:
+                        signatures.append(definition_signature(definition))
+                    if isinstance(definition, ast.ClassDef):
+                        for member in definition.body:
+                            if isinstance(member, (ast.FunctionDef, ast.AsyncFunctionDef)) and member.name in wanted:
+                                signatures.append(f"{definition.name}.{definition_signature(member)}")
+        return signatures
+
+    def failing_definitions(self, file_name, records):
+        """
+        Find the definitions of a source file involved in the failing tests: the ones that
+        contain a traceback frame, or else the ones the failing test calls.
+
+        Args:
+            file_name (str): The file name relative to the project.
+            records (list): The failing test records.
+
+        Returns:
+            list: The definition nodes, in source order.
+        """
+        found = {}
+        source, tree = self._parse(file_name)
+        if tree is None:
+            return []
+        for record in records:
+            frames = self.project_frames(record['traceback'])
+            in_file = [frame for frame in frames if frame[0] == file_name]
+            for _, line, _ in in_file:
+                node = self.enclosing_definition(file_name, line)
+                if node is not None:
+                    found[node.name] = node
+            if in_file:
+                continue
+            # Nothing failed inside the file, e.g. a failed assertion in the test: use the
+            # definitions called by the failing test function.
+            definitions = top_level_definitions(tree)
+            for test_file, line, _ in frames:
+                test_node = self.enclosing_function(test_file, line)
+                if test_node is None:
+                    continue
+                for name in self.called_names(test_node):
+                    if name in definitions:
+                        found[name] = definitions[name]
+        return sorted(found.values(), key=lambda node: node.lineno)
+
+    def failure_summary(self, record):
+        """
+        Summarize a failing test: the failing line of the innermost project frame and the exception.
+
+        Args:
+            record (dict): The failing test record.
+
+        Returns:
+            str: The summary.
+        """
+        lines = [line for line in record['traceback'].strip().splitlines() if line.strip()]
+        exception_line = lines[-1] if lines else record['status']
+        frames = self.project_frames(record['traceback'])
+        if not frames:
+            return f"{record['id']}: {exception_line}"
+        file_name, line, name = frames[-1]
+        source, _ = self._parse(file_name)
+        code_line = source.splitlines()[line - 1].strip() if source and line <= len(source.splitlines()) else ''
+        return f"{record['id']}: {file_name}:{line} in {name}: {code_line}\n    {exception_line}"
+
+    def build(self, file_name, signatures):
+        """
+        Build the context of a fix prompt for one source file.
+
+        Args:
+            file_name (str): The file name relative to the project.
+            signatures (dict): Failure signatures mapped to the failing test records.
+
+        Returns:
+            str: The context, trimmed to the token budget.
+        """
+        # Files change between fix iterations, so parse them afresh for every prompt.
+        self._trees = {}
+        records = [records[0] for records in signatures.values()]
+        all_records = [record for records in signatures.values() for record in records]
+        source, _ = self._parse(file_name)
+        definitions = self.failing_definitions(file_name, all_records)
+
+        sections = ["Failures:\n" + '\n'.join(self.failure_summary(record) for record in records)]
+        if definitions:
+            sections.append("Failing code:\n" + '\n\n'.join(ast.get_source_segment(source, node) for node in definitions))
+            called = []
+            for node in definitions:
+                called.extend(self.called_signatures(node, exclude=[definition.name for definition in definitions]))
+            if called:
+                sections.append("Signatures of called code:\n" + '\n'.join(sorted(set(called))))
+        elif source:
+            sections.append("Current code:\n" + source)
+
+        context = ''
+        for section in sections:
+            candidate = f"{context}\n\n{section}" if context else section
+            if estimate_tokens(candidate) > self.token_budget:
+                remaining = self.token_budget * 4 - len(context)
+                if remaining > 0:
+                    context = (f"{context}\n\n" if context else '') + section[:remaining] + "\n..."
+                break
+            context = candidate
+        return context
@@ -0,0 +1,323 @@
+import os
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from code_generator import CodeGenerator
+from code_validator import CodeValidator, module_names
+from context_builder import ContextBuilder, parse_traceback_frames
+from generation_engine import estimate_tokens
+from instrumentation import instrumentation
+from project_buffer import ProjectBuffer
+from sandbox import project_sandbox
+from test_executor import TestExecutor, affected_test_modules, build_import_graph, discover_test_modules
+
+# Sampling temperatures of speculative fix candidates; the first uses the provider default.
+CANDIDATE_TEMPERATURES = (None, 0.4, 0.8, 1.0)
+
+
+def failure_signature(record):
+    """
+    Build a signature identifying the cause of a failing test, independent of the test
+    that hit it: the last line of the traceback (exception type and message) and the
+    innermost frame, with line numbers and memory addresses removed.
+
+    Args:
+        record (dict): The failing test record.
+
+    Returns:
+        str: The failure signature.
+    """
+    lines = [line for line in record['traceback'].strip().splitlines() if line.strip()]
+    exception_line = lines[-1] if lines else record['status']
+    frames = parse_traceback_frames(record['traceback'])
+    innermost = f"{os.path.basename(frames[-1][0])}:{frames[-1][2]}" if frames else record['module']
+    return re.sub(r'0x[0-9a-fA-F]+', '0x?', f"{innermost} {exception_line}")
+
+
+class FixScheduler:
+    """
+    A class to run the test-and-fix loop within a budget. Each iteration groups the
+    failing tests by source file and traceback signature and sends one consolidated
+    fix request per file. In speculative mode several candidate fixes are requested at
+    once and tested in parallel sandboxes, and only the best one is applied.
+    """
+
+    def __init__(self, test_runner, ai_interaction, max_iterations=10, max_seconds=None, max_tokens=None,
+                 max_repeats=2, context_token_budget=1500, candidates=1):
+        """
+        Initialize the FixScheduler.
+
+        Args:
+            test_runner (TestRunner): The test runner of the project.
+            ai_interaction (AIInteraction): The AI interaction used to request fixes.
+            max_iterations (int): The maximum number of fix iterations.
+            max_seconds (float): The maximum total duration in seconds. None means no limit.
+            max_tokens (int): The maximum estimated prompt and completion tokens. None means no limit.
+            max_repeats (int): Stop when the same set of failures has been seen this many times.
+            context_token_budget (int): The maximum estimated tokens of the code context in a fix prompt.
+            candidates (int): The number of candidate fixes per iteration. 1 applies every fix directly.
+        """
+        self.test_runner = test_runner
+        self.ai_interaction = ai_interaction
+        self.max_iterations = max_iterations
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.max_repeats = max_repeats
+        self.candidates = candidates
+        self.code_generator = CodeGenerator(test_runner.project_name, base_dir=os.path.dirname(test_runner.test_dir))
+        self.context_builder = ContextBuilder(test_runner.test_dir, token_budget=context_token_budget)
+        self.validator = CodeValidator(ai_interaction)
+        self.stats = []
+        self.stop_reason = None
+
+    def source_file_for(self, record):
+        """
+        Choose the project file to fix for a failing test: the innermost traceback frame in
+        the project that is not a test module, falling back to the test module itself.
+
+        Args:
+            record (dict): The failing test record.
+
+        Returns:
+            str: The file name relative to the project directory.
+        """
+        project_files = [file_name for file_name, _, _ in self.context_builder.project_frames(record['traceback'])]
+        for file_name in reversed(project_files):
+            if not os.path.basename(file_name).startswith('test'):
+                return file_name
+        # The failure surfaced in the test itself, e.g. a failed assertion: blame the code
+        # under test when the test module imports exactly one project module.
+        imported = sorted(
+            module_name for module_name in build_import_graph(self.test_runner.test_dir).get(record['module'], ())
+            if not module_name.rsplit('.', 1)[-1].startswith('test')
+        )
+        if len(imported) == 1:
+            return imported[0].replace('.', os.sep) + '.py'
+        return project_files[-1] if project_files else record['module'].replace('.', os.sep) + '.py'
+
+    def group_failures(self, failures):
+        """
+        Group failing test records by the source file to fix and by failure signature.
+
+        Args:
+            failures (list): The failing test records.
+
+        Returns:
+            dict: File names mapped to {signature: [records]}.
+        """
+        groups = {}
+        for record in failures:
+            file_name = self.source_file_for(record)
+            groups.setdefault(file_name, {}).setdefault(failure_signature(record), []).append(record)
+        return groups
+
+    def build_fix_prompt(self, file_name, signatures):
+        """
+        Build one consolidated fix prompt for a source file from a compact context of the
+        failing definitions, the signatures they call and the distinct failures.
+
+        Args:
+            file_name (str): The name of the file to fix.
+            signatures (dict): Failure signatures mapped to the failing test records.
+
+        Returns:
+            str: The prompt.
+        """
+        with instrumentation.span('prompt_build', kind='fix'):
+            context = self.context_builder.build(file_name, signatures)
+        return (
+            f"Fix the following errors in the Python module '{file_name}'. "
+            f"Return only the corrected functions and classes, with any imports they need.\n\n{context}"
+        )
+
+    def fix_file(self, file_name, signatures):
+        """
+        Request a fix for one file and merge it into the project buffer.
+
+        Args:
+            file_name (str): The name of the file to fix.
+            signatures (dict): Failure signatures mapped to the failing test records.
+
+        Returns:
+            int: The estimated number of tokens used.
+        """
+        prompt = self.build_fix_prompt(file_name, signatures)
+        # A cached answer to the same errors is the fix that already failed.
+        response = self.ai_interaction.generate_code(prompt, bypass_cache=True)
+        fixed_code = self.validator.validate(
+            [prompt], [response], known_names=[module_names(self.code_generator.buffer.module(file_name).source)]
+        )[0]
+        self.code_generator.save_definitions(file_name, fixed_code)
+        self.test_runner.changed_modules.add(os.path.splitext(file_name)[0].replace(os.sep, '.'))
+        return estimate_tokens(prompt) + estimate_tokens(fixed_code)
+
+    def candidate_generate_fn(self, index):
+        """
+        Return the generation function of a speculative candidate, sampling at its temperature.
+
+        Args:
+            index (int): The candidate index.
+
+        Returns:
+            callable: A function generating code for a prompt.
+        """
+        temperature = CANDIDATE_TEMPERATURES[index % len(CANDIDATE_TEMPERATURES)]
+        return lambda prompt: self.ai_interaction.generate_code(prompt, bypass_cache=True, temperature=temperature)
+
+    def evaluate_candidate(self, fixes, max_workers, cancel_event=None):
+        """
+        Apply candidate fixes to a sandbox copy of the project and run the affected tests there.
+
+        Args:
+            fixes (dict): File names mapped to the fixed code.
+            max_workers (int): The maximum number of concurrent test processes.
+            cancel_event (threading.Event): Once set, the test modules not started yet are skipped.
+
+        Returns:
+            tuple: The number of failing tests, the test modules run and their records, with
+                tracebacks pointing at the project instead of the sandbox.
+        """
+        project_dir = self.test_runner.test_dir
+        with project_sandbox(project_dir) as sandbox_dir:
+            buffer = ProjectBuffer(sandbox_dir)
+            for file_name, code in fixes.items():
+                buffer.module(file_name).merge(code)
+            buffer.flush()
+            changed_modules = {os.path.splitext(file_name)[0].replace(os.sep, '.') for file_name in fixes}
+            test_modules = affected_test_modules(
+                build_import_graph(sandbox_dir), discover_test_modules(sandbox_dir), changed_modules
+            )
+            executor = TestExecutor(
+                sandbox_dir, max_workers=max_workers, per_test_timeout=self.test_runner.executor.per_test_timeout,
+                python=self.test_runner.executor.python, worker_pool=self.test_runner.worker_pool
+            )
+            records = executor.run(test_modules, cancel_event=cancel_event)
+        for record in records:
+            record['traceback'] = record['traceback'].replace(sandbox_dir, project_dir)
+        failing = sum(1 for record in records if record['status'] not in ('passed', 'skipped'))
+        return failing, test_modules, records
+
+    def fix_files_speculatively(self, groups):
+        """
+        Request several candidate fixes for the failing files concurrently, test every
+        distinct candidate in its own sandbox in parallel, and apply the first candidate
+        that passes, or else the one with the fewest failing tests. The test results of
+        the applied candidate are recorded, so its tests are not run again.
+
+        Args:
+            groups (dict): File names mapped to {signature: [records]}.
+
+        Returns:
+            int: The estimated number of tokens used.
+        """
+        prompts = {file_name: self.build_fix_prompt(file_name, signatures) for file_name, signatures in groups.items()}
+        requests = [(index, file_name) for index in range(self.candidates) for file_name in prompts]
+        generated = self.ai_interaction.generation_engine().run(
+            [prompts[file_name] for _, file_name in requests],
+            generate_fns=[self.candidate_generate_fn(index) for index, _ in requests]
+        )
+        generated = self.validator.validate(
+            [prompts[file_name] for _, file_name in requests],
+            generated,
+            known_names=[module_names(self.code_generator.buffer.module(file_name).source) for _, file_name in requests]
+        )
+        candidates = []
+        for index in range(self.candidates):
+            fixes = {file_name: code for (candidate, file_name), code in zip(requests, generated) if candidate == index}
+            # Identical candidates, e.g. from a deterministic provider, are tested once.
+            if fixes not in candidates:
+                candidates.append(fixes)
+
+        max_workers = max(1, (os.cpu_count() or 1) // len(candidates))
+        cancel_event = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=len(candidates))
+        futures = {
+            executor.submit(self.evaluate_candidate, fixes, max_workers, cancel_event): index
+            for index, fixes in enumerate(candidates)
+        }
+        outcomes = {}
+        for future in as_completed(futures):
+            outcomes[futures[future]] = future.result()
+            if outcomes[futures[future]][0] == 0:
+                break
+        # Once one candidate passes, the others skip their remaining test modules. They are
+        # still waited for, as they share the warm worker pool the caller closes afterwards.
+        cancel_event.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        best = min(outcomes, key=lambda index: (outcomes[index][0], index))
+        _, test_modules, records = outcomes[best]
+
+        for file_name, code in candidates[best].items():
+            self.code_generator.save_definitions(file_name, code)
+        self.test_runner.record_results(test_modules, records)
+        print(f"Applied fix candidate {best + 1} of {len(candidates)} with {outcomes[best][0]} failing test(s).")
+        return sum(estimate_tokens(prompts[file_name]) for _, file_name in requests) + sum(
+            estimate_tokens(code) for code in generated
+        )
+
+    def run(self, check_cancelled=None):
+        """
+        Run tests and fix failures until all tests pass or a budget is exhausted.
+
+        Args:
+            check_cancelled (callable): Called before every test run and fix iteration;
+                raises to stop the loop.
+
+        Returns:
+            bool: True if all tests pass.
+        """
+        start = time.monotonic()
+        tokens_used = 0
+        seen_failure_sets = {}
+        iteration = 0
+        while True:
+            iteration_start = time.monotonic()
+            if check_cancelled is not None:
+                check_cancelled()
+            if self.test_runner.run_tests():
+                self.stop_reason = 'passed'
+                return True
+            failures = self.test_runner.failures()
+            groups = self.group_failures(failures)
+            failure_set = frozenset(signature for signatures in groups.values() for signature in signatures)
+            seen_failure_sets[failure_set] = seen_failure_sets.get(failure_set, 0) + 1
+
+            if iteration >= self.max_iterations:
+                self.stop_reason = 'max_iterations'
+            elif self.max_seconds is not None and time.monotonic() - start >= self.max_seconds:
+                self.stop_reason = 'max_seconds'
+            elif self.max_tokens is not None and tokens_used >= self.max_tokens:
+                self.stop_reason = 'max_tokens'
+            elif seen_failure_sets[failure_set] > self.max_repeats:
+                self.stop_reason = 'not_converging'
+            if self.stop_reason is not None:
+                print(f"Stopping the fix loop ({self.stop_reason}) with {len(failures)} failing test(s).")
+                return False
+
+            if check_cancelled is not None:
+                check_cancelled()
+            iteration += 1
+            iteration_tokens = 0
+            with instrumentation.span('fix_iteration'):
+                if self.candidates > 1:
+                    iteration_tokens += self.fix_files_speculatively(groups)
+                else:
+                    for file_name, signatures in groups.items():
+                        iteration_tokens += self.fix_file(file_name, signatures)
+                # Write all fixes of the iteration at once, so the next test run sees a consistent snapshot
+                self.code_generator.flush()
+            tokens_used += iteration_tokens
+            self.stats.append({
+                'iteration': iteration,
+                'failing_tests': len(failures),
+                'distinct_failures': len(failure_set),
+                'files_fixed': len(groups),
+                'tokens': iteration_tokens,
+                'seconds': time.monotonic() - iteration_start,
+            })
+            print(
+                f"Iteration {iteration}: {len(failures)} failing test(s), {len(failure_set)} distinct failure(s), "
+                f"{len(groups)} file(s) fixed, ~{iteration_tokens} tokens."
+            )
@@ -0,0 +1,187 @@
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RateLimiter:
+    """
+    A thread-safe token-bucket rate limiter for requests and tokens per minute.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        """
+        Initialize the RateLimiter.
+
+        Args:
+            requests_per_minute (int): The maximum number of requests per minute. None means no limit.
+            tokens_per_minute (int): The maximum number of tokens per minute. None means no limit.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute or 0)
+        self._token_allowance = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_allowance = min(
+                self.requests_per_minute,
+                self._request_allowance + elapsed * self.requests_per_minute / 60.0
+            )
+        if self.tokens_per_minute:
+            self._token_allowance = min(
+                self.tokens_per_minute,
+                self._token_allowance + elapsed * self.tokens_per_minute / 60.0
+            )
+
+    def acquire(self, tokens=0):
+        """
+        Block until one request using the given number of tokens is allowed.
+
+        Args:
+            tokens (int): The estimated number of tokens used by the request.
+        """
+        if self.tokens_per_minute:
+            # A single request larger than the whole budget can never fit; let it through
+            # once the bucket is full instead of waiting forever.
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                wait = 0.0
+                if self.requests_per_minute and self._request_allowance < 1:
+                    wait = max(wait, (1 - self._request_allowance) * 60.0 / self.requests_per_minute)
+                if self.tokens_per_minute and self._token_allowance < tokens:
+                    wait = max(wait, (tokens - self._token_allowance) * 60.0 / self.tokens_per_minute)
+                if wait == 0.0:
+                    if self.requests_per_minute:
+                        self._request_allowance -= 1
+                    if self.tokens_per_minute:
+                        self._token_allowance -= tokens
+                    return
+            time.sleep(wait)
+
+
+DEFAULT_RATE_LIMITS = {
+    'openai': {'requests_per_minute': 60, 'tokens_per_minute': 90000},
+    'gpt4all': {},
+}
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider, **limits):
+    """
+    Return the process-wide rate limiter of a provider, creating it on first use.
+
+    Args:
+        provider (str): The provider name, e.g. 'openai' or 'gpt4all'.
+        **limits: requests_per_minute and tokens_per_minute overriding the defaults.
+
+    Returns:
+        RateLimiter: The shared rate limiter of the provider.
+    """
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters or limits:
+            settings = dict(DEFAULT_RATE_LIMITS.get(provider, {}))
+            settings.update(limits)
+            _rate_limiters[provider] = RateLimiter(**settings)
+        return _rate_limiters[provider]
+
+
+def estimate_tokens(text):
+    """
+    Roughly estimate the number of tokens in a text (about four characters per token).
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated token count.
+    """
+    return max(1, len(text) // 4)
+
+
+class GenerationEngine:
+    """
+    A class to run a batch of generation jobs with bounded parallelism, rate limiting
+    and retries with exponential backoff.
+    """
+
+    def __init__(self, generate_fn, max_workers=1, rate_limiter=None, max_retries=3,
+                 backoff_base=1.0, backoff_max=30.0, completion_tokens=500):
+        """
+        Initialize the GenerationEngine.
+
+        Args:
+            generate_fn (callable): Called with a prompt and returns the generated text.
+            max_workers (int): The maximum number of concurrent calls. 1 serializes the jobs.
+            rate_limiter (RateLimiter): The rate limiter applied before every call.
+            max_retries (int): The number of retries after a failed call.
+            backoff_base (float): The initial backoff delay in seconds.
+            backoff_max (float): The maximum backoff delay in seconds.
+            completion_tokens (int): The expected completion size used for rate limiting.
+        """
+        self.generate_fn = generate_fn
+        self.max_workers = max(1, max_workers)
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.completion_tokens = completion_tokens
+
+    def run_one(self, prompt, generate_fn=None):
+        """
+        Run a single prompt with rate limiting and retries.
+
+        Args:
+            prompt (str): The prompt for the AI model.
+            generate_fn (callable): Overrides the engine's generate_fn for this prompt.
+
+        Returns:
+            str: The generated text.
+        """
+        generate_fn = generate_fn or self.generate_fn
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(estimate_tokens(prompt) + self.completion_tokens)
+            try:
+                return generate_fn(prompt)
+            except Exception as error:
+                if attempt >= self.max_retries:
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                delay += random.uniform(0, delay / 2)
+                print(f"Generation failed ({error}); retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                attempt += 1
+
+    def run(self, prompts, generate_fns=None):
+        """
+        Run a batch of prompts.
+
+        Args:
+            prompts (list): The prompts to run.
+            generate_fns (list): Optional per-prompt generate functions.
+
+        Returns:
+            list: The generated texts, in the same order as the prompts.
+        """
+        generate_fns = generate_fns or [None] * len(prompts)
+        if self.max_workers == 1 or len(prompts) <= 1:
+            return [self.run_one(prompt, generate_fn) for prompt, generate_fn in zip(prompts, generate_fns)]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(prompts))) as executor:
+            # Each call runs in a copy of the caller's context so per-run traces follow it
+            futures = [
+                executor.submit(contextvars.copy_context().run, self.run_one, prompt, generate_fn)
+                for prompt, generate_fn in zip(prompts, generate_fns)
+            ]
+            return [future.result() for future in futures]
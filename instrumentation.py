@@ -0,0 +1,222 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_current_trace = contextvars.ContextVar('autopywizard_trace', default=None)
+
+
+class _NullSpan:
+    """
+    The span returned while instrumentation is disabled; entering and leaving it does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+
+    def __init__(self, instrumentation, name, labels):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.instrumentation.record_span(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Trace:
+    """
+    The spans and counters recorded during one pipeline run.
+    """
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, seconds, labels):
+        with self._lock:
+            self.spans.append({
+                'name': name,
+                'start': time.perf_counter() - self._start - seconds,
+                'seconds': seconds,
+                'labels': labels,
+            })
+
+    def add_count(self, name, value, labels):
+        key = name + ''.join(f",{label}={labels[label]}" for label in sorted(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def to_dict(self):
+        """
+        Return the trace as a JSON-serializable dict.
+
+        Returns:
+            dict: The run id, start time, spans and counters.
+        """
+        with self._lock:
+            return {
+                'run_id': self.run_id,
+                'started_at': self.started_at,
+                'spans': list(self.spans),
+                'counters': dict(self.counters),
+            }
+
+
+class Instrumentation:
+    """
+    A lightweight recorder of pipeline timings and counters, exposed in the Prometheus
+    text format and as per-run JSON traces. When disabled, spans and counters cost a
+    single attribute check.
+    """
+
+    def __init__(self, enabled=True):
+        """
+        Initialize the Instrumentation.
+
+        Args:
+            enabled (bool): Flag to record spans and counters.
+        """
+        self.enabled = enabled
+        self._spans = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def span(self, name, **labels):
+        """
+        Time a block of code as a stage.
+
+        Args:
+            name (str): The stage name, e.g. 'generation'.
+            **labels: Extra labels, e.g. provider='openai'.
+
+        Returns:
+            A context manager recording the duration of the block.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, labels)
+
+    def record_span(self, name, seconds, **labels):
+        """
+        Record the duration of a stage measured by the caller.
+
+        Args:
+            name (str): The stage name.
+            seconds (float): The duration in seconds.
+            **labels: Extra labels.
+        """
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            count, total = self._spans.get(key, (0, 0.0))
+            self._spans[key] = (count + 1, total + seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(name, seconds, labels)
+
+    def count(self, name, value=1, **labels):
+        """
+        Increase a counter.
+
+        Args:
+            name (str): The counter name, e.g. 'cache_hits'.
+            value (int): The amount to add.
+            **labels: Extra labels.
+        """
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_count(name, value, labels)
+
+    @contextmanager
+    def trace(self, run_id, path=None):
+        """
+        Collect the spans and counters of one run, including those recorded by threads
+        started with copy_context(), and optionally write them to a JSON file.
+
+        Args:
+            run_id (str): The run id.
+            path (str): The path of the JSON trace file, or None to keep it in memory only.
+
+        Yields:
+            Trace: The trace of the run.
+        """
+        trace = Trace(run_id)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            if path is not None and self.enabled:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(path, 'w', encoding='utf-8') as file:
+                    json.dump(trace.to_dict(), file, indent=2)
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        escaped = [
+            '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in labels
+        ]
+        return '{' + ','.join(escaped) + '}'
+
+    def prometheus_text(self):
+        """
+        Render the recorded metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics.
+        """
+        with self._lock:
+            spans = dict(self._spans)
+            counters = dict(self._counters)
+        lines = [
+            '# HELP autopywizard_stage_seconds Time spent in each pipeline stage.',
+            '# TYPE autopywizard_stage_seconds summary',
+        ]
+        for (name, labels), (count, total) in sorted(spans.items()):
+            label_text = self._format_labels((('stage', name),) + labels)
+            lines.append(f"autopywizard_stage_seconds_sum{label_text} {total:.6f}")
+            lines.append(f"autopywizard_stage_seconds_count{label_text} {count}")
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE autopywizard_{name}_total counter")
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"autopywizard_{name}_total{self._format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+instrumentation = Instrumentation(enabled=os.environ.get('AUTOPYWIZARD_METRICS', '1') != '0')
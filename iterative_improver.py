@@ -1,30 +1,59 @@
+import os
 from test_runner import TestRunner
 from ai_interaction import AIInteraction
+from fix_scheduler import FixScheduler
 
 class IterativeImprover:
     """
     A class to handle iterative improvement of the generated code by running tests and fixing errors.
     """
 
-    def __init__(self, project_name):
+    def __init__(self, project_name, max_iterations=10, max_seconds=None, max_tokens=None, base_dir=None, ai_interaction=None,
+                 fix_candidates=None):
         """
         Initialize the IterativeImprover with the project name.
         
         Args:
             project_name (str): The name of the project.
+            max_iterations (int): The maximum number of fix iterations.
+            max_seconds (float): The maximum duration of the improvement process in seconds.
+            max_tokens (int): The maximum estimated number of tokens spent on fixes.
+            base_dir (str): The directory containing the project directory. Defaults to the working directory.
+            ai_interaction (AIInteraction): The AI interaction of the project; fixes use its 'fix' route.
+                Defaults to a new AIInteraction.
+            fix_candidates (int): The number of speculative fix candidates tested per iteration.
+                Defaults to AUTOPYWIZARD_FIX_CANDIDATES, or 1.
         """
         self.project_name = project_name
-        self.test_runner = TestRunner(project_name)
-        self.ai_interaction = AIInteraction()
+        self.test_runner = TestRunner(project_name, base_dir=base_dir)
+        self.ai_interaction = (ai_interaction or AIInteraction()).for_task('fix')
+        self.fix_scheduler = FixScheduler(
+            self.test_runner,
+            self.ai_interaction,
+            max_iterations=max_iterations,
+            max_seconds=max_seconds,
+            max_tokens=max_tokens,
+            candidates=fix_candidates or int(os.environ.get('AUTOPYWIZARD_FIX_CANDIDATES', '1'))
+        )
 
-    def improve_code(self):
+    def improve_code(self, check_cancelled=None):
         """
-        Run tests and iteratively improve the code until all tests pass.
+        Run tests and iteratively improve the code until all tests pass or the fix budget is exhausted.
+        
+        Args:
+            check_cancelled (callable): Called before every test run and fix iteration;
+                raises to stop the improvement process.
+        
+        Returns:
+            bool: True if all tests pass.
         """
-        all_tests_passed = self.test_runner.run_tests()
-
-        while not all_tests_passed:
-            print("Starting another iteration to fix errors...")
-            all_tests_passed = self.test_runner.run_tests()
+        try:
+            all_tests_passed = self.fix_scheduler.run(check_cancelled=check_cancelled)
+        finally:
+            self.test_runner.close()
 
-        print("All tests passed. Code improvement process is complete.")
+        if all_tests_passed:
+            print("All tests passed. Code improvement process is complete.")
+        else:
+            print(f"Code improvement stopped ({self.fix_scheduler.stop_reason}); some tests still fail.")
+        return all_tests_passed
@@ -0,0 +1,520 @@
+import importlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+DEFAULT_JOB_DB_PATH = os.path.join(os.getcwd(), '.autopywizard', 'jobs.sqlite3')
+
+# Handlers are referenced by import path so worker processes can resolve them too.
+JOB_HANDLERS = {
+    'generate_project': 'pipeline:run_project_job',
+}
+
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+# Payload keys removed once a job has finished, so credentials are not kept on disk
+SECRET_PAYLOAD_KEYS = ('api_key',)
+
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a running job when its cancellation has been requested.
+    Not an Exception, so retry and error handlers along the way let it through.
+    """
+
+
+def scrub_secrets(value):
+    """
+    Return a copy of a JSON value without the keys listed in SECRET_PAYLOAD_KEYS.
+
+    Args:
+        value: The JSON value.
+
+    Returns:
+        The scrubbed copy.
+    """
+    if isinstance(value, dict):
+        return {key: scrub_secrets(item) for key, item in value.items() if key not in SECRET_PAYLOAD_KEYS}
+    if isinstance(value, list):
+        return [scrub_secrets(item) for item in value]
+    return value
+
+
+def coalesce_token_events(events):
+    """
+    Join consecutive token events of the same generation job into one event.
+
+    Args:
+        events (list): The event dicts, in order.
+
+    Returns:
+        list: The coalesced events.
+    """
+    coalesced = []
+    for event in events:
+        previous = coalesced[-1] if coalesced else None
+        if (event.get('type') == 'token' and previous is not None and previous.get('type') == 'token'
+                and previous.get('job') == event.get('job')):
+            coalesced[-1] = dict(previous, token=previous['token'] + event['token'])
+        else:
+            coalesced.append(event)
+    return coalesced
+
+
+class JobContext:
+    """
+    The handle a running job uses to report progress and check for cancellation.
+    Token events are buffered and written in batches; other events are written at once.
+    """
+
+    def __init__(self, queue, job_id, flush_events=64, flush_seconds=0.25):
+        """
+        Initialize the JobContext.
+
+        Args:
+            queue (JobQueue): The queue running the job.
+            job_id (str): The job id.
+            flush_events (int): The number of buffered token events that triggers a write.
+            flush_seconds (float): The maximum time token events stay buffered.
+        """
+        self.queue = queue
+        self.job_id = job_id
+        self.flush_events = flush_events
+        self.flush_seconds = flush_seconds
+        self._pending = []
+        self._flushed_at = time.monotonic()
+
+    def emit(self, event_type, **data):
+        """
+        Record a progress event for the job.
+        Raises JobCancelled once cancellation has been requested, so long-running
+        handlers stop at their next write of progress events.
+
+        Args:
+            event_type (str): The event type, e.g. 'stage' or 'token'.
+            **data: The event payload.
+        """
+        self._pending.append(dict(data, type=event_type))
+        if (event_type != 'token' or len(self._pending) >= self.flush_events
+                or time.monotonic() - self._flushed_at >= self.flush_seconds):
+            self.check_cancelled()
+
+    def flush(self):
+        """
+        Write the buffered events.
+
+        Returns:
+            bool: True if cancellation of the job has been requested.
+        """
+        events, self._pending = coalesce_token_events(self._pending), []
+        self._flushed_at = time.monotonic()
+        return self.queue.add_events(self.job_id, events)
+
+    def check_cancelled(self):
+        """
+        Write the buffered events, and raise JobCancelled if cancellation of the job
+        has been requested.
+        """
+        if self.flush():
+            raise JobCancelled(self.job_id)
+
+
+class JobQueue:
+    """
+    A persistent job queue backed by SQLite, executed by in-process worker threads
+    or local worker processes. A running job holds a lease that its worker renews;
+    jobs whose lease expired, because their worker or server stopped, are run again.
+    """
+
+    def __init__(self, path=DEFAULT_JOB_DB_PATH, workers=2, mode='thread', poll_interval=0.5, lease_seconds=30.0):
+        """
+        Initialize the JobQueue.
+
+        Args:
+            path (str): The path of the SQLite database file.
+            workers (int): The number of workers.
+            mode (str): 'thread' for in-process workers or 'process' for worker processes.
+            poll_interval (float): The time in seconds an idle worker waits before polling again.
+            lease_seconds (float): How long a running job stays claimed without a heartbeat.
+        """
+        self.path = path
+        self.workers = workers
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        # Identifies the leases of this queue's workers
+        self.owner = uuid.uuid4().hex
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._workers = []
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            # WAL lets the web tier read job events while workers append them.
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL, "
+                "result TEXT, error TEXT, cancel_requested INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                "job_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL, PRIMARY KEY (job_id, seq))"
+            )
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (('owner', 'TEXT'), ('lease_expires', 'REAL')):
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def start(self):
+        """
+        Start the workers. Calling start again is a no-op. Interrupted jobs are claimed
+        again by any worker once their lease has expired.
+        """
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            for _ in range(self.workers):
+                if self.mode == 'process':
+                    worker = multiprocessing.Process(
+                        target=_process_worker, args=(self.path, self.poll_interval, self.lease_seconds), daemon=True
+                    )
+                else:
+                    worker = threading.Thread(target=self.work, daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def stop(self):
+        """
+        Stop the workers after their current job.
+        """
+        self._stop.set()
+        for worker in self._workers:
+            if isinstance(worker, multiprocessing.Process):
+                worker.terminate()
+
+    def submit(self, kind, payload):
+        """
+        Queue a new job.
+
+        Args:
+            kind (str): The job kind, a key of JOB_HANDLERS.
+            payload (dict): The JSON-serializable job arguments.
+
+        Returns:
+            str: The job id.
+        """
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, kind, payload, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(payload), now, now)
+            )
+        return job_id
+
+    def get(self, job_id):
+        """
+        Return the state of a job.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            dict: The job id, kind, status, result, error and timestamps, or None if unknown.
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT id, kind, status, result, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'kind': row[1],
+            'status': row[2],
+            'result': json.loads(row[3]) if row[3] is not None else None,
+            'error': row[4],
+            'created_at': row[5],
+            'updated_at': row[6],
+        }
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. A queued job is cancelled at once; a running job stops at its next progress event.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            bool: True if the job was still queued or running.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status = 'queued'",
+                (now, job_id)
+            )
+            if cursor.rowcount:
+                self._append_event(connection, job_id, {'type': 'cancelled'})
+                self._scrub_payload(connection, job_id)
+                return True
+            cursor = connection.execute(
+                "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = 'running'",
+                (now, job_id)
+            )
+            return bool(cursor.rowcount)
+
+    def is_cancel_requested(self, job_id):
+        """
+        Check whether cancellation of a job has been requested.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            bool: True if the job should stop.
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def add_event(self, job_id, event):
+        """
+        Append a progress event to a job.
+
+        Args:
+            job_id (str): The job id.
+            event (dict): The event.
+        """
+        self.add_events(job_id, [event])
+
+    def add_events(self, job_id, events):
+        """
+        Append progress events to a job in one transaction, and check for cancellation.
+
+        Args:
+            job_id (str): The job id.
+            events (list): The events, in order.
+
+        Returns:
+            bool: True if cancellation of the job has been requested.
+        """
+        with self._connect() as connection:
+            for event in events:
+                self._append_event(connection, job_id, event)
+            row = connection.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    @staticmethod
+    def _append_event(connection, job_id, event):
+        connection.execute(
+            "INSERT INTO job_events (job_id, seq, event) "
+            "SELECT ?, COALESCE(MAX(seq), -1) + 1, ? FROM job_events WHERE job_id = ?",
+            (job_id, json.dumps(event), job_id)
+        )
+
+    def events(self, job_id, offset=0):
+        """
+        Return the progress events of a job from the given offset.
+
+        Args:
+            job_id (str): The job id.
+            offset (int): The sequence number of the first event.
+
+        Returns:
+            list: (sequence number, event dict) tuples.
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT seq, event FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq", (job_id, offset)
+            ).fetchall()
+        return [(seq, json.loads(event)) for seq, event in rows]
+
+    def follow(self, job_id, offset=0, keepalive_seconds=15.0):
+        """
+        Yield the events of a job until it has finished.
+        None is yielded when no event arrived within the keep-alive interval.
+
+        Args:
+            job_id (str): The job id.
+            offset (int): The sequence number of the first event.
+            keepalive_seconds (float): The maximum time between two yielded items.
+
+        Yields:
+            tuple: (sequence number, event dict), or None as a keep-alive marker.
+        """
+        idle_since = time.monotonic()
+        while True:
+            events = self.events(job_id, offset)
+            for seq, event in events:
+                yield seq, event
+                offset = seq + 1
+            job = self.get(job_id)
+            if job is None or (job['status'] in FINISHED_STATUSES and not self.events(job_id, offset)):
+                return
+            if events:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= keepalive_seconds:
+                idle_since = time.monotonic()
+                yield None
+            time.sleep(self.poll_interval)
+
+    def claim(self):
+        """
+        Atomically take the oldest queued job, or running job whose lease has expired,
+        and mark it as running under a lease of this queue.
+
+        Returns:
+            tuple: (job id, kind, payload dict), or None if no job is queued.
+        """
+        connection = self._connect()
+        try:
+            connection.isolation_level = None
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = connection.execute(
+                "SELECT id, kind, payload FROM jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND (lease_expires IS NULL OR lease_expires < ?)) ORDER BY created_at LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, lease_expires = ?, updated_at = ? WHERE id = ?",
+                    (self.owner, now + self.lease_seconds, now, row[0])
+                )
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def renew_lease(self, job_id):
+        """
+        Extend the lease of a job run by this queue.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            bool: False if the job is no longer leased by this queue.
+        """
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, job_id, self.owner)
+            )
+        return bool(cursor.rowcount)
+
+    def _heartbeat(self, job_id, stopped):
+        while not stopped.wait(self.lease_seconds / 3):
+            self.renew_lease(job_id)
+
+    @staticmethod
+    def _scrub_payload(connection, job_id):
+        row = connection.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is not None:
+            connection.execute(
+                "UPDATE jobs SET payload = ? WHERE id = ?", (json.dumps(scrub_secrets(json.loads(row[0]))), job_id)
+            )
+
+    @staticmethod
+    def _compact_events(connection, job_id):
+        # Followers have read past a run of token events or read it whole; either way
+        # one event per run, kept at the sequence number of its first token, replays the same text.
+        rows = connection.execute(
+            "SELECT seq, event FROM job_events WHERE job_id = ? ORDER BY seq", (job_id,)
+        ).fetchall()
+        runs = []
+        for seq, event in rows:
+            event = json.loads(event)
+            previous = runs[-1] if runs else None
+            if (event.get('type') == 'token' and previous is not None and previous[1].get('type') == 'token'
+                    and previous[1].get('job') == event.get('job')):
+                previous[1]['token'] += event['token']
+                previous[2].append(seq)
+            else:
+                runs.append((seq, event, []))
+        for seq, event, merged in runs:
+            if merged:
+                connection.execute(
+                    "UPDATE job_events SET event = ? WHERE job_id = ? AND seq = ?", (json.dumps(event), job_id, seq)
+                )
+                connection.executemany(
+                    "DELETE FROM job_events WHERE job_id = ? AND seq = ?", [(job_id, other) for other in merged]
+                )
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+            self._scrub_payload(connection, job_id)
+            self._compact_events(connection, job_id)
+
+    def run_job(self, job_id, kind, payload):
+        """
+        Run a claimed job and record its outcome.
+
+        Args:
+            job_id (str): The job id.
+            kind (str): The job kind.
+            payload (dict): The job arguments.
+        """
+        context = JobContext(self, job_id)
+        stopped = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job_id, stopped), daemon=True).start()
+        try:
+            module_name, function_name = JOB_HANDLERS[kind].split(':')
+            handler = getattr(importlib.import_module(module_name), function_name)
+            result = handler(payload, context)
+        except JobCancelled:
+            context.flush()
+            self.add_event(job_id, {'type': 'cancelled'})
+            self._finish(job_id, 'cancelled')
+        except Exception as error:
+            traceback.print_exc()
+            context.flush()
+            self.add_event(job_id, {'type': 'error', 'message': str(error)})
+            self._finish(job_id, 'failed', error=str(error))
+        else:
+            # The result, e.g. whether the tests passed, lets followers report the outcome
+            context.flush()
+            self.add_event(job_id, dict(result, type='done') if isinstance(result, dict) else {'type': 'done'})
+            self._finish(job_id, 'succeeded', result=result)
+        finally:
+            stopped.set()
+
+    def work(self):
+        """
+        Run queued jobs until the queue is stopped.
+        """
+        while not self._stop.is_set():
+            claimed = self.claim()
+            if claimed is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.run_job(*claimed)
+
+
+def _process_worker(path, poll_interval, lease_seconds):
+    JobQueue(path, workers=0, poll_interval=poll_interval, lease_seconds=lease_seconds).work()
@@ -1,6 +1,9 @@
+import os
+
 from user_input import UserInput
 from ai_interaction import AIInteraction
 from code_generator import CodeGenerator
+from pipeline import generate_project_code, record_fixed_code
 from iterative_improver import IterativeImprover
 
 def main():
@@ -8,31 +11,39 @@ def main():
     project_details = UserInput.get_project_details()
     project_name = project_details['project_name']
 
-    # Initialize AI Interaction and Code Generator
-    ai_interaction = AIInteraction()
+    # Initialize AI Interaction and Code Generator. The settings come from the environment,
+    # so AUTOPYWIZARD_ROUTES applies here as in the web app and batch mode.
+    ai_settings = {
+        'ai_provider': os.environ.get('AUTOPYWIZARD_AI_PROVIDER', 'gpt4all'),
+        'model_name': 'wizardcoder-33b-v1.1.Q4_0.gguf',
+        'api_key': os.environ.get('OPENAI_API_KEY'),
+        'base_url': os.environ.get('OPENAI_BASE_URL'),
+    }
+    ai_interaction = AIInteraction.from_settings(ai_settings)
+    ai_interaction.start_session(project_details)
     code_generator = CodeGenerator(project_name)
 
-    # Get module and function details, generate code, and save it
+    # Get module and function details
+    modules = []
+    functions = []
     while True:
         module_details = UserInput.get_module_details()
-        class_name = module_details['module_name']
-        class_description = module_details['module_description']
-        class_code = ai_interaction.generate_class_code(class_name, class_description)
-        code_generator.save_class_code(class_name, class_code)
+        modules.append(module_details)
 
         function_details = UserInput.get_function_details()
-        function_name = function_details['function_name']
-        function_description = function_details['function_description']
-        function_code = ai_interaction.generate_function_code(function_name, function_description)
-        code_generator.save_function_code(class_name, function_name, function_code)
+        functions.append((module_details['module_name'], function_details))
 
         another_module = input("Do you want to add another module? (yes/no): ")
         if another_module.lower() != 'yes':
             break
 
+    # Generate the code for all modules and functions and save it
+    generate_project_code(ai_interaction.for_task('generation'), code_generator, modules, functions)
+
     # Initialize IterativeImprover and start the improvement process
-    iterative_improver = IterativeImprover(project_name)
+    iterative_improver = IterativeImprover(project_name, ai_interaction=ai_interaction)
     iterative_improver.improve_code()
+    record_fixed_code(ai_interaction, code_generator.project_dir)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,235 @@
+import os
+import threading
+from collections import OrderedDict
+
+from gpt4all import GPT4All
+from instrumentation import instrumentation
+
+DEFAULT_MODEL_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'gpt4all')
+
+
+class ModelRegistry:
+    """
+    A process-wide registry of loaded gpt4all models.
+    Each model is loaded once per (model name, load parameters) and shared by every
+    AIInteraction. Least-recently-used models are evicted when the memory budget is exceeded.
+    """
+
+    def __init__(self, memory_budget_bytes=None):
+        """
+        Initialize the ModelRegistry.
+
+        Args:
+            memory_budget_bytes (int): The maximum total size of loaded models in bytes.
+                None means no limit.
+        """
+        self.memory_budget_bytes = memory_budget_bytes
+        self._models = OrderedDict()
+        self._lock = threading.RLock()
+        self._load_locks = {}
+
+    @staticmethod
+    def make_key(model_name, **load_kwargs):
+        """
+        Build the registry key for a model and its load parameters.
+
+        Args:
+            model_name (str): The name of the model.
+            **load_kwargs: Extra keyword arguments passed to GPT4All.
+
+        Returns:
+            tuple: A hashable key.
+        """
+        return (model_name, tuple(sorted(load_kwargs.items())))
+
+    def get_model(self, model_name, **load_kwargs):
+        """
+        Return the loaded model, loading it on first use.
+
+        Args:
+            model_name (str): The name of the model.
+            **load_kwargs: Extra keyword arguments passed to GPT4All.
+
+        Returns:
+            GPT4All: The shared model instance.
+        """
+        key = self.make_key(model_name, **load_kwargs)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]['model']
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so other models stay available while a large
+        # model is read from disk; the per-key lock stops two threads loading the same one.
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key]['model']
+            size = self.estimate_model_size(model_name, load_kwargs.get('model_path'))
+            with self._lock:
+                self._make_room(size)
+            print(f"Loading model '{model_name}'...")
+            with instrumentation.span('model_load', model=model_name):
+                model = GPT4All(model=model_name, **load_kwargs)
+            if not size:
+                # The file was downloaded or found elsewhere; account for it now it is loaded
+                size = self.estimate_model_size(model_name, load_kwargs.get('model_path'), getattr(model, 'config', None))
+                with self._lock:
+                    self._make_room(size)
+            with self._lock:
+                self._models[key] = {'model': model, 'size': size, 'lock': threading.Lock(), 'session': {}}
+                self._models.move_to_end(key)
+            return model
+
+    def get_model_lock(self, model_name, **load_kwargs):
+        """
+        Return the lock that serializes generation on a shared model instance.
+
+        Args:
+            model_name (str): The name of the model.
+            **load_kwargs: Extra keyword arguments passed to GPT4All.
+
+        Returns:
+            threading.Lock: The generation lock of the model.
+        """
+        self.get_model(model_name, **load_kwargs)
+        key = self.make_key(model_name, **load_kwargs)
+        with self._lock:
+            return self._models[key]['lock']
+
+    def get_session_state(self, model_name, **load_kwargs):
+        """
+        Return the mutable chat session state of a shared model instance. It must only be
+        used while holding the generation lock of the model.
+
+        Args:
+            model_name (str): The name of the model.
+            **load_kwargs: Extra keyword arguments passed to GPT4All.
+
+        Returns:
+            dict: The session state, empty when no session is open.
+        """
+        self.get_model(model_name, **load_kwargs)
+        key = self.make_key(model_name, **load_kwargs)
+        with self._lock:
+            return self._models[key]['session']
+
+    def warm_up(self, model_names, **load_kwargs):
+        """
+        Load the given models ahead of the first request.
+
+        Args:
+            model_names (list): The names of the models to load.
+            **load_kwargs: Extra keyword arguments passed to GPT4All.
+        """
+        for model_name in model_names:
+            self.get_model(model_name, **load_kwargs)
+
+    def evict(self, model_name, **load_kwargs):
+        """
+        Drop a model from the registry.
+
+        Args:
+            model_name (str): The name of the model.
+            **load_kwargs: Extra keyword arguments passed to GPT4All.
+        """
+        key = self.make_key(model_name, **load_kwargs)
+        with self._lock:
+            entry = self._models.pop(key, None)
+        if entry is not None:
+            with entry['lock']:
+                self.close_session(entry['session'])
+
+    @staticmethod
+    def close_session(session):
+        """
+        Close a chat session state, see get_session_state. The caller must hold the
+        generation lock of the model.
+
+        Args:
+            session (dict): The session state; emptied when closed.
+        """
+        if session:
+            session['stack'].close()
+            session.clear()
+
+    def loaded_models(self):
+        """
+        Return the keys of the loaded models, least recently used first.
+
+        Returns:
+            list: The registry keys of the loaded models.
+        """
+        with self._lock:
+            return list(self._models.keys())
+
+    def _make_room(self, size):
+        """
+        Evict least-recently-used models until a model of the given size fits the budget.
+        Models that are generating are kept, and models with an open chat session are only
+        evicted, with their session closed, once the idle ones are gone. The caller must
+        hold the registry lock.
+
+        Args:
+            size (int): The size in bytes of the model about to be loaded.
+        """
+        if self.memory_budget_bytes is None:
+            return
+        used = sum(entry['size'] for entry in self._models.values())
+        for with_session in (False, True):
+            for key in list(self._models):
+                if used + size <= self.memory_budget_bytes:
+                    return
+                entry = self._models[key]
+                if bool(entry['session']) != with_session or not entry['lock'].acquire(blocking=False):
+                    continue
+                try:
+                    # The session holds the model; closing it lets the model be freed
+                    self.close_session(entry['session'])
+                    del self._models[key]
+                finally:
+                    entry['lock'].release()
+                used -= entry['size']
+                print(f"Evicted model '{key[0]}' from the model registry.")
+        if used + size > self.memory_budget_bytes:
+            print("The models generating now exceed the model memory budget.")
+
+    @staticmethod
+    def estimate_model_size(model_name, model_path=None, config=None):
+        """
+        Estimate the memory used by a model from the size of its weights file, resolved
+        the way gpt4all does, or else from its model config.
+
+        Args:
+            model_name (str): The name of the model.
+            model_path (str): The directory containing the model file.
+            config (dict): The config of the loaded model, whose 'path' is the weights
+                file and whose 'ramrequired' is the RAM it needs in GB.
+
+        Returns:
+            int: The estimated size in bytes, or 0 if neither the file nor the config is known.
+        """
+        file_names = [model_name]
+        if not os.path.splitext(model_name)[1]:
+            # gpt4all appends the extension when the name has none
+            file_names += [model_name + '.gguf', model_name + '.bin']
+        paths = [os.path.join(model_path or DEFAULT_MODEL_DIR, file_name) for file_name in file_names]
+        if config and config.get('path'):
+            paths.insert(0, config['path'])
+        for file_path in paths:
+            if os.path.isfile(file_path):
+                return os.path.getsize(file_path)
+        try:
+            return int(float((config or {}).get('ramrequired')) * 1024 ** 3)
+        except (TypeError, ValueError):
+            return 0
+
+
+def _budget_from_env():
+    value = os.environ.get('AUTOPYWIZARD_MODEL_MEMORY_BUDGET_MB')
+    return int(value) * 1024 * 1024 if value else None
+
+
+model_registry = ModelRegistry(memory_budget_bytes=_budget_from_env())
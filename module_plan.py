@@ -0,0 +1,175 @@
+import json
+import keyword
+
+MODULE_PLAN_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'module_name': {'type': 'string', 'description': 'A valid Python module name, e.g. "data_loader"'},
+        'module_description': {'type': 'string', 'minLength': 1},
+    },
+    'required': ['module_name', 'module_description'],
+}
+
+
+def build_module_plan_prompt(project_description):
+    """
+    Build the prompt asking for the module plan of a project as JSON Lines.
+
+    Args:
+        project_description (str): The description of the project.
+
+    Returns:
+        str: The prompt.
+    """
+    return (
+        f"Generate a list of modules with names and descriptions for a project with the following description: "
+        f"{project_description}\nAnswer in JSON Lines: one JSON object per line matching the schema "
+        f"{json.dumps(MODULE_PLAN_SCHEMA)}, and nothing else."
+    )
+
+
+def validate_module_entry(entry):
+    """
+    Check a parsed module entry against MODULE_PLAN_SCHEMA.
+
+    Args:
+        entry: The parsed JSON value.
+
+    Returns:
+        list: The problems found, empty if the entry is valid.
+    """
+    if not isinstance(entry, dict):
+        return ["The entry is not a JSON object."]
+    problems = [f"Missing '{key}'." for key in MODULE_PLAN_SCHEMA['required'] if key not in entry]
+    name = entry.get('module_name')
+    description = entry.get('module_description')
+    if 'module_name' in entry and (not isinstance(name, str) or not name.isidentifier() or keyword.iskeyword(name)):
+        problems.append(f"'{name}' is not a valid Python module name.")
+    if 'module_description' in entry and (not isinstance(description, str) or not description.strip()):
+        problems.append("The module description is empty.")
+    return problems
+
+
+class ModulePlanParser:
+    """
+    An incremental parser of a streamed module plan. JSON objects are picked out of the
+    text as soon as their closing brace arrives, whether the model answers in JSON Lines,
+    a JSON array or a code block; prose between the objects is ignored. Every object is
+    validated, and invalid or repeated modules are rejected.
+    """
+
+    def __init__(self):
+        """
+        Initialize the ModulePlanParser.
+        """
+        self.modules = []
+        self.rejected = []
+        self._names = set()
+        self._object = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text):
+        """
+        Parse the next chunk of the response.
+
+        Args:
+            text (str): The chunk.
+
+        Returns:
+            list: The valid modules completed by the chunk, as module details dicts.
+        """
+        completed = []
+        for char in text:
+            if self._depth == 0:
+                if char == '{':
+                    self._object = [char]
+                    self._depth = 1
+                continue
+            self._object.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    module = self._parse(''.join(self._object))
+                    if module is not None:
+                        completed.append(module)
+        return completed
+
+    def close(self):
+        """
+        Finish parsing; an object left open by the response is rejected.
+        """
+        if self._depth:
+            self.rejected.append({'text': ''.join(self._object), 'problems': ["The object is incomplete."]})
+            self._depth = 0
+            self._in_string = self._escaped = False
+
+    def _parse(self, text):
+        try:
+            entry = json.loads(text)
+        except ValueError as error:
+            self.rejected.append({'text': text, 'problems': [f"Invalid JSON: {error}"]})
+            return None
+        problems = validate_module_entry(entry)
+        if not problems and entry['module_name'] in self._names:
+            problems = [f"Module '{entry['module_name']}' is listed twice."]
+        if problems:
+            self.rejected.append({'text': text, 'problems': problems})
+            return None
+        module = {
+            'module_name': entry['module_name'],
+            'module_description': entry['module_description'].strip(),
+        }
+        self._names.add(module['module_name'])
+        self.modules.append(module)
+        return module
+
+
+def parse_module_plan(response):
+    """
+    Parse a complete module plan response.
+
+    Args:
+        response (str): The model response.
+
+    Returns:
+        tuple: The valid modules and the rejected entries.
+    """
+    parser = ModulePlanParser()
+    parser.feed(response)
+    parser.close()
+    return parser.modules, parser.rejected
+
+
+def stream_module_plan(ai_interaction, project_description, parser=None):
+    """
+    Stream the module plan of a project, yielding every valid module as soon as the model
+    has written it.
+
+    Args:
+        ai_interaction (AIInteraction): The AI interaction used for the plan.
+        project_description (str): The description of the project.
+        parser (ModulePlanParser): The parser to use, whose rejected entries the caller
+            can read afterwards. Defaults to a new parser.
+
+    Yields:
+        dict: The module details dicts.
+    """
+    parser = parser or ModulePlanParser()
+    for token in ai_interaction.stream_code(build_module_plan_prompt(project_description)):
+        yield from parser.feed(token)
+    parser.close()
+    if parser.rejected:
+        print(f"Rejected {len(parser.rejected)} invalid module plan entr{'y' if len(parser.rejected) == 1 else 'ies'}.")
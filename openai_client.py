@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+
+
+class OpenAIClient:
+    """
+    A client for an OpenAI-compatible API with one set of credentials. Requests share a
+    pooled keep-alive HTTP session, so connections and TLS sessions are reused, and the
+    model list is cached for a while. Clients are safe to use from several threads.
+    """
+
+    def __init__(self, api_key, base_url=None, timeout=None, connect_timeout=None, pool_size=16, models_ttl=None):
+        """
+        Initialize the OpenAIClient.
+
+        Args:
+            api_key (str): The API key.
+            base_url (str): The base URL of the API. Defaults to the OpenAI API.
+            timeout (float): Seconds to wait for a response. Defaults to
+                AUTOPYWIZARD_OPENAI_TIMEOUT, or 60.
+            connect_timeout (float): Seconds to wait for a connection. Defaults to
+                AUTOPYWIZARD_OPENAI_CONNECT_TIMEOUT, or 10.
+            pool_size (int): The maximum number of kept-alive connections.
+            models_ttl (float): Seconds the model list is cached. Defaults to
+                AUTOPYWIZARD_MODELS_TTL, or 300.
+        """
+        self.api_key = api_key
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
+        self.timeout = (
+            connect_timeout if connect_timeout is not None
+            else float(os.environ.get('AUTOPYWIZARD_OPENAI_CONNECT_TIMEOUT', '10')),
+            timeout if timeout is not None else float(os.environ.get('AUTOPYWIZARD_OPENAI_TIMEOUT', '60')),
+        )
+        self.models_ttl = models_ttl if models_ttl is not None else float(os.environ.get('AUTOPYWIZARD_MODELS_TTL', '300'))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Authorization'] = f"Bearer {api_key}"
+        self._models = None
+        self._models_expiry = 0.0
+        self._models_lock = threading.Lock()
+
+    def _post(self, path, payload, stream=False):
+        response = self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout, stream=stream)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            # An unread streamed error body would keep its pooled connection busy
+            response.close()
+            raise
+        return response
+
+    def list_models(self):
+        """
+        Return the ids of the available models, from the cache while it is fresh.
+
+        Returns:
+            list: The model ids.
+        """
+        with self._models_lock:
+            if self._models is None or time.monotonic() >= self._models_expiry:
+                response = self.session.get(f"{self.base_url}/models", timeout=self.timeout)
+                response.raise_for_status()
+                self._models = [model['id'] for model in response.json()['data']]
+                self._models_expiry = time.monotonic() + self.models_ttl
+            return list(self._models)
+
+    def complete(self, model, prompt, max_tokens, temperature=None):
+        """
+        Request a completion.
+
+        Args:
+            model (str): The model name.
+            prompt (str): The prompt.
+            max_tokens (int): The completion token limit.
+            temperature (float): The sampling temperature, or None for the API default.
+
+        Returns:
+            str: The completion text.
+        """
+        payload = {'model': model, 'prompt': prompt, 'max_tokens': max_tokens}
+        if temperature is not None:
+            payload['temperature'] = temperature
+        return self._post('/completions', payload).json()['choices'][0]['text']
+
+    def stream_completion(self, model, prompt, max_tokens):
+        """
+        Request a completion as a stream of server-sent events.
+
+        Args:
+            model (str): The model name.
+            prompt (str): The prompt.
+            max_tokens (int): The completion token limit.
+
+        Yields:
+            str: The text of every chunk.
+        """
+        response = self._post('/completions', {'model': model, 'prompt': prompt, 'max_tokens': max_tokens, 'stream': True}, stream=True)
+        # Closing the response returns the connection to the pool, also when the caller stops early
+        with response:
+            # Server-sent events are UTF-8; decoding by the response charset would fall back to ISO-8859-1
+            for line in response.iter_lines():
+                line = line.decode('utf-8')
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                yield json.loads(data)['choices'][0]['text']
+
+    def close(self):
+        """
+        Close the pooled connections.
+        """
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_openai_client(api_key, base_url=None):
+    """
+    Return the process-wide client of a set of credentials, creating it on first use.
+
+    Args:
+        api_key (str): The API key.
+        base_url (str): The base URL of the API. Defaults to the OpenAI API.
+
+    Returns:
+        OpenAIClient: The shared client.
+    """
+    key = (api_key, (base_url or DEFAULT_BASE_URL).rstrip('/'))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = OpenAIClient(api_key, base_url)
+        return _clients[key]
@@ -0,0 +1,196 @@
+import os
+import uuid
+
+from ai_interaction import AIInteraction
+from code_generator import CodeGenerator
+from code_validator import CodeValidator, module_names
+from instrumentation import instrumentation
+from iterative_improver import IterativeImprover
+from project_buffer import ProjectBuffer
+from requirements_manager import RequirementsManager
+from spec_manifest import SpecManifest
+
+TRACE_FILE_NAME = '.autopywizard_trace.json'
+
+
+def build_generation_jobs(modules, functions):
+    """
+    Build the generation jobs for a project: one class job per module, then one
+    function job per function.
+
+    Args:
+        modules (list): The module details dicts.
+        functions (list): (module_name, function details dict) tuples.
+
+    Returns:
+        list: The generation jobs for AIInteraction.generate_batch.
+    """
+    return [
+        {
+            'type': 'class',
+            'module': module['module_name'],
+            'name': module['module_name'],
+            'description': module['module_description'],
+        }
+        for module in modules
+    ] + [
+        {
+            'type': 'function',
+            'module': module_name,
+            'name': function['function_name'],
+            'description': function['function_description'],
+        }
+        for module_name, function in functions
+    ]
+
+
+def generate_project_code(ai_interaction, code_generator, modules, functions, emit=None):
+    """
+    Generate the code of the modules and functions that were added or changed since the
+    last run, as one batch, and save it. Items whose spec and code are unchanged are kept,
+    and code of items removed from the spec is deleted.
+
+    Args:
+        ai_interaction (AIInteraction): The AI interaction used for generation.
+        code_generator (CodeGenerator): The code generator used to save the code.
+        modules (list): The module details dicts.
+        functions (list): (module_name, function details dict) tuples.
+        emit (callable): Optional progress callback, see run_project. When given, the
+            generated tokens of every job are streamed through it.
+    """
+    all_jobs = build_generation_jobs(modules, functions)
+    manifest = SpecManifest(code_generator.project_dir, preamble=ai_interaction.session_preamble)
+    jobs = [all_jobs[index] for index in manifest.changed_jobs(all_jobs, code_generator.buffer)]
+    print(f"Generating {len(jobs)} of {len(all_jobs)} item(s); the rest are unchanged.")
+
+    on_token = None
+    if emit is not None:
+        for index, job in enumerate(jobs):
+            emit('job', job=index, job_type=job['type'], name=job['name'])
+        on_token = lambda index, token: emit('token', job=index, token=token)
+    # Items of the same module are requested together, with fewer and larger prompts
+    generated_code = ai_interaction.generate_packed(jobs, on_token=on_token)
+
+    # Check the code before saving it, so invalid output is regenerated now instead of
+    # failing the next test run. Names of the other items of a module count as defined.
+    module_items = {}
+    for job in all_jobs:
+        module_items.setdefault(job['module'], set()).add(job['name'])
+    generated_code = CodeValidator(ai_interaction).validate(
+        [ai_interaction.build_job_prompt(job) for job in jobs],
+        generated_code,
+        expected_names=[job['name'] for job in jobs],
+        known_names=[
+            module_items[job['module']] | module_names(code_generator.buffer.module(f"{job['module'].lower()}.py").source)
+            for job in jobs
+        ]
+    )
+
+    # Results come back in submission order, so each module starts with its class and
+    # the functions are merged in after it.
+    for job, code in zip(jobs, generated_code):
+        if job['type'] == 'class':
+            code_generator.save_class_code(job['name'], code)
+        else:
+            code_generator.save_function_code(job['module'], job['name'], code)
+        manifest.record(job, code_generator.buffer)
+
+    for item in manifest.removed_items(all_jobs):
+        code_generator.buffer.module(item['file']).remove_definition(item['name'])
+
+    code_generator.flush()
+    manifest.update(all_jobs, {'modules': modules, 'functions': functions})
+    # Later items merged into a module may have changed the code recorded for earlier ones
+    manifest.refresh(code_generator.buffer)
+    manifest.save()
+
+
+def record_fixed_code(ai_interaction, project_dir):
+    """
+    Record the code on disk after the test-and-fix loop in the spec manifest, so the fixes
+    are not taken for manual edits and regenerated by the next run.
+
+    Args:
+        ai_interaction (AIInteraction): The AI interaction the project was generated with.
+        project_dir (str): The project directory.
+    """
+    manifest = SpecManifest(project_dir, preamble=ai_interaction.session_preamble)
+    manifest.refresh(ProjectBuffer(project_dir))
+    manifest.save()
+
+
+def run_project(project_details, modules, functions, ai_settings, emit, base_dir=None, run_id=None, check_cancelled=None):
+    """
+    Run the whole generation pipeline for a project: code generation, installation of
+    the project requirements and the iterative test-and-fix loop. Progress is reported
+    through emit, and the timings of the run are written to a JSON trace in the
+    project directory.
+
+    Args:
+        project_details (dict): The project name and description.
+        modules (list): The module details dicts.
+        functions (list): (module_name, function details dict) tuples.
+        ai_settings (dict): The AI provider, model name and OpenAI credentials.
+        emit (callable): Called with an event type and keyword payload for every progress event.
+        base_dir (str): The directory containing the project directory. Defaults to the working directory.
+        run_id (str): The id of the run in the trace. Defaults to a new uuid.
+        check_cancelled (callable): Called during the long stages; raises to stop the run.
+
+    Returns:
+        dict: The project name, whether all tests passed, why the fix loop stopped and the path of the trace.
+    """
+    project_name = project_details['project_name']
+    trace_path = os.path.join(base_dir or os.getcwd(), project_name, TRACE_FILE_NAME)
+    with instrumentation.trace(run_id or uuid.uuid4().hex, path=trace_path):
+        with instrumentation.span('pipeline'):
+            all_tests_passed, stop_reason = _run_stages(
+                project_details, modules, functions, ai_settings, emit, base_dir, check_cancelled
+            )
+    return {
+        'project_name': project_name,
+        'all_tests_passed': all_tests_passed,
+        'stop_reason': stop_reason,
+        'trace_path': trace_path,
+    }
+
+
+def _run_stages(project_details, modules, functions, ai_settings, emit, base_dir, check_cancelled):
+    emit('stage', stage='generation')
+    ai_interaction = AIInteraction.from_settings(ai_settings)
+    ai_interaction.start_session(project_details)
+
+    code_generator = CodeGenerator(project_details['project_name'], base_dir=base_dir)
+    generate_project_code(ai_interaction.for_task('generation'), code_generator, modules, functions, emit=emit)
+
+    requirements_manager = RequirementsManager(project_details['project_name'], base_dir=base_dir)
+    if os.path.exists(requirements_manager.requirements_path):
+        emit('stage', stage='requirements')
+        emit('requirements', **requirements_manager.install_requirements(check_cancelled=check_cancelled))
+
+    emit('stage', stage='improvement')
+    iterative_improver = IterativeImprover(project_details['project_name'], base_dir=base_dir, ai_interaction=ai_interaction)
+    all_tests_passed = iterative_improver.improve_code(check_cancelled=check_cancelled)
+    record_fixed_code(ai_interaction, code_generator.project_dir)
+    return all_tests_passed, iterative_improver.fix_scheduler.stop_reason
+
+
+def run_project_job(payload, context):
+    """
+    Job handler running run_project for a queued 'generate_project' job.
+
+    Args:
+        payload (dict): The project_details, modules, functions and ai_settings.
+        context (JobContext): The context of the running job.
+
+    Returns:
+        dict: The project name, whether all tests passed, why the fix loop stopped and the path of the trace.
+    """
+    return run_project(
+        payload['project_details'],
+        payload['modules'],
+        [tuple(item) for item in payload['functions']],
+        payload['ai_settings'],
+        context.emit,
+        run_id=context.job_id,
+        check_cancelled=context.check_cancelled
+    )
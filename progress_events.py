@@ -0,0 +1,15 @@
+import json
+
+
+def format_sse(event_id, event):
+    """
+    Format an event as a server-sent-events message.
+
+    Args:
+        event_id (int): The event id, used by the browser as Last-Event-ID on reconnect.
+        event (dict): The event.
+
+    Returns:
+        str: The SSE message.
+    """
+    return f"id: {event_id}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
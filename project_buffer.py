@@ -0,0 +1,366 @@
+import ast
+import hashlib
+import os
+import re
+import tempfile
+
+from instrumentation import instrumentation
+
+DEFINITION_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+DEFINITION_LINE = re.compile(r'(?:async\s+def|def|class)\s+(\w+)')
+
+
+def statement_key(node):
+    """
+    Return the key under which a top-level statement replaces an existing one: the
+    assigned names of an assignment, or the test of an if statement (such as the
+    __main__ guard).
+
+    Args:
+        node (ast.stmt): The statement.
+
+    Returns:
+        tuple: The key, or None if the statement never replaces another one.
+    """
+    if isinstance(node, ast.Assign) and all(isinstance(target, ast.Name) for target in node.targets):
+        return ('assign',) + tuple(sorted(target.id for target in node.targets))
+    if isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+        return ('assign', node.target.id)
+    if isinstance(node, ast.If):
+        return ('if', ast.unparse(node.test))
+    return None
+
+
+def merge_definitions(source, code):
+    """
+    Merge generated code into existing module source: top-level functions and classes
+    replace the definitions with the same name, new ones are appended, and missing
+    imports are added after the existing imports. Other top-level statements, such as
+    constants, replace the assignment to the same names or the if statement with the
+    same test, and are otherwise added after the imports.
+    
+    Args:
+        source (str): The existing module source.
+        code (str): The generated code.
+    
+    Returns:
+        str: The merged source.
+    
+    Raises:
+        SyntaxError: If either source does not parse.
+    """
+    old_tree = ast.parse(source)
+    new_tree = ast.parse(code)
+    lines = source.splitlines()
+    old_definitions = {
+        node.name: node for node in old_tree.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+    }
+    old_imports = {ast.unparse(node) for node in old_tree.body if isinstance(node, (ast.Import, ast.ImportFrom))}
+    old_statements = {
+        statement_key(node): node for node in old_tree.body
+        if not isinstance(node, DEFINITION_TYPES) and statement_key(node) is not None
+    }
+    old_texts = {ast.unparse(node) for node in old_tree.body}
+
+    replacements = []
+    appended = []
+    imports = []
+    statements = []
+    for node in new_tree.body:
+        segment = ast.get_source_segment(code, node, padded=True)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            if node.decorator_list:
+                segment = '\n'.join(code.splitlines()[node.decorator_list[0].lineno - 1:node.end_lineno])
+            old = old_definitions.get(node.name)
+            if old is not None:
+                start = min([old.lineno] + [decorator.lineno for decorator in old.decorator_list])
+                replacements.append((start, old.end_lineno, segment))
+            else:
+                appended.append(segment)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            if ast.unparse(node) not in old_imports:
+                imports.append(segment)
+        elif isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            # Docstrings of generated snippets
+            continue
+        elif statement_key(node) in old_statements:
+            old = old_statements[statement_key(node)]
+            replacements.append((old.lineno, old.end_lineno, segment))
+        elif ast.unparse(node) not in old_texts:
+            statements.append(segment)
+
+    if imports or statements:
+        import_end = max(
+            [node.end_lineno for node in old_tree.body if isinstance(node, (ast.Import, ast.ImportFrom))] or [0]
+        )
+        if not statements:
+            inserted = imports
+        elif import_end or imports:
+            inserted = imports + [''] + statements
+        else:
+            inserted = statements + ['', '']
+        # An insertion is an empty range right after the imports
+        replacements.append((import_end + 1, import_end, '\n'.join(inserted) + '\n'))
+    # Replace from the bottom up so earlier line numbers stay valid
+    for start, end, segment in sorted(replacements, reverse=True):
+        lines[start - 1:end] = segment.splitlines()
+    merged = '\n'.join(lines).rstrip('\n')
+    for segment in appended:
+        merged += "\n\n\n" + segment
+    return merged + "\n"
+
+
+def merge_definitions_by_text(source, code):
+    """
+    Merge generated code into module source that does not parse. Top-level definitions
+    are found by their unindented 'def' or 'class' line, decorators included, and end
+    before the next unindented line; the generated definitions replace the ones with
+    the same name, missing imports are added after the existing imports, and everything
+    else in the generated code is appended.
+
+    Args:
+        source (str): The existing module source, which need not parse.
+        code (str): The generated code.
+
+    Returns:
+        str: The merged source.
+
+    Raises:
+        SyntaxError: If the generated code does not parse.
+    """
+    new_tree = ast.parse(code)
+    lines = source.splitlines()
+    # Unindented lines start a top-level statement; decorators belong to the next one
+    starts = [number for number, line in enumerate(lines) if line.strip() and line[0] not in ' \t#)]}']
+    starts = [number for index, number in enumerate(starts) if index == 0 or not lines[starts[index - 1]].startswith('@')]
+    blocks = {}
+    for start, next_start in zip(starts, starts[1:] + [len(lines)]):
+        first = start
+        while first < next_start - 1 and lines[first].startswith('@'):
+            first += 1
+        match = DEFINITION_LINE.match(lines[first])
+        if match:
+            end = next_start
+            while end > start and (not lines[end - 1].strip() or lines[end - 1].startswith('#')):
+                end -= 1
+            blocks[match.group(1)] = (start, end)
+
+    replacements = []
+    imports = []
+    appended = []
+    for node in new_tree.body:
+        first = node.decorator_list[0].lineno if isinstance(node, DEFINITION_TYPES) and node.decorator_list else node.lineno
+        segment = '\n'.join(code.splitlines()[first - 1:node.end_lineno])
+        if isinstance(node, DEFINITION_TYPES) and node.name in blocks:
+            replacements.append(blocks[node.name] + (segment,))
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            if segment not in lines:
+                imports.append(segment)
+        else:
+            appended.append(segment)
+    if imports:
+        import_end = max([number + 1 for number in starts if lines[number].startswith(('import ', 'from '))] or [0])
+        replacements.append((import_end, import_end, '\n'.join(imports)))
+    for start, end, segment in sorted(replacements, reverse=True):
+        lines[start:end] = segment.splitlines()
+    merged = '\n'.join(lines).rstrip('\n')
+    for segment in appended:
+        merged += "\n\n\n" + segment
+    return merged + "\n"
+
+
+def content_hash(content):
+    """
+    Hash module content.
+
+    Args:
+        content (str): The module source.
+
+    Returns:
+        str: The SHA-256 hex digest of the content.
+    """
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class ModuleBuffer:
+    """
+    The in-memory source of one project module, merged by top-level definition name.
+    """
+
+    def __init__(self, file_name, source='', written_hash=None):
+        """
+        Initialize the ModuleBuffer.
+
+        Args:
+            file_name (str): The module file name relative to the project directory.
+            source (str): The current module source.
+            written_hash (str): The hash of the content on disk, or None if the file does not exist.
+        """
+        self.file_name = file_name
+        self.source = source
+        self.written_hash = written_hash
+        self.rejected = []
+
+    def definitions(self):
+        """
+        Return the top-level functions and classes of the module.
+
+        Returns:
+            dict: Definition names mapped to their source, in source order. Empty if the module does not parse.
+        """
+        try:
+            tree = ast.parse(self.source)
+        except SyntaxError:
+            return {}
+        return {
+            node.name: ast.get_source_segment(self.source, node)
+            for node in tree.body
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+        }
+
+    def merge(self, code):
+        """
+        Merge generated code into the module, replacing definitions with the same name.
+        Code that does not parse is rejected and kept in 'rejected', so the module keeps
+        its last good source; a module that does not parse, e.g. after a manual edit, is
+        merged by definition text.
+
+        Args:
+            code (str): The generated code.
+
+        Returns:
+            bool: False if the code was rejected.
+        """
+        try:
+            ast.parse(code)
+        except SyntaxError as error:
+            self.rejected.append(code)
+            print(f"Rejected code for '{self.file_name}' that does not parse ({error.msg}, line {error.lineno}); "
+                  f"keeping the module unchanged.")
+            return False
+        if not self.source.strip():
+            self.source = code
+            return True
+        try:
+            self.source = merge_definitions(self.source, code)
+        except SyntaxError:
+            self.source = merge_definitions_by_text(self.source, code)
+        return True
+
+    def remove_definition(self, name):
+        """
+        Remove a top-level function or class from the module.
+
+        Args:
+            name (str): The name of the definition.
+
+        Returns:
+            bool: True if the definition was found and removed.
+        """
+        try:
+            tree = ast.parse(self.source)
+        except SyntaxError:
+            return False
+        for node in tree.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.name == name:
+                start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+                lines = self.source.splitlines()
+                del lines[start - 1:node.end_lineno]
+                self.source = '\n'.join(lines).strip('\n') + '\n'
+                return True
+        return False
+
+    def replace(self, code):
+        """
+        Replace the whole module source.
+
+        Args:
+            code (str): The new module source.
+        """
+        self.source = code
+
+    @property
+    def dirty(self):
+        """
+        Whether the buffered content differs from the content on disk.
+        """
+        return content_hash(self.source) != self.written_hash
+
+
+class ProjectBuffer:
+    """
+    The in-memory model of a project's modules. Modules are loaded from disk on first use
+    and written back in one batched flush, atomically and only when their content changed.
+    """
+
+    def __init__(self, project_dir):
+        """
+        Initialize the ProjectBuffer.
+
+        Args:
+            project_dir (str): The project directory.
+        """
+        self.project_dir = project_dir
+        self.modules = {}
+
+    def module(self, file_name):
+        """
+        Return the buffer of a module, loading it from disk on first use.
+
+        Args:
+            file_name (str): The module file name relative to the project directory.
+
+        Returns:
+            ModuleBuffer: The module buffer.
+        """
+        if file_name not in self.modules:
+            file_path = os.path.join(self.project_dir, file_name)
+            if os.path.exists(file_path):
+                with open(file_path, encoding='utf-8') as file:
+                    source = file.read()
+                self.modules[file_name] = ModuleBuffer(file_name, source, content_hash(source))
+            else:
+                self.modules[file_name] = ModuleBuffer(file_name)
+        return self.modules[file_name]
+
+    def snapshot(self):
+        """
+        Return the buffered source of every loaded module.
+
+        Returns:
+            dict: Module file names mapped to their source.
+        """
+        return {file_name: module.source for file_name, module in self.modules.items()}
+
+    def flush(self):
+        """
+        Write every changed module to disk. Each file is written to a temporary file in the
+        same directory and renamed over the target, so readers never see a partial module.
+
+        Returns:
+            list: The paths of the written files.
+        """
+        with instrumentation.span('file_write'):
+            return self._flush()
+
+    def _flush(self):
+        written = []
+        for file_name, module in self.modules.items():
+            if not module.dirty:
+                continue
+            file_path = os.path.join(self.project_dir, file_name)
+            directory = os.path.dirname(file_path)
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                    file.write(module.source)
+                os.replace(temp_path, file_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            module.written_hash = content_hash(module.source)
+            written.append(file_path)
+        return written
@@ -0,0 +1,276 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from generation_engine import estimate_tokens, get_rate_limiter
+from instrumentation import instrumentation
+
+TASK_TYPES = ('modules', 'generation', 'fix')
+
+
+class ProviderStats:
+    """
+    Rolling latency and error statistics of one provider and model, over its latest requests.
+    """
+
+    def __init__(self, window=50):
+        """
+        Initialize the ProviderStats.
+
+        Args:
+            window (int): The number of latest requests the statistics cover.
+        """
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok=True):
+        """
+        Record the outcome of a request.
+
+        Args:
+            seconds (float): The duration of the request.
+            ok (bool): False if the request failed.
+        """
+        with self._lock:
+            self.samples.append((seconds, ok))
+
+    def error_rate(self):
+        """
+        Return the share of failed requests, 0 when there were none.
+        """
+        with self._lock:
+            if not self.samples:
+                return 0.0
+            return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def latency(self, quantile=0.5, min_samples=1):
+        """
+        Return a latency quantile of the successful requests.
+
+        Args:
+            quantile (float): The quantile, e.g. 0.95.
+            min_samples (int): The number of successful requests needed for an estimate.
+
+        Returns:
+            float: The latency in seconds, or None without enough successful requests.
+        """
+        with self._lock:
+            latencies = sorted(seconds for seconds, ok in self.samples if ok)
+        if len(latencies) < max(1, min_samples):
+            return None
+        return latencies[min(len(latencies) - 1, int(quantile * len(latencies)))]
+
+    def snapshot(self):
+        """
+        Return the statistics as a dict.
+        """
+        with self._lock:
+            requests = len(self.samples)
+        return {
+            'requests': requests,
+            'error_rate': self.error_rate(),
+            'p50_seconds': self.latency(0.5),
+            'p95_seconds': self.latency(0.95),
+        }
+
+
+_provider_stats = {}
+_provider_stats_lock = threading.Lock()
+
+
+def get_provider_stats(provider, model_name):
+    """
+    Return the process-wide statistics of a provider and model, creating them on first use.
+
+    Args:
+        provider (str): The provider name.
+        model_name (str): The model name.
+
+    Returns:
+        ProviderStats: The shared statistics.
+    """
+    with _provider_stats_lock:
+        return _provider_stats.setdefault((provider, model_name), ProviderStats())
+
+
+class RoutedBackend:
+    """
+    Generates with the first of several backends, in order of preference, failing over
+    to the next one when a request fails. Backends whose rolling error rate exceeds a
+    limit are tried last. A request that takes longer than the hedge delay is also sent
+    to the next backend, and the first successful answer is used, so one slow endpoint
+    does not stall its callers. Streams fail over before their first token, but are not
+    hedged.
+    """
+
+    def __init__(self, backends, hedge_after=None, max_error_rate=0.5, max_workers=32):
+        """
+        Initialize the RoutedBackend.
+
+        Args:
+            backends (list): The backends, most preferred first.
+            hedge_after (float): Seconds after which a request is hedged. Defaults to the
+                rolling 95th latency percentile of the backend, once it has enough requests.
+            max_error_rate (float): The rolling error rate above which a backend is tried last.
+            max_workers (int): The maximum number of requests in flight, hedges included.
+        """
+        self.backends = backends
+        self.hedge_after = hedge_after
+        self.max_error_rate = max_error_rate
+        primary = backends[0]
+        # Cache keys and rate limits of the router are the ones of its preferred backend
+        self.name = primary.name
+        self.model_name = primary.model_name
+        self.concurrent = primary.concurrent
+        self.context_budget = min(backend.context_budget for backend in backends)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='routed-request')
+
+    def stats(self, backend):
+        """
+        Return the rolling statistics of a backend.
+        """
+        return get_provider_stats(backend.name, backend.model_name)
+
+    def candidates(self):
+        """
+        Return the backends in the order they are tried: the healthy ones in order of
+        preference, then the ones failing too often.
+        """
+        healthy = [backend for backend in self.backends if self.stats(backend).error_rate() <= self.max_error_rate]
+        return healthy + [backend for backend in self.backends if backend not in healthy]
+
+    def hedge_delay(self, backend):
+        """
+        Return how long to wait for a backend before hedging, or None to never hedge.
+        """
+        if self.hedge_after is not None:
+            return self.hedge_after
+        return self.stats(backend).latency(0.95, min_samples=5)
+
+    def generation_params(self, max_tokens):
+        """
+        Return the generation parameters of the preferred backend.
+        """
+        return self.backends[0].generation_params(max_tokens)
+
+    def start_session(self, preamble):
+        """
+        Start a session with the preamble on every backend.
+        """
+        for backend in self.backends:
+            backend.start_session(preamble)
+
+    def reset_session(self):
+        """
+        Reset the session of every backend.
+        """
+        for backend in self.backends:
+            backend.reset_session()
+
+    def _acquire(self, backend, prompt, max_tokens):
+        if backend is not self.backends[0]:
+            # The caller only rate-limited the preferred provider
+            get_rate_limiter(backend.name).acquire(estimate_tokens(prompt) + max_tokens)
+
+    def _call(self, backend, prompt, max_tokens, temperature):
+        self._acquire(backend, prompt, max_tokens)
+        start = time.perf_counter()
+        try:
+            response = backend.generate(prompt, max_tokens, temperature=temperature)
+        except Exception:
+            self._record(backend, time.perf_counter() - start, False)
+            raise
+        self._record(backend, time.perf_counter() - start, True)
+        return response
+
+    def _record(self, backend, seconds, ok):
+        self.stats(backend).record(seconds, ok)
+        instrumentation.record_span(
+            'provider_request', seconds,
+            provider=backend.name, model=backend.model_name, outcome='ok' if ok else 'error'
+        )
+
+    def _submit(self, backend, prompt, max_tokens, temperature):
+        return self._executor.submit(
+            contextvars.copy_context().run, self._call, backend, prompt, max_tokens, temperature
+        )
+
+    def generate(self, prompt, max_tokens, temperature=None):
+        """
+        Generate a completion, failing over and hedging across the backends.
+
+        Args:
+            prompt (str): The prompt.
+            max_tokens (int): The completion token limit.
+            temperature (float): The sampling temperature, or None for the provider default.
+
+        Returns:
+            str: The completion of the first backend that answers.
+        """
+        if len(self.backends) == 1:
+            return self._call(self.backends[0], prompt, max_tokens, temperature)
+        waiting = deque(self.candidates())
+        running = {}
+        error = None
+        failed_backend = None
+        while waiting or running:
+            if waiting and not running:
+                if error is not None:
+                    instrumentation.count('provider_failovers', provider=waiting[0].name)
+                    print(
+                        f"Request to {failed_backend.name} model {failed_backend.model_name} failed ({error}); "
+                        f"failing over to {waiting[0].name} model {waiting[0].model_name}."
+                    )
+                backend = waiting.popleft()
+                running[self._submit(backend, prompt, max_tokens, temperature)] = backend
+            delay = self.hedge_delay(next(iter(running.values()))) if waiting else None
+            done, _ = wait(running, timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                instrumentation.count('provider_hedges', provider=waiting[0].name)
+                backend = waiting.popleft()
+                running[self._submit(backend, prompt, max_tokens, temperature)] = backend
+                continue
+            for future in done:
+                backend = running.pop(future)
+                try:
+                    return future.result()
+                except Exception as failure:
+                    error = failure
+                    failed_backend = backend
+        raise error
+
+    def stream(self, prompt, max_tokens):
+        """
+        Generate a completion token by token, failing over to the next backend when one
+        fails before its first token.
+
+        Args:
+            prompt (str): The prompt.
+            max_tokens (int): The completion token limit.
+
+        Yields:
+            str: The generated tokens.
+        """
+        error = None
+        for backend in self.candidates():
+            if error is not None:
+                instrumentation.count('provider_failovers', provider=backend.name)
+                print(f"Streaming failed ({error}); failing over to {backend.name} model {backend.model_name}.")
+            self._acquire(backend, prompt, max_tokens)
+            start = time.perf_counter()
+            started = False
+            try:
+                for token in backend.stream(prompt, max_tokens):
+                    started = True
+                    yield token
+            except Exception as failure:
+                self._record(backend, time.perf_counter() - start, False)
+                if started:
+                    raise
+                error = failure
+                continue
+            self._record(backend, time.perf_counter() - start, True)
+            return
+        raise error
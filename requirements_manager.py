@@ -1,28 +1,235 @@
+import hashlib
+import json
 import os
+import re
+import shlex
 import subprocess
+import sys
+import tempfile
+import time
+import venv
+from instrumentation import instrumentation
+
+VENV_DIR_NAME = '.venv'
+STATE_FILE_NAME = '.autopywizard_requirements.json'
+DEFAULT_WHEELHOUSE = os.path.join(os.path.expanduser('~'), '.cache', 'autopywizard', 'wheelhouse')
+REQUIREMENT_PATTERN = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[[^\]]*\])?\s*(.*)$')
+
+
+def normalize_name(name):
+    """
+    Normalize a distribution name as pip compares them (PEP 503).
+
+    Args:
+        name (str): The distribution name.
+
+    Returns:
+        str: The normalized name.
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def normalize_requirement(line):
+    """
+    Normalize one requirements.txt line.
+
+    Args:
+        line (str): The line, e.g. "Flask >= 2.0  # web".
+
+    Returns:
+        tuple: The key identifying the requirement (the normalized name, or the whole line
+            for URLs and options) and the normalized specifier, or None for blank and comment lines.
+    """
+    line = line.split(' #', 1)[0].strip()
+    if not line or line.startswith('#'):
+        return None
+    match = REQUIREMENT_PATTERN.match(line)
+    if match is None or '://' in line or line.startswith('-'):
+        return line, line
+    name, extras, rest = match.groups()
+    name = normalize_name(name)
+    extras = ','.join(sorted(normalize_name(extra) for extra in extras[1:-1].split(',') if extra.strip())) if extras else ''
+    specifier = name + (f"[{extras}]" if extras else '') + re.sub(r'\s+', '', rest.split(';', 1)[0])
+    if ';' in rest:
+        specifier += '; ' + rest.split(';', 1)[1].strip()
+    return name, specifier
+
+
+def project_python(project_dir):
+    """
+    Return the Python interpreter of a project: the one of its virtualenv if it has one.
+
+    Args:
+        project_dir (str): The project directory.
+
+    Returns:
+        str: The path of the interpreter.
+    """
+    bin_dir = 'Scripts' if os.name == 'nt' else 'bin'
+    python = os.path.join(project_dir, VENV_DIR_NAME, bin_dir, 'python.exe' if os.name == 'nt' else 'python')
+    return python if os.path.exists(python) else sys.executable
+
 
 class RequirementsManager:
     """
     A class to handle the creation and installation of requirements.txt.
+    Requirements are installed into a virtualenv of the project, and only the
+    requirements that changed since the last installation are installed.
     """
 
-    def __init__(self, project_name):
+    def __init__(self, project_name, base_dir=None, wheelhouse=None):
+        """
+        Initialize the RequirementsManager.
+
+        Args:
+            project_name (str): The name of the project.
+            base_dir (str): The directory containing the project directory. Defaults to the working directory.
+            wheelhouse (str): A directory of wheels shared by all projects, used before the package
+                index. Defaults to AUTOPYWIZARD_WHEELHOUSE, or ~/.cache/autopywizard/wheelhouse.
+        """
         self.project_name = project_name
-        self.requirements_path = os.path.join(os.getcwd(), project_name, 'requirements.txt')
+        self.project_dir = os.path.join(base_dir or os.getcwd(), project_name)
+        self.requirements_path = os.path.join(self.project_dir, 'requirements.txt')
+        self.venv_dir = os.path.join(self.project_dir, VENV_DIR_NAME)
+        self.state_path = os.path.join(self.venv_dir, STATE_FILE_NAME)
+        self.wheelhouse = wheelhouse or os.environ.get('AUTOPYWIZARD_WHEELHOUSE', DEFAULT_WHEELHOUSE)
+
+    def requirements(self):
+        """
+        Read requirements.txt, normalized and deduplicated. A later specifier for the same
+        package replaces an earlier one.
+
+        Returns:
+            dict: Requirement keys mapped to their specifiers, in the order of first appearance.
+        """
+        requirements = {}
+        if os.path.exists(self.requirements_path):
+            with open(self.requirements_path, encoding='utf-8') as requirements_file:
+                for line in requirements_file:
+                    normalized = normalize_requirement(line)
+                    if normalized is not None:
+                        requirements[normalized[0]] = normalized[1]
+        return requirements
 
     def add_requirement(self, package_name):
         """
-        Add a package to requirements.txt.
-        
+        Add a package to requirements.txt, replacing an earlier specifier of the same package.
+
+        Args:
+            package_name (str): The package specifier to add, e.g. "requests>=2.31".
+        """
+        normalized = normalize_requirement(package_name)
+        if normalized is None:
+            return
+        requirements = self.requirements()
+        if requirements.get(normalized[0]) == normalized[1]:
+            return
+        requirements[normalized[0]] = normalized[1]
+        os.makedirs(self.project_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.project_dir, prefix='.', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as requirements_file:
+            requirements_file.write(''.join(f"{specifier}\n" for specifier in requirements.values()))
+        os.replace(temp_path, self.requirements_path)
+        print(f"Added {normalized[1]} to requirements.txt")
+
+    @staticmethod
+    def requirements_hash(requirements):
+        """
+        Hash a requirement set independently of its order.
+
         Args:
-            package_name (str): The name of the package to add.
+            requirements (dict): Requirement keys mapped to their specifiers.
+
+        Returns:
+            str: The SHA-256 hex digest.
+        """
+        return hashlib.sha256('\n'.join(sorted(requirements.values())).encode('utf-8')).hexdigest()
+
+    def installed_state(self):
         """
-        with open(self.requirements_path, 'a',encoding="utf-8") as requirements_file:
-            requirements_file.write(f"{package_name}\n")
-        print(f"Added {package_name} to requirements.txt")
+        Return the requirement set of the last successful installation.
 
-    def install_requirements(self):
+        Returns:
+            dict: The hash and the requirements, or an empty dict if nothing was installed.
         """
-        Install the packages listed in requirements.txt.
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, encoding='utf-8') as state_file:
+            return json.load(state_file)
+
+    def _pip(self, *args, check_cancelled=None):
+        process = subprocess.Popen(
+            [project_python(self.project_dir), '-m', 'pip', '--disable-pip-version-check', *args],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                if check_cancelled is None:
+                    continue
+                try:
+                    check_cancelled()
+                except BaseException:
+                    process.kill()
+                    process.wait()
+                    raise
+        return subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+
+    def install_requirements(self, check_cancelled=None):
         """
-        subprocess.run(['pip', 'install', '-r', self.requirements_path])
+        Install the packages listed in requirements.txt into the project virtualenv.
+        Nothing is run when the requirement set is unchanged since the last installation;
+        otherwise only added and changed requirements are installed and removed ones uninstalled.
+
+        Args:
+            check_cancelled (callable): Called while pip runs; pip is stopped if it raises.
+
+        Returns:
+            dict: The 'status' ('unchanged', 'installed' or 'failed'), the 'installed' and
+                'removed' specifiers, the duration in 'seconds' and the pip 'error' output on failure.
+        """
+        start = time.monotonic()
+        requirements = self.requirements()
+        requirements_hash = self.requirements_hash(requirements)
+        state = self.installed_state()
+        if state.get('hash') == requirements_hash:
+            print("Requirements unchanged since the last installation; skipping pip.")
+            return {'status': 'unchanged', 'installed': [], 'removed': [], 'seconds': time.monotonic() - start}
+
+        previous = state.get('requirements', {})
+        added = [specifier for key, specifier in requirements.items() if previous.get(key) != specifier]
+        # Only named packages can be uninstalled; options and URLs are left in place
+        removed = [
+            key for key in previous
+            if key not in requirements and not key.startswith('-') and '://' not in key
+        ]
+        report = {'status': 'installed', 'installed': added, 'removed': removed}
+        with instrumentation.span('pip_install'):
+            if not os.path.exists(self.venv_dir):
+                venv.EnvBuilder(with_pip=True).create(self.venv_dir)
+            completed = None
+            if removed:
+                completed = self._pip('uninstall', '--yes', *removed, check_cancelled=check_cancelled)
+            if added and (completed is None or completed.returncode == 0):
+                find_links = ['--find-links', self.wheelhouse] if os.path.isdir(self.wheelhouse) else []
+                arguments = [
+                    argument for specifier in added
+                    for argument in (shlex.split(specifier) if specifier.startswith('-') else [specifier])
+                ]
+                completed = self._pip('install', *find_links, *arguments, check_cancelled=check_cancelled)
+        report['seconds'] = time.monotonic() - start
+
+        if completed is not None and completed.returncode != 0:
+            report['status'] = 'failed'
+            report['error'] = completed.stderr.strip() or completed.stdout.strip()
+            print(f"Installing requirements failed after {report['seconds']:.1f}s:\n{report['error']}")
+            return report
+        with open(self.state_path, 'w', encoding='utf-8') as state_file:
+            json.dump({'hash': requirements_hash, 'requirements': requirements}, state_file, indent=2)
+        print(
+            f"Installed {len(added)} and removed {len(removed)} requirement(s) "
+            f"in {report['seconds']:.1f}s."
+        )
+        return report
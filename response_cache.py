@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.getcwd(), '.autopywizard', 'response_cache.sqlite3')
+
+
+class ResponseCache:
+    """
+    A persistent, content-addressed cache of model responses stored in SQLite.
+    Entries are evicted least-recently-used first when the cache grows beyond its size
+    limit, and are dropped once they are older than the maximum age.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_size_bytes=256 * 1024 * 1024, max_age_seconds=30 * 24 * 3600):
+        """
+        Initialize the ResponseCache.
+
+        Args:
+            path (str): The path of the SQLite database file.
+            max_size_bytes (int): The maximum total size of the cached responses. None means no limit.
+            max_age_seconds (float): The maximum age of an entry. None means entries never expire.
+        """
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def make_key(prompt, provider, model_name, params=None):
+        """
+        Build the cache key of a prompt.
+
+        Args:
+            prompt (str): The prompt.
+            provider (str): The provider name, e.g. 'openai' or 'gpt4all'.
+            model_name (str): The name of the model.
+            params (dict): The generation parameters.
+
+        Returns:
+            str: The SHA-256 hex digest identifying the request.
+        """
+        payload = json.dumps(
+            {'prompt': prompt, 'provider': provider, 'model': model_name, 'params': params or {}},
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            str: The cached response, or None on a miss.
+        """
+        now = time.time()
+        with self._lock, self._connect() as connection:
+            row = connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.max_age_seconds is not None and now - row[1] > self.max_age_seconds:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        """
+        Store a response and evict old entries if needed.
+
+        Args:
+            key (str): The cache key.
+            response (str): The response to cache.
+        """
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._evict(connection, now)
+
+    def _evict(self, connection, now):
+        if self.max_age_seconds is not None:
+            connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,))
+        if self.max_size_bytes is None:
+            return
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_size_bytes:
+            return
+        for key, size in connection.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if total <= self.max_size_bytes:
+                break
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+    def clear(self):
+        """
+        Remove every cached response.
+        """
+        with self._lock, self._connect() as connection:
+            connection.execute("DELETE FROM responses")
+
+    def stats(self):
+        """
+        Return the cache counters.
+
+        Returns:
+            dict: The hits, misses, number of entries and total size in bytes.
+        """
+        with self._lock, self._connect() as connection:
+            entries, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'size_bytes': size}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the process-wide response cache, creating it on first use.
+
+    Returns:
+        ResponseCache: The shared response cache.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(os.environ.get('AUTOPYWIZARD_CACHE_PATH', DEFAULT_CACHE_PATH))
+        return _default_cache
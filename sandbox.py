@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+
+def copy_project(project_dir, target_dir):
+    """
+    Make a cheap copy-on-write copy of a project. Python sources are hard-linked, since
+    the project buffer replaces files instead of writing into them; other files, which
+    tests may write in place, are copied. Hidden directories and __pycache__ are skipped.
+
+    Args:
+        project_dir (str): The project directory.
+        target_dir (str): The empty directory to copy into.
+    """
+    for root, dirs, files in os.walk(project_dir):
+        dirs[:] = [name for name in dirs if not name.startswith('.') and name != '__pycache__']
+        target_root = os.path.join(target_dir, os.path.relpath(root, project_dir))
+        os.makedirs(target_root, exist_ok=True)
+        for file_name in files:
+            source = os.path.join(root, file_name)
+            target = os.path.join(target_root, file_name)
+            if file_name.endswith('.py'):
+                try:
+                    os.link(source, target)
+                    continue
+                except OSError:
+                    pass
+            shutil.copy2(source, target)
+
+
+@contextmanager
+def project_sandbox(project_dir):
+    """
+    Create a temporary copy of a project next to it, and remove it afterwards.
+
+    Args:
+        project_dir (str): The project directory.
+
+    Yields:
+        str: The path of the sandbox directory.
+    """
+    project_dir = os.path.abspath(project_dir)
+    # A sibling directory is on the same file system, so sources can be hard-linked.
+    sandbox_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(project_dir)}_sandbox_", dir=os.path.dirname(project_dir))
+    try:
+        copy_project(project_dir, sandbox_dir)
+        yield sandbox_dir
+    finally:
+        shutil.rmtree(sandbox_dir, ignore_errors=True)
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import tempfile
+
+MANIFEST_FILE_NAME = '.autopywizard_manifest.json'
+
+
+def spec_hash(job, preamble=None):
+    """
+    Hash what determines the prompt of a generation job: the job and the session preamble,
+    which holds the project name and description. The provider and model are left out,
+    so switching models keeps the existing code, which the test-and-fix loop still checks.
+
+    Args:
+        job (dict): The generation job.
+        preamble (str): The session preamble of the project, if any.
+
+    Returns:
+        str: The SHA-256 hex digest.
+    """
+    payload = json.dumps(
+        {'type': job['type'], 'name': job['name'], 'description': job['description'], 'preamble': preamble},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def code_hash(code):
+    """
+    Hash the generated code of an item.
+
+    Args:
+        code (str): The source of the definition.
+
+    Returns:
+        str: The SHA-256 hex digest.
+    """
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+
+def item_key(job):
+    """
+    Build the manifest key of a generation job.
+
+    Args:
+        job (dict): The generation job, with its 'module'.
+
+    Returns:
+        str: The key, e.g. 'function:calc:add'.
+    """
+    return f"{job['type']}:{job['module'].lower()}:{job['name']}"
+
+
+class SpecManifest:
+    """
+    A class to record the project spec and content hashes of every spec item and the
+    code generated for it, so that a regeneration only calls the model for items that
+    were added or changed, or whose code has gone missing or was changed on disk.
+    """
+
+    def __init__(self, project_dir, preamble=None):
+        """
+        Initialize the SpecManifest and load it from the project directory if it exists.
+
+        Args:
+            project_dir (str): The project directory.
+            preamble (str): The session preamble of the project's prompts, see spec_hash.
+        """
+        self.path = os.path.join(project_dir, MANIFEST_FILE_NAME)
+        self.preamble = preamble
+        self.spec = {}
+        self.items = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+            self.spec = data.get('spec', {})
+            self.items = data.get('items', {})
+
+    def changed_jobs(self, jobs, project_buffer):
+        """
+        Select the jobs that need generation.
+
+        Args:
+            jobs (list): The generation jobs of the new spec.
+            project_buffer (ProjectBuffer): The project buffer holding the current code.
+
+        Returns:
+            list: The indices of the jobs to generate.
+        """
+        changed = []
+        for index, job in enumerate(jobs):
+            item = self.items.get(item_key(job))
+            if item is None or item['spec_hash'] != spec_hash(job, self.preamble):
+                changed.append(index)
+            elif item['defined']:
+                code = project_buffer.module(item['file']).definitions().get(job['name'])
+                if code is None:
+                    changed.append(index)
+                elif code_hash(code) != item.get('artifact_hash'):
+                    print(f"'{job['name']}' in '{item['file']}' differs from the generated code; regenerating it.")
+                    changed.append(index)
+        return changed
+
+    def removed_items(self, jobs):
+        """
+        Return the manifest items that are no longer part of the spec.
+
+        Args:
+            jobs (list): The generation jobs of the new spec.
+
+        Returns:
+            list: The removed manifest item dicts, with their 'name'.
+        """
+        keys = {item_key(job) for job in jobs}
+        return [item for key, item in self.items.items() if key not in keys]
+
+    def record(self, job, project_buffer):
+        """
+        Record the spec hash and the generated code hash of a job.
+
+        Args:
+            job (dict): The generation job.
+            project_buffer (ProjectBuffer): The project buffer holding the generated code.
+        """
+        file_name = f"{job['module'].lower()}.py"
+        definitions = project_buffer.module(file_name).definitions()
+        code = definitions.get(job['name'], '')
+        self.items[item_key(job)] = {
+            'name': job['name'],
+            'file': file_name,
+            # Only code that defines the requested name can be checked for removal later
+            'defined': job['name'] in definitions,
+            'spec_hash': spec_hash(job, self.preamble),
+            'artifact_hash': code_hash(code),
+        }
+
+    def refresh(self, project_buffer):
+        """
+        Record the current code of every item, e.g. after the test-and-fix loop changed it,
+        so that only later changes on disk count as edits.
+
+        Args:
+            project_buffer (ProjectBuffer): The project buffer holding the current code.
+        """
+        for item in self.items.values():
+            code = project_buffer.module(item['file']).definitions().get(item['name']) if item['defined'] else None
+            if code is not None:
+                item['artifact_hash'] = code_hash(code)
+
+    def update(self, jobs, spec):
+        """
+        Set the spec and drop the items that are no longer part of it.
+
+        Args:
+            jobs (list): The generation jobs of the spec.
+            spec (dict): The project spec.
+        """
+        keys = {item_key(job) for job in jobs}
+        self.items = {key: item for key, item in self.items.items() if key in keys}
+        self.spec = spec
+
+    def save(self):
+        """
+        Write the manifest atomically.
+        """
+        directory = os.path.dirname(self.path)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump({'spec': self.spec, 'items': self.items}, file, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,256 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+
+DEFAULT_STATE_DB_PATH = os.path.join(os.getcwd(), '.autopywizard', 'state.sqlite3')
+
+
+class MemoryStateStore:
+    """
+    A thread-safe, in-process store of per-session project state.
+    Suitable for a single multi-threaded server process.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty MemoryStateStore.
+        """
+        self._values = {}
+        self._items = {}
+        self._lock = threading.RLock()
+
+    def get(self, state_id, key, default=None):
+        """
+        Return a value of a session.
+
+        Args:
+            state_id (str): The session or project id.
+            key (str): The name of the value.
+            default: Returned when the value is not set.
+
+        Returns:
+            The stored value, or default.
+        """
+        with self._lock:
+            return copy.deepcopy(self._values.get((state_id, key), default))
+
+    def set(self, state_id, key, value):
+        """
+        Set a value of a session.
+
+        Args:
+            state_id (str): The session or project id.
+            key (str): The name of the value.
+            value: The JSON-serializable value.
+        """
+        with self._lock:
+            self._values[(state_id, key)] = copy.deepcopy(value)
+
+    def update(self, state_id, key, **changes):
+        """
+        Atomically update fields of a dict value of a session.
+
+        Args:
+            state_id (str): The session or project id.
+            key (str): The name of the value.
+            **changes: The fields to set.
+        """
+        with self._lock:
+            value = dict(self._values.get((state_id, key)) or {})
+            value.update(copy.deepcopy(changes))
+            self._values[(state_id, key)] = value
+
+    def append(self, state_id, key, item):
+        """
+        Append an item to a list of a session.
+
+        Args:
+            state_id (str): The session or project id.
+            key (str): The name of the list.
+            item: The JSON-serializable item.
+        """
+        with self._lock:
+            self._items.setdefault((state_id, key), []).append(copy.deepcopy(item))
+
+    def items(self, state_id, key):
+        """
+        Return the items of a list of a session.
+
+        Args:
+            state_id (str): The session or project id.
+            key (str): The name of the list.
+
+        Returns:
+            list: The items in the order they were appended.
+        """
+        with self._lock:
+            return copy.deepcopy(self._items.get((state_id, key), []))
+
+    def clear(self, state_id):
+        """
+        Remove all state of a session.
+
+        Args:
+            state_id (str): The session or project id.
+        """
+        with self._lock:
+            for store in (self._values, self._items):
+                for state_key in [state_key for state_key in store if state_key[0] == state_id]:
+                    del store[state_key]
+
+
+class SQLiteStateStore:
+    """
+    A store of per-session project state backed by SQLite, shared by every thread and
+    process of a multi-threaded or multi-process WSGI deployment on one host.
+    """
+
+    def __init__(self, path=DEFAULT_STATE_DB_PATH):
+        """
+        Initialize the SQLiteStateStore.
+
+        Args:
+            path (str): The path of the SQLite database file.
+        """
+        self.path = path
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            # WAL lets readers proceed while another worker appends.
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS state_values ("
+                "state_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (state_id, key))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS state_items ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, state_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS state_items_key ON state_items (state_id, key, seq)")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def get(self, state_id, key, default=None):
+        """
+        Return a value of a session.
+
+        Args:
+            state_id (str): The session or project id.
+            key (str): The name of the value.
+            default: Returned when the value is not set.
+
+        Returns:
+            The stored value, or default.
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT value FROM state_values WHERE state_id = ? AND key = ?", (state_id, key)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def set(self, state_id, key, value):
+        """
+        Set a value of a session.
+
+        Args:
+            state_id (str): The session or project id.
+            key (str): The name of the value.
+            value: The JSON-serializable value.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO state_values (state_id, key, value) VALUES (?, ?, ?)",
+                (state_id, key, json.dumps(value))
+            )
+
+    def update(self, state_id, key, **changes):
+        """
+        Atomically update fields of a dict value of a session.
+
+        Args:
+            state_id (str): The session or project id.
+            key (str): The name of the value.
+            **changes: The fields to set.
+        """
+        connection = self._connect()
+        try:
+            connection.isolation_level = None
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT value FROM state_values WHERE state_id = ? AND key = ?", (state_id, key)
+            ).fetchone()
+            value = json.loads(row[0]) if row is not None else {}
+            value.update(changes)
+            connection.execute(
+                "INSERT OR REPLACE INTO state_values (state_id, key, value) VALUES (?, ?, ?)",
+                (state_id, key, json.dumps(value))
+            )
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def append(self, state_id, key, item):
+        """
+        Append an item to a list of a session.
+
+        Args:
+            state_id (str): The session or project id.
+            key (str): The name of the list.
+            item: The JSON-serializable item.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO state_items (state_id, key, value) VALUES (?, ?, ?)",
+                (state_id, key, json.dumps(item))
+            )
+
+    def items(self, state_id, key):
+        """
+        Return the items of a list of a session.
+
+        Args:
+            state_id (str): The session or project id.
+            key (str): The name of the list.
+
+        Returns:
+            list: The items in the order they were appended.
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT value FROM state_items WHERE state_id = ? AND key = ? ORDER BY seq", (state_id, key)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def clear(self, state_id):
+        """
+        Remove all state of a session.
+
+        Args:
+            state_id (str): The session or project id.
+        """
+        with self._connect() as connection:
+            connection.execute("DELETE FROM state_values WHERE state_id = ?", (state_id,))
+            connection.execute("DELETE FROM state_items WHERE state_id = ?", (state_id,))
+
+
+def make_state_store(url):
+    """
+    Build a state store from a URL: 'memory' or 'sqlite:///path/to/state.sqlite3'.
+
+    Args:
+        url (str): The state store URL.
+
+    Returns:
+        MemoryStateStore or SQLiteStateStore: The state store.
+    """
+    if url == 'memory':
+        return MemoryStateStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStateStore(url[len('sqlite:///'):])
+    raise ValueError(f"Unsupported state store URL '{url}'")
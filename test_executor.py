@@ -0,0 +1,547 @@
+import ast
+import atexit
+import importlib
+import json
+import os
+import re
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import unittest
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+RESULTS_MARKER = 'AUTOPYWIZARD_TEST_RESULTS:'
+WORKER_READY = 'AUTOPYWIZARD_WORKER_READY'
+
+
+def module_name_for_path(project_dir, file_path):
+    """
+    Return the dotted module name of a Python file inside the project directory.
+
+    Args:
+        project_dir (str): The project directory.
+        file_path (str): The path of the Python file.
+
+    Returns:
+        str: The dotted module name.
+    """
+    relative_path = os.path.relpath(file_path, project_dir)
+    return os.path.splitext(relative_path)[0].replace(os.sep, '.')
+
+
+def project_modules(project_dir):
+    """
+    Find the Python modules of a project.
+
+    Args:
+        project_dir (str): The project directory.
+
+    Returns:
+        dict: Dotted module names mapped to file paths.
+    """
+    modules = {}
+    for root, dirs, files in os.walk(project_dir):
+        dirs[:] = [name for name in dirs if not name.startswith('.') and name != '__pycache__']
+        for file_name in files:
+            if file_name.endswith('.py'):
+                file_path = os.path.join(root, file_name)
+                modules[module_name_for_path(project_dir, file_path)] = file_path
+    return modules
+
+
+def build_import_graph(project_dir):
+    """
+    Build the import graph between the modules of a project by parsing them with ast.
+    Modules that do not parse are given no edges.
+
+    Args:
+        project_dir (str): The project directory.
+
+    Returns:
+        dict: Each module name mapped to the set of project modules it imports.
+    """
+    modules = project_modules(project_dir)
+    graph = {}
+    for module_name, file_path in modules.items():
+        imported = set()
+        try:
+            with open(file_path, encoding='utf-8') as file:
+                tree = ast.parse(file.read(), filename=file_path)
+        except (SyntaxError, ValueError, UnicodeDecodeError):
+            graph[module_name] = imported
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module] + [f"{node.module}.{alias.name}" for alias in node.names]
+            else:
+                continue
+            for name in names:
+                # "import a.b.c" depends on a, a.b and a.b.c
+                parts = name.split('.')
+                for end in range(1, len(parts) + 1):
+                    candidate = '.'.join(parts[:end])
+                    if candidate in modules and candidate != module_name:
+                        imported.add(candidate)
+        graph[module_name] = imported
+    return graph
+
+
+def discover_test_modules(project_dir, pattern='test'):
+    """
+    Find the test modules of a project, using unittest's default 'test*.py' naming.
+
+    Args:
+        project_dir (str): The project directory.
+        pattern (str): The file name prefix of test modules.
+
+    Returns:
+        list: The dotted names of the test modules, sorted.
+    """
+    return sorted(
+        module_name for module_name in project_modules(project_dir)
+        if module_name.rsplit('.', 1)[-1].startswith(pattern)
+    )
+
+
+def affected_test_modules(graph, test_modules, changed_modules):
+    """
+    Select the test modules that directly or transitively import a changed module.
+
+    Args:
+        graph (dict): The import graph from build_import_graph.
+        test_modules (list): The dotted names of the test modules.
+        changed_modules (set): The dotted names of the changed modules.
+
+    Returns:
+        list: The affected test modules, in the order of test_modules.
+    """
+    dependents = {}
+    for module_name, imported in graph.items():
+        for dependency in imported:
+            dependents.setdefault(dependency, set()).add(module_name)
+    affected = set(changed_modules)
+    pending = list(changed_modules)
+    while pending:
+        for dependent in dependents.get(pending.pop(), ()):
+            if dependent not in affected:
+                affected.add(dependent)
+                pending.append(dependent)
+    return [module_name for module_name in test_modules if module_name in affected]
+
+
+# Pools whose workers are stopped at exit; a pool that is no longer used drops out
+_live_pools = weakref.WeakSet()
+
+
+@atexit.register
+def _close_live_pools():
+    for pool in list(_live_pools):
+        pool.close()
+
+
+class WarmWorkerPool:
+    """
+    A long-lived test worker process that has imported the third-party requirements of
+    a project, and forks a fresh child for every test module it is asked to run. The
+    children inherit the imported requirements, but import the generated code afresh,
+    so tests see the current code without paying for heavy imports on every run.
+    The worker is replaced when the interpreter or the requirements change.
+    """
+
+    def __init__(self, python=None):
+        """
+        Initialize the WarmWorkerPool. The worker is started on first use.
+
+        Args:
+            python (str): The interpreter of the worker. Defaults to the current one.
+        """
+        self.python = python or sys.executable
+        self.requirements = {}
+        self._process = None
+        self._socket_dir = None
+        self._socket_path = None
+        self._failed = False
+        self._lock = threading.Lock()
+        _live_pools.add(self)
+
+    @staticmethod
+    def supported():
+        """
+        Return whether the platform can fork workers and serve them over Unix sockets.
+        """
+        return hasattr(os, 'fork') and hasattr(socket, 'AF_UNIX')
+
+    def configure(self, python, requirements):
+        """
+        Set the interpreter and the requirements to preload, replacing the worker if they changed.
+
+        Args:
+            python (str): The interpreter of the worker.
+            requirements (dict): Requirement keys mapped to their specifiers, see
+                RequirementsManager.requirements.
+        """
+        with self._lock:
+            if python != self.python or requirements != self.requirements:
+                if self._process is not None:
+                    print("Interpreter or requirements changed; restarting the warm test worker.")
+                self._stop()
+                self.python = python
+                self.requirements = dict(requirements)
+                self._failed = False
+
+    def _start(self):
+        # Options and URLs are installed but cannot be imported by name
+        distributions = [key for key in self.requirements if not key.startswith('-') and '://' not in key]
+        self._socket_dir = tempfile.mkdtemp(prefix='autopywizard_workers_')
+        self._socket_path = os.path.join(self._socket_dir, 'workers.sock')
+        start = time.monotonic()
+        process = subprocess.Popen(
+            [self.python, os.path.abspath(__file__), '--serve', self._socket_path, json.dumps(distributions)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+        )
+        for line in process.stdout:
+            if line.strip() == WORKER_READY:
+                break
+        else:
+            process.wait()
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+            self._failed = True
+            raise OSError(f"The warm test worker exited with status {process.returncode} before it was ready")
+        process.stdout.close()
+        self._process = process
+        print(f"Warm test worker ready in {time.monotonic() - start:.1f}s with {len(distributions)} preloaded requirement(s).")
+
+    def _stop(self):
+        if self._process is not None:
+            # The worker exits when its stdin closes
+            self._process.stdin.close()
+            try:
+                self._process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+            self._process = None
+        if self._socket_dir is not None:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+            self._socket_dir = None
+
+    def close(self):
+        """
+        Stop the worker. It is started again if the pool is used afterwards.
+        """
+        with self._lock:
+            self._stop()
+
+    def run_module(self, project_dir, module_name, per_test_timeout, module_timeout):
+        """
+        Run one test module in a child forked from the warm worker.
+
+        Args:
+            project_dir (str): The project directory, which may be a sandbox copy of the project.
+            module_name (str): The dotted name of the test module.
+            per_test_timeout (float): The maximum duration of a single test in seconds.
+            module_timeout (float): The maximum duration of the whole test module in seconds.
+
+        Returns:
+            list: The test records, see TestExecutor.run_module.
+
+        Raises:
+            OSError: If the worker cannot be started or reached.
+        """
+        with self._lock:
+            if self._failed:
+                raise OSError("The warm test worker failed to start")
+            if self._process is None or self._process.poll() is not None:
+                self._stop()
+                self._start()
+            socket_path = self._socket_path
+        start = time.monotonic()
+        pid = None
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(module_timeout)
+            connection.connect(socket_path)
+            stream = connection.makefile('rw', encoding='utf-8')
+            stream.write(json.dumps({
+                'project_dir': project_dir, 'module': module_name, 'per_test_timeout': per_test_timeout
+            }) + '\n')
+            stream.flush()
+            try:
+                pid = json.loads(stream.readline())['pid']
+                results = stream.readline()
+            except socket.timeout:
+                if pid is not None:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                return [TestExecutor._module_record(
+                    module_name, 'timeout', start, f"Test module timed out after {module_timeout}s"
+                )]
+        if not results:
+            return [TestExecutor._module_record(module_name, 'error', start, "The test process exited without results")]
+        return json.loads(results)
+
+
+class TestExecutor:
+    """
+    A class to run the test modules of a project in parallel, each in its own
+    Python process so that every run imports the current generated code.
+    """
+
+    def __init__(self, project_dir, max_workers=None, per_test_timeout=30, module_timeout=300, python=None,
+                 worker_pool=None):
+        """
+        Initialize the TestExecutor.
+
+        Args:
+            project_dir (str): The project directory.
+            max_workers (int): The maximum number of concurrent test processes. Defaults to the CPU count.
+            per_test_timeout (float): The maximum duration of a single test in seconds.
+            module_timeout (float): The maximum duration of a whole test module in seconds.
+            python (str): The interpreter running the tests. Defaults to the current one.
+            worker_pool (WarmWorkerPool): Runs the test modules in children of a warm worker
+                instead of new interpreters. Modules fall back to a new interpreter when the
+                worker is unavailable.
+        """
+        self.project_dir = os.path.abspath(project_dir)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.per_test_timeout = per_test_timeout
+        self.module_timeout = module_timeout
+        self.python = python or sys.executable
+        self.worker_pool = worker_pool
+
+    def run(self, test_modules=None, cancel_event=None):
+        """
+        Run test modules in parallel.
+
+        Args:
+            test_modules (list): The dotted names of the test modules. Defaults to all test modules.
+            cancel_event (threading.Event): Once set, the modules not started yet are skipped
+                and have no records.
+
+        Returns:
+            list: The test records, see run_module.
+        """
+        if test_modules is None:
+            test_modules = discover_test_modules(self.project_dir)
+        if not test_modules:
+            return []
+
+        def run_module(module_name):
+            if cancel_event is not None and cancel_event.is_set():
+                return []
+            return self.run_module(module_name)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(test_modules))) as executor:
+            results = executor.map(run_module, test_modules)
+        return [record for records in results for record in records]
+
+    def run_module(self, module_name):
+        """
+        Run one test module in a fresh Python process: a child of the warm worker, or else
+        a new interpreter.
+
+        Args:
+            module_name (str): The dotted name of the test module.
+
+        Returns:
+            list: One dict per test with 'id', 'module', 'status' ('passed', 'failed',
+                'error', 'skipped' or 'timeout'), 'duration' and 'traceback'.
+        """
+        if self.worker_pool is not None:
+            try:
+                return self.worker_pool.run_module(self.project_dir, module_name, self.per_test_timeout, self.module_timeout)
+            except (OSError, ValueError) as error:
+                print(f"Warm test worker unavailable ({error}); running {module_name} in a new interpreter.")
+        start = time.monotonic()
+        command = [self.python, os.path.abspath(__file__), self.project_dir, module_name, str(self.per_test_timeout)]
+        try:
+            completed = subprocess.run(
+                command, cwd=self.project_dir, capture_output=True, text=True, timeout=self.module_timeout
+            )
+        except subprocess.TimeoutExpired:
+            return [self._module_record(module_name, 'timeout', start, f"Test module timed out after {self.module_timeout}s")]
+        for line in reversed(completed.stdout.splitlines()):
+            if line.startswith(RESULTS_MARKER):
+                return json.loads(line[len(RESULTS_MARKER):])
+        return [self._module_record(module_name, 'error', start, completed.stderr or completed.stdout)]
+
+    @staticmethod
+    def _module_record(module_name, status, start, message):
+        return {
+            'id': module_name,
+            'module': module_name,
+            'status': status,
+            'duration': time.monotonic() - start,
+            'traceback': message,
+        }
+
+
+class TestTimeout(Exception):
+    """
+    Raised inside a test that exceeded the per-test timeout.
+    """
+
+
+class _RecordingResult(unittest.TestResult):
+
+    def __init__(self, module_name, per_test_timeout):
+        super().__init__()
+        self.module_name = module_name
+        self.per_test_timeout = per_test_timeout
+        self.records = []
+        self._start = None
+
+    def _alarm(self, signum, frame):
+        raise TestTimeout(f"Test exceeded the {self.per_test_timeout}s timeout")
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._start = time.monotonic()
+        if self.per_test_timeout and hasattr(signal, 'setitimer'):
+            signal.signal(signal.SIGALRM, self._alarm)
+            signal.setitimer(signal.ITIMER_REAL, self.per_test_timeout)
+
+    def stopTest(self, test):
+        if self.per_test_timeout and hasattr(signal, 'setitimer'):
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        super().stopTest(test)
+
+    def _record(self, test, status, err=None):
+        tb = ''
+        if err is not None:
+            tb = ''.join(traceback.format_exception(*err))
+            if err[0] is TestTimeout:
+                status = 'timeout'
+        self.records.append({
+            'id': test.id(),
+            'module': self.module_name,
+            'status': status,
+            'duration': time.monotonic() - self._start if self._start else 0.0,
+            'traceback': tb,
+        })
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._record(test, 'passed')
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, 'error', err)
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, 'failed', err)
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, 'skipped')
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._record(test, 'passed')
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, 'failed')
+
+
+def _run_test_module(module_name, per_test_timeout):
+    result = _RecordingResult(module_name, per_test_timeout)
+    suite = unittest.defaultTestLoader.loadTestsFromName(module_name)
+    suite.run(result)
+    return result.records
+
+
+def _worker_main(project_dir, module_name, per_test_timeout):
+    # Replace this script's directory so only the generated project is importable
+    sys.path[0] = project_dir
+    records = _run_test_module(module_name, per_test_timeout)
+    sys.stdout.write('\n' + RESULTS_MARKER + json.dumps(records) + '\n')
+
+
+def _preload(distributions):
+    wanted = {re.sub(r'[-_.]+', '-', name).lower() for name in distributions}
+    try:
+        from importlib.metadata import packages_distributions
+        top_level = {
+            module_name for module_name, owners in packages_distributions().items()
+            if not module_name.startswith('_') and any(re.sub(r'[-_.]+', '-', owner).lower() in wanted for owner in owners)
+        }
+    except ImportError:
+        top_level = set()
+    top_level |= {name.replace('-', '_') for name in wanted}
+    for module_name in sorted(top_level):
+        try:
+            importlib.import_module(module_name)
+        except Exception:
+            # Not importable under this name, or broken; the tests will report it
+            pass
+
+
+def _serve_connection(connection):
+    status = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        stream = connection.makefile('rw', encoding='utf-8')
+        request = json.loads(stream.readline())
+        stream.write(json.dumps({'pid': os.getpid()}) + '\n')
+        stream.flush()
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        os.chdir(request['project_dir'])
+        sys.path.insert(0, request['project_dir'])
+        start = time.monotonic()
+        try:
+            records = _run_test_module(request['module'], request['per_test_timeout'])
+        except Exception:
+            # E.g. a NameError or SyntaxError importing the module; report its traceback
+            # as a new interpreter would on stderr
+            records = [TestExecutor._module_record(request['module'], 'error', start, traceback.format_exc())]
+        stream.write(json.dumps(records) + '\n')
+        stream.flush()
+        status = 0
+    finally:
+        os._exit(status)
+
+
+def _serve(socket_path, distributions):
+    # Preload the requirements without this script's directory on the path; the children
+    # put the project directory there and import the generated code themselves.
+    sys.path.pop(0)
+    _preload(distributions)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(64)
+    # Finished children are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    sys.stdout.write(WORKER_READY + '\n')
+    sys.stdout.flush()
+    while True:
+        readable, _, _ = select.select([server, sys.stdin], [], [])
+        if sys.stdin in readable:
+            # End of input: the pool was closed or its process died
+            return
+        connection, _ = server.accept()
+        if os.fork() == 0:
+            server.close()
+            _serve_connection(connection)
+        connection.close()
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == '--serve':
+        _serve(sys.argv[2], json.loads(sys.argv[3]))
+    else:
+        _worker_main(sys.argv[1], sys.argv[2], float(sys.argv[3]))
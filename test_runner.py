@@ -1,67 +1,109 @@
-import unittest
 import os
-import traceback
-from ai_interaction import AIInteraction
-from code_generator import CodeGenerator
+from context_builder import ContextBuilder
+from instrumentation import instrumentation
+from requirements_manager import RequirementsManager, project_python
+from test_executor import TestExecutor, WarmWorkerPool, build_import_graph, discover_test_modules, affected_test_modules
 
 class TestRunner:
     """
     A class to handle running tests and managing exceptions for the generated code.
     """
 
-    def __init__(self, project_name):
+    def __init__(self, project_name, max_workers=None, per_test_timeout=30, base_dir=None):
         """
         Initialize the TestRunner with the project name.
         
         Args:
             project_name (str): The name of the project.
+            max_workers (int): The maximum number of concurrent test processes.
+            per_test_timeout (float): The maximum duration of a single test in seconds.
+            base_dir (str): The directory containing the project directory. Defaults to the working directory.
         """
         self.project_name = project_name
-        self.test_dir = os.path.join(os.getcwd(), project_name)
-        self.ai_interaction = AIInteraction()
+        self.test_dir = os.path.join(base_dir or os.getcwd(), project_name)
+        self.requirements_manager = RequirementsManager(project_name, base_dir=base_dir)
+        # A warm worker keeps the project requirements imported across test runs;
+        # AUTOPYWIZARD_WARM_TEST_WORKERS=0 starts a new interpreter per test module instead.
+        self.worker_pool = None
+        if WarmWorkerPool.supported() and os.environ.get('AUTOPYWIZARD_WARM_TEST_WORKERS', '1') != '0':
+            self.worker_pool = WarmWorkerPool()
+        # Tests run in the project virtualenv, where the project requirements are installed
+        self.executor = TestExecutor(
+            self.test_dir, max_workers=max_workers, per_test_timeout=per_test_timeout, python=project_python(self.test_dir),
+            worker_pool=self.worker_pool
+        )
+        # Latest record of every test by id; None until the first full run
+        self.results = None
+        self.changed_modules = set()
 
     def run_tests(self):
         """
-        Run tests on the generated code.
+        Run tests on the generated code. The first run executes every test module; later
+        runs only re-run the test modules affected by the modules changed since.
         
         Returns:
             bool: True if all tests pass, False otherwise.
         """
-        loader = unittest.TestLoader()
-        suite = loader.discover(self.test_dir)
-        runner = unittest.TextTestRunner()
-        result = runner.run(suite)
-        
-        if result.wasSuccessful():
+        with instrumentation.span('test_discovery'):
+            test_modules = discover_test_modules(self.test_dir)
+            if self.results is not None:
+                graph = build_import_graph(self.test_dir)
+                test_modules = affected_test_modules(graph, test_modules, self.changed_modules)
+        if self.results is None:
+            self.results = {}
+        else:
+            print(f"Re-running {len(test_modules)} affected test module(s).")
+        self.changed_modules = set()
+
+        # The virtualenv or the requirements may have changed since the last run
+        self.executor.python = project_python(self.test_dir)
+        if self.worker_pool is not None:
+            self.worker_pool.configure(self.executor.python, self.requirements_manager.requirements())
+        with instrumentation.span('test_execution'):
+            records = self.executor.run(test_modules)
+        self.record_results(test_modules, records)
+
+        failures = self.failures()
+        if not failures:
             print("All tests passed!")
             return True
         else:
-            print("Some tests failed. Check the errors and revise the code.")
-            for error in result.errors:
-                self.handle_exceptions(error)
-            for failure in result.failures:
-                self.handle_exceptions(failure)
+            print(f"{len(failures)} test(s) failed.")
             return False
 
-    def handle_exceptions(self, test_result):
+    def close(self):
+        """
+        Stop the warm test worker, if there is one.
+        """
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+
+    def record_results(self, test_modules, records):
         """
-        Handle exceptions by sending the traceback to the AI for fixes.
+        Replace the results of re-run test modules with their new records.
         
         Args:
-            test_result (tuple): The test case and the traceback information.
+            test_modules (list): The dotted names of the test modules that were run.
+            records (list): The test records of the run.
         """
-        test_case, tb_info = test_result
-        tb = ''.join(traceback.format_exception(None, tb_info, tb_info.__traceback__))
-        prompt = f"Fix the following error in the code:\n{tb}"
-        fixed_code = self.ai_interaction.generate_code(prompt)
+        rerun = set(test_modules)
+        self.results = {
+            test_id: record for test_id, record in (self.results or {}).items() if record['module'] not in rerun
+        }
+        for record in records:
+            self.results[record['id']] = record
 
-        # Save the fixed code
-        file_name = self.extract_file_name(tb)
-        module_name = os.path.splitext(file_name)[0]
-        CodeGenerator(self.project_name).save_function_code(module_name, "fixed_function", fixed_code)
+    def failures(self):
+        """
+        Return the records of the tests that did not pass in their latest run.
         
-        # Re-run the tests after fixing
-        self.run_tests()
+        Returns:
+            list: The failing test records.
+        """
+        return [
+            record for record in (self.results or {}).values()
+            if record['status'] not in ('passed', 'skipped')
+        ]
 
     def extract_file_name(self, traceback_info):
         """
@@ -71,10 +113,10 @@ class TestRunner:
             traceback_info (str): The traceback information.
         
         Returns:
-            str: The name of the file where the error occurred.
+            str: The name, relative to the project, of the innermost project file in the
+                traceback, where the error occurred.
         """
-        lines = traceback_info.split('\n')
-        for line in lines:
-            if ".py" in line:
-                return line.split('"')[1]
+        frames = ContextBuilder(self.test_dir).project_frames(traceback_info)
+        if frames:
+            return frames[-1][0]
         return "unknown_file.py"
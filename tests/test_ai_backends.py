@@ -0,0 +1,73 @@
+import contextlib
+import unittest
+from unittest import mock
+
+import ai_backends
+from model_registry import ModelRegistry
+from response_cache import ResponseCache
+
+
+class FakeGPT4All:
+    """
+    A stand-in for a gpt4all model that counts the chat sessions it opens.
+    """
+
+    def __init__(self, model, **kwargs):
+        self.sessions = 0
+
+    @contextlib.contextmanager
+    def chat_session(self, system_prompt=None):
+        self.sessions += 1
+        yield
+
+    def generate(self, prompt, max_tokens=200, streaming=False, **options):
+        return 'def answer():\n    return 42\n'
+
+
+class GPT4AllBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        patches = [
+            mock.patch('model_registry.GPT4All', FakeGPT4All),
+            mock.patch.object(ai_backends, 'model_registry', ModelRegistry()),
+            mock.patch.object(ModelRegistry, 'estimate_model_size', return_value=1),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.backend = ai_backends.GPT4AllBackend('fake-model.gguf')
+
+    def test_cache_key_depends_on_max_tokens(self):
+        def key(max_tokens):
+            return ResponseCache.make_key('p', self.backend.name, self.backend.model_name,
+                                          self.backend.generation_params(max_tokens))
+
+        self.assertNotEqual(key(100), key(2000))
+        self.backend.start_session('You write Python code.')
+        self.assertNotEqual(key(100), key(2000))
+
+    def test_packed_calls_keep_the_session(self):
+        self.backend.start_session('You write Python code.')
+        for _ in range(3):
+            # The completion limit of a pack of four items
+            self.backend.generate('Generate the following Python definitions.', max_tokens=500 * 4)
+
+        self.assertEqual(self.backend.model.sessions, 1)
+
+    def test_eviction_keeps_generating_models_and_closes_sessions(self):
+        registry = ai_backends.model_registry
+        registry.memory_budget_bytes = 1
+        self.backend.start_session('You write Python code.')
+        self.backend.generate('Generate a function.', max_tokens=100)
+        session = registry.get_session_state('fake-model.gguf')
+        with registry.get_model_lock('fake-model.gguf'):
+            registry.get_model('other-model.gguf')
+            self.assertIn(registry.make_key('fake-model.gguf'), registry.loaded_models())
+        registry.get_model('third-model.gguf')
+
+        self.assertNotIn(registry.make_key('fake-model.gguf'), registry.loaded_models())
+        self.assertEqual(session, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
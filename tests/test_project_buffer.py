@@ -0,0 +1,31 @@
+import ast
+import unittest
+
+from project_buffer import ModuleBuffer
+
+
+class ModuleBufferMergeTest(unittest.TestCase):
+
+    def test_broken_code_then_valid_code_keeps_earlier_definitions(self):
+        module = ModuleBuffer('calc.py')
+        module.merge("class Calc:\n    pass\n")
+        module.merge("def add(a, b):\n    return a + b\n")
+
+        self.assertFalse(module.merge("def broken(:\n    pass\n"))
+        self.assertTrue(module.merge("def mul(a, b):\n    return a * b\n"))
+
+        ast.parse(module.source)
+        self.assertEqual(list(module.definitions()), ['Calc', 'add', 'mul'])
+        self.assertEqual(module.rejected, ["def broken(:\n    pass\n"])
+
+    def test_module_that_does_not_parse_is_merged_by_definition(self):
+        module = ModuleBuffer('calc.py', "import os\n\n\ndef add(a, b:\n    return a + b\n\n\ndef sub(a, b):\n    return a - b\n")
+
+        module.merge("import sys\n\n\ndef add(a, b):\n    return a + b\n\n\ndef mul(a, b):\n    return a * b\n")
+
+        self.assertEqual(list(module.definitions()), ['add', 'sub', 'mul'])
+        self.assertIn("import sys", module.source)
+
+
+if __name__ == '__main__':
+    unittest.main()